@@ -0,0 +1,87 @@
+### Description
+# Benchmark of the binning steps in src/data_preparation.py.
+# Compares the original row-by-row Series.apply(lambda ...) chains with the vectorized
+# bin_counts layer on 36k (the size of the raw dataset), 1M and 10M rows.
+# The rows are sampled with replacement from the raw dataset, so the value distributions
+# match the real data. Before timing, the outputs of both versions are checked to be identical.
+# The script can be executed from the command line using the following command:
+# python benchmarks/bench_binning.py [--rows 36275 1000000 10000000] [--repeat 3]
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from data_preparation import bin_counts, WEEKEND_NIGHTS_LABELS, WEEK_NIGHTS_LABELS, SPECIAL_REQUESTS_LABELS
+
+RAW_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'raw', 'hotel_reservations.csv')
+COLUMNS = ['no_of_children', 'no_of_weekend_nights', 'no_of_week_nights', 'no_of_special_requests']
+DEFAULT_ROWS = [36275, 1000000, 10000000]
+
+def make_data(raw: pd.DataFrame, n_rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    data = {}
+    for column in COLUMNS:
+        data[column] = rng.choice(raw[column].to_numpy(), size=n_rows, replace=True)
+    return pd.DataFrame(data)
+
+def legacy_binning(data: pd.DataFrame) -> pd.DataFrame:
+    # The lambdas from the original version of data_preparation.py
+    data = data.copy()
+    data['with_children'] = data['no_of_children'].apply(lambda x: 1 if x > 0 else 0)
+    data['no_of_weekend_nights'] = data['no_of_weekend_nights'].apply(lambda x: '0' if x == 0 else '1' if x == 1 else '2' if x == 2 else '3+')
+    data['no_of_weekend_nights'] = data['no_of_weekend_nights'].astype('category')
+    data['no_of_week_nights'] = data['no_of_week_nights'].astype('category')
+    data['no_of_week_nights'] = data['no_of_week_nights'].apply(lambda x: '0' if x == 0 else '1' if x == 1 else '2' if x == 2 else '3' if x == 3 else '4' if x == 4 else '5' if x == 5 else '6+')
+    data['no_of_special_requests'] = data['no_of_special_requests'].apply(lambda x: '0' if x == 0 else '1' if x == 1 else '2+' if x >= 2 else 'Unknown')
+    data['no_of_special_requests'] = data['no_of_special_requests'].astype('category')
+    return data
+
+def vectorized_binning(data: pd.DataFrame) -> pd.DataFrame:
+    data = data.copy()
+    data['with_children'] = (data['no_of_children'] > 0).astype(np.int64)
+    data['no_of_weekend_nights'] = bin_counts(data['no_of_weekend_nights'], WEEKEND_NIGHTS_LABELS)
+    data['no_of_week_nights'] = bin_counts(data['no_of_week_nights'], WEEK_NIGHTS_LABELS)
+    data['no_of_special_requests'] = bin_counts(data['no_of_special_requests'], SPECIAL_REQUESTS_LABELS, unknown_label='Unknown')
+    return data
+
+def encode(data: pd.DataFrame) -> pd.DataFrame:
+    return pd.get_dummies(data, columns=['no_of_weekend_nights', 'no_of_week_nights', 'no_of_special_requests'], drop_first=True, dtype=np.int64)
+
+def best_time(function, data: pd.DataFrame, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(data)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the binning steps of the data preparation script')
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS, help='Number of rows to benchmark')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of repetitions, the best time is reported')
+    args = parser.parse_args()
+
+    raw = pd.read_csv(RAW_FILE_PATH, usecols=COLUMNS)
+
+    print('{:>10} {:>12} {:>12} {:>10}'.format('rows', 'legacy [s]', 'vector [s]', 'speedup'))
+    for n_rows in args.rows:
+        data = make_data(raw, n_rows)
+
+        # Both versions have to produce the same encoded frame
+        expected = encode(legacy_binning(data))
+        actual = encode(vectorized_binning(data))
+        pd.testing.assert_frame_equal(expected, actual)
+        del expected, actual
+
+        legacy_time = best_time(legacy_binning, data, args.repeat)
+        vectorized_time = best_time(vectorized_binning, data, args.repeat)
+        print('{:>10} {:>12.4f} {:>12.4f} {:>9.1f}x'.format(n_rows, legacy_time, vectorized_time, legacy_time / vectorized_time))
+
+if __name__ == '__main__':
+    main()
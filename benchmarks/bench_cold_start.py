@@ -0,0 +1,69 @@
+### Description
+# Benchmark of the cold start of the production service: the time from starting 'bentoml serve' until the first
+# successful /predict_from_record response, with the fast start from the memory-mappable forest artifact
+# (hotel_booking_model_1.forest next to serve_model.py, written by store_model.py) and with the pickled sklearn model.
+# Every mode is started several times and the median is reported together with the startup phases the service prints.
+# The script can be executed from the command line using the following command:
+# python benchmarks/bench_cold_start.py [--runs 5]
+# The forest artifact has to be in src/production (run store_model.py there), otherwise both modes load the pickled model.
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import numpy as np
+import pandas as pd
+
+from load_test_predict_record import MODEL_COLUMNS, PRODUCTION_PATH, TEST_FILE_PATH
+
+MODES = {
+    'forest artifact': {'PREDICT_ENGINE': 'flat'},
+    'pickled model': {'PREDICT_ENGINE': 'flat', 'MODEL_ARTIFACT_PATH': os.devnull},
+    'sklearn only': {'PREDICT_ENGINE': 'sklearn'},
+}
+
+def time_to_first_prediction(port: int, environment: dict, record: dict, timeout: float = 120.0) -> tuple:
+    url = 'http://localhost:{}/predict_from_record'.format(port)
+    with tempfile.TemporaryFile(mode='w+') as log:
+        start = time.perf_counter()
+        service = subprocess.Popen(
+            [sys.executable, '-m', 'bentoml', 'serve', 'serve_model:ProductionService', '--port', str(port)],
+            cwd=PRODUCTION_PATH, env=dict(os.environ, **environment), stdout=log, stderr=subprocess.STDOUT,
+        )
+        try:
+            while True:
+                if time.perf_counter() - start > timeout:
+                    raise TimeoutError('No prediction within {} s'.format(timeout))
+                try:
+                    if httpx.post(url, json={'input': [record]}, timeout=5.0).status_code == 200:
+                        elapsed = time.perf_counter() - start
+                        break
+                except httpx.HTTPError:
+                    pass
+                time.sleep(0.02)
+        finally:
+            service.terminate()
+            service.wait()
+        log.seek(0)
+        startup = [line.strip() for line in log if 'Startup ' in line]
+    return elapsed, startup[-1] if startup else ''
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Time to first prediction of the production service')
+    parser.add_argument('--runs', type=int, default=5, help='Number of starts of every mode')
+    parser.add_argument('--port', type=int, default=3110, help='Port the service is started on')
+    args = parser.parse_args()
+
+    record = pd.read_csv(TEST_FILE_PATH, usecols=MODEL_COLUMNS, nrows=1)[MODEL_COLUMNS].to_dict(orient='records')[0]
+    print('{:<16} {:>12} {:>12}  {}'.format('mode', 'median [s]', 'min [s]', 'startup phases (last run)'))
+    for mode, environment in MODES.items():
+        results = [time_to_first_prediction(args.port, environment, record) for _ in range(args.runs)]
+        seconds = np.array([elapsed for elapsed, _ in results])
+        print('{:<16} {:>12.2f} {:>12.2f}  {}'.format(mode, np.median(seconds), seconds.min(), results[-1][1]))
+
+if __name__ == '__main__':
+    main()
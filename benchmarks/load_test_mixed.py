@@ -0,0 +1,100 @@
+### Description
+# Load test of the production service with mixed traffic: single-record /predict_from_record requests while CSV files
+# are uploaded at the same time, to check that the uploads do not starve the record requests.
+# The record clients run in a closed loop for a fixed duration in three phases: without uploads, with concurrent
+# uploads to the sync /predict_from_file endpoint and with concurrent uploads to /predict_from_file_async.
+# For every phase the p50/p99 latency and the requests per second of the records and the number and mean latency
+# of the uploads are reported. The uploaded file is the test data repeated to the given number of rows.
+# The script can be executed from the command line using the following command:
+# python benchmarks/load_test_mixed.py [--concurrency 16] [--uploads 2] [--file-rows 50000] [--duration 20]
+# A running service can be tested instead with --url http://localhost:3000.
+
+import argparse
+import asyncio
+import tempfile
+import time
+
+import httpx
+import numpy as np
+import pandas as pd
+
+from load_test_predict_record import MODEL_COLUMNS, TEST_FILE_PATH, client, start_service, wait_until_ready
+
+PHASES = [
+    ('records only', None),
+    ('+ sync uploads', '/predict_from_file'),
+    ('+ async uploads', '/predict_from_file_async'),
+]
+
+async def uploader(http: httpx.AsyncClient, url: str, content: bytes, stop_time: float, latencies: list, errors: list) -> None:
+    while time.monotonic() < stop_time:
+        start = time.perf_counter()
+        try:
+            response = await http.post(url, files={'file': ('bookings.csv', content, 'text/csv')})
+            response.raise_for_status()
+            if 'error' in response.json():
+                raise httpx.HTTPError(response.json()['error'])
+            latencies.append(time.perf_counter() - start)
+        except httpx.HTTPError:
+            errors.append(time.perf_counter() - start)
+
+async def run_phase(url: str, records: list, concurrency: int, duration: float, upload_route: str, uploads: int, content: bytes) -> dict:
+    latencies, errors = [], []
+    upload_latencies, upload_errors = [], []
+    limits = httpx.Limits(max_connections=concurrency + uploads, max_keepalive_connections=concurrency + uploads)
+    async with httpx.AsyncClient(limits=limits, timeout=120.0) as http:
+        await asyncio.gather(*[http.post(url + '/predict_from_record', json={'input': [records[i]]}) for i in range(concurrency)])
+        start = time.monotonic()
+        stop_time = start + duration
+        tasks = [client(http, url, records, i, stop_time, latencies, errors) for i in range(concurrency)]
+        if upload_route is not None:
+            tasks += [uploader(http, url + upload_route, content, stop_time, upload_latencies, upload_errors) for _ in range(uploads)]
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - start
+    latencies = np.array(latencies) * 1000.0
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'requests_per_second': len(latencies) / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else float('nan'),
+        'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else float('nan'),
+        'uploads': len(upload_latencies),
+        'upload_errors': len(upload_errors),
+        'upload_mean_s': float(np.mean(upload_latencies)) if upload_latencies else float('nan'),
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Load test of /predict_from_record with concurrent file uploads')
+    parser.add_argument('--concurrency', type=int, default=16, help='Number of concurrent record clients')
+    parser.add_argument('--uploads', type=int, default=2, help='Number of concurrent upload clients')
+    parser.add_argument('--file-rows', type=int, default=50000, help='Rows of the uploaded file')
+    parser.add_argument('--duration', type=float, default=20.0, help='Duration of every phase in seconds')
+    parser.add_argument('--port', type=int, default=3120, help='Port the service is started on')
+    parser.add_argument('--url', default=None, help='Test an already running service instead of starting one')
+    args = parser.parse_args()
+
+    test = pd.read_csv(TEST_FILE_PATH)
+    records = test[MODEL_COLUMNS].to_dict(orient='records')
+    data = pd.concat([test] * (args.file_rows // len(test) + 1), ignore_index=True).iloc[:args.file_rows]
+    with tempfile.TemporaryFile(mode='w+b') as file:
+        data.to_csv(file, index=False)
+        file.seek(0)
+        content = file.read()
+
+    url = args.url or 'http://localhost:{}'.format(args.port)
+    service = None if args.url else start_service(args.port, {})
+    try:
+        wait_until_ready(url)
+        print('{:<16} {:>9} {:>7} {:>9} {:>9} {:>9} {:>8} {:>14}'.format('phase', 'requests', 'errors', 'req/s', 'p50 [ms]', 'p99 [ms]', 'uploads', 'upload [s]'))
+        for phase, upload_route in PHASES:
+            result = asyncio.run(run_phase(url, records, args.concurrency, args.duration, upload_route, args.uploads, content))
+            print('{:<16} {:>9} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>8} {:>14.2f}'.format(
+                phase, result['requests'], result['errors'], result['requests_per_second'], result['p50_ms'], result['p99_ms'],
+                '{}/{}'.format(result['uploads'], result['upload_errors']), result['upload_mean_s']))
+    finally:
+        if service is not None:
+            service.terminate()
+            service.wait()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+### Description
+# Load test of the /predict_from_record endpoint of the production service with micro-batching on and off.
+# For every mode the service is started from src/production (the model 'hotel_booking_model_1' has to be in the
+# local BentoML store, see store_model.py), then a number of concurrent clients send single-record requests in a
+# closed loop for a fixed duration. The p50/p99 latency and the requests per second are reported for every mode.
+# The script can be executed from the command line using the following command:
+# python benchmarks/load_test_predict_record.py [--concurrency 32] [--duration 20]
+# A running service can be tested instead with --url http://localhost:3000 (a single mode is tested then).
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+import pandas as pd
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+PRODUCTION_PATH = os.path.join(ROOT_PATH, 'src', 'production')
+TEST_FILE_PATH = os.path.join(ROOT_PATH, 'data', 'ml', 'hotel_reservations_test.csv')
+
+sys.path.append(PRODUCTION_PATH)
+from features import MODEL_COLUMNS
+
+def start_service(port: int, environment: dict) -> subprocess.Popen:
+    env = dict(os.environ, **environment)
+    return subprocess.Popen(
+        [sys.executable, '-m', 'bentoml', 'serve', 'serve_model:ProductionService', '--port', str(port)],
+        cwd=PRODUCTION_PATH, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+def wait_until_ready(url: str, timeout: float = 120.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url + '/readyz', timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError('The service at {} did not become ready in {} s'.format(url, timeout))
+
+async def client(http: httpx.AsyncClient, url: str, records: list, offset: int, stop_time: float, latencies: list, errors: list) -> None:
+    i = offset
+    while time.monotonic() < stop_time:
+        record = records[i % len(records)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            response = await http.post(url + '/predict_from_record', json={'input': [record]})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+        except httpx.HTTPError:
+            errors.append(time.perf_counter() - start)
+
+async def run_load(url: str, records: list, concurrency: int, duration: float) -> dict:
+    latencies = []
+    errors = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30.0) as http:
+        # Warm up the connections and the model before measuring
+        await asyncio.gather(*[http.post(url + '/predict_from_record', json={'input': [records[i]]}) for i in range(concurrency)])
+        start = time.monotonic()
+        stop_time = start + duration
+        await asyncio.gather(*[client(http, url, records, i, stop_time, latencies, errors) for i in range(concurrency)])
+        elapsed = time.monotonic() - start
+    latencies = np.array(latencies) * 1000.0
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'requests_per_second': len(latencies) / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else float('nan'),
+        'p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else float('nan'),
+    }
+
+def print_result(mode: str, result: dict) -> None:
+    print('{:<14} {:>9} {:>7} {:>10.1f} {:>9.1f} {:>9.1f}'.format(
+        mode, result['requests'], result['errors'], result['requests_per_second'], result['p50_ms'], result['p99_ms']))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Load test of /predict_from_record with micro-batching on and off')
+    parser.add_argument('--concurrency', type=int, default=32, help='Number of concurrent clients')
+    parser.add_argument('--duration', type=float, default=20.0, help='Duration of every run in seconds')
+    parser.add_argument('--port', type=int, default=3100, help='Port the service is started on')
+    parser.add_argument('--max-batch-size', type=int, default=64, help='PREDICT_MAX_BATCH_SIZE of the service')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0, help='PREDICT_MAX_WAIT_MS of the service')
+    parser.add_argument('--url', default=None, help='Test an already running service instead of starting one')
+    args = parser.parse_args()
+
+    records = pd.read_csv(TEST_FILE_PATH, usecols=MODEL_COLUMNS)[MODEL_COLUMNS].to_dict(orient='records')
+
+    print('{:<14} {:>9} {:>7} {:>10} {:>9} {:>9}'.format('mode', 'requests', 'errors', 'req/s', 'p50 [ms]', 'p99 [ms]'))
+    if args.url is not None:
+        print_result('external', asyncio.run(run_load(args.url, records, args.concurrency, args.duration)))
+        return
+
+    url = 'http://localhost:{}'.format(args.port)
+    modes = [
+        ('batching off', {'PREDICT_BATCHING': '0'}),
+        ('batching on', {'PREDICT_BATCHING': '1', 'PREDICT_MAX_BATCH_SIZE': str(args.max_batch_size), 'PREDICT_MAX_WAIT_MS': str(args.max_wait_ms)}),
+    ]
+    for mode, environment in modes:
+        service = start_service(args.port, environment)
+        try:
+            wait_until_ready(url)
+            print_result(mode, asyncio.run(run_load(url, records, args.concurrency, args.duration)))
+        finally:
+            service.terminate()
+            service.wait()
+
+if __name__ == '__main__':
+    main()
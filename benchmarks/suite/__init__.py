@@ -0,0 +1,9 @@
+### Description
+# Benchmark suite of the data preparation pipeline and the serving path of the production service.
+# synthetic.py generates raw bookings with the schema of data/raw/hotel_reservations.csv at any number of rows,
+# pipeline.py times every stage of the in-memory pipeline of src/data_preparation.py with its peak memory,
+# predict.py times the encoding of raw records and the predictions of the model at batch sizes from 1 to 100k rows
+# and results.py stores the results as JSON and compares them against a baseline.
+# The suite is executed from the root of the repository, see __main__.py:
+# python -m benchmarks.suite run --rows 10000 100000 1000000 --output results.json
+# python -m benchmarks.suite compare baseline.json results.json
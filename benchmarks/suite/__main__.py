@@ -0,0 +1,90 @@
+### Description
+# Command line of the benchmark suite, executed from the root of the repository:
+# python -m benchmarks.suite generate --rows 1000000 --output bookings.csv
+# python -m benchmarks.suite run [--rows 10000 100000 1000000 10000000] [--benchmarks pipeline predict] --output results.json
+# python -m benchmarks.suite run --output results.json --baseline baseline.json [--tolerance 0.1]
+# python -m benchmarks.suite compare baseline.json results.json [--tolerance 0.1]
+# The generated raw files are kept in data/benchmarks and reused by the next runs with the same rows and seed.
+# 'run' and 'compare' exit with status 1 when a result regressed against the baseline.
+
+import argparse
+import os
+import sys
+
+from .pipeline import benchmark_pipeline
+from .predict import BATCH_SIZES, ENGINES, benchmark_predict, load_model
+from .results import compare_results, format_key, load_results, print_comparison, save_results
+from .synthetic import ROOT_PATH, bookings_file, generate_bookings, write_bookings
+
+DATA_DIR = os.path.join(ROOT_PATH, 'data', 'benchmarks')
+DEFAULT_ROWS = [10000, 100000, 1000000]
+
+def run(args) -> list:
+    results = []
+    if 'pipeline' in args.benchmarks:
+        for n_rows in args.rows:
+            raw_file_path = bookings_file(args.data_dir, n_rows, args.seed)
+            print('Pipeline on {} rows...'.format(n_rows), flush=True)
+            for result in benchmark_pipeline(raw_file_path, n_rows, args.format):
+                results.append(result)
+                print('  {:<12} {:>10.3f} s {:>10.1f} MB'.format(result['stage'], result['seconds'], result['peak_memory_mb']), flush=True)
+    if 'predict' in args.benchmarks:
+        print('Predict at batch sizes {}...'.format(args.batch_sizes), flush=True)
+        # A few more bookings than the largest batch, the rows with categories the service rejects are left out
+        bookings = generate_bookings(int(max(args.batch_sizes) * 1.05) + 100, args.seed)
+        model = load_model(args.model_tag) if args.model_tag else None
+        for result in benchmark_predict(bookings, model, args.batch_sizes, args.engines, args.min_time):
+            results.append(result)
+            print('  {:<10} {:>7} rows {:>12.6f} s {:>12.0f} rows/s'.format(result['engine'], result['batch_size'], result['seconds'], result['rows_per_second']), flush=True)
+    return results
+
+def compare(baseline_path: str, current: dict, tolerance: float) -> int:
+    comparisons = compare_results(load_results(baseline_path), current, tolerance)
+    print_comparison(comparisons)
+    regressions = [comparison for comparison in comparisons if comparison['regression']]
+    for comparison in regressions:
+        print('Regression: {} {} {:.4f} -> {:.4f}'.format(format_key(comparison['key']), comparison['metric'], comparison['baseline'], comparison['current']))
+    return 1 if regressions else 0
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.suite', description='Benchmarks of the data preparation and serving paths')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = commands.add_parser('generate', help='Generate synthetic raw bookings')
+    generate_parser.add_argument('--rows', type=int, required=True, help='Number of bookings')
+    generate_parser.add_argument('--seed', type=int, default=0, help='Seed of the generator')
+    generate_parser.add_argument('--output', required=True, help='CSV file the bookings are written to')
+
+    run_parser = commands.add_parser('run', help='Run the benchmarks and save the results as JSON')
+    run_parser.add_argument('--benchmarks', nargs='+', choices=['pipeline', 'predict'], default=['pipeline', 'predict'], help='Benchmarks to run')
+    run_parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS, help='Numbers of raw rows of the pipeline benchmark')
+    run_parser.add_argument('--format', default='csv', help='Format the processed data is saved in')
+    run_parser.add_argument('--batch-sizes', type=int, nargs='+', default=BATCH_SIZES, help='Batch sizes of the predict benchmark')
+    run_parser.add_argument('--engines', nargs='+', choices=ENGINES, default=ENGINES, help='Engines of the predict benchmark')
+    run_parser.add_argument('--min-time', type=float, default=0.5, help='Minimum time every batch size is called for, in seconds')
+    run_parser.add_argument('--model-tag', default=None, help='BentoML model to predict with instead of a model trained on data/ml')
+    run_parser.add_argument('--seed', type=int, default=0, help='Seed of the generator')
+    run_parser.add_argument('--data-dir', default=DATA_DIR, help='Directory of the generated raw files')
+    run_parser.add_argument('--output', required=True, help='JSON file the results are saved to')
+    run_parser.add_argument('--baseline', default=None, help='JSON results of a previous run to compare against')
+    run_parser.add_argument('--tolerance', type=float, default=0.1, help='Relative slowdown reported as a regression')
+
+    compare_parser = commands.add_parser('compare', help='Compare saved results against a baseline')
+    compare_parser.add_argument('baseline', help='JSON results of the baseline')
+    compare_parser.add_argument('current', help='JSON results to compare')
+    compare_parser.add_argument('--tolerance', type=float, default=0.1, help='Relative slowdown reported as a regression')
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        write_bookings(args.output, args.rows, args.seed)
+        return 0
+    if args.command == 'compare':
+        return compare(args.baseline, load_results(args.current), args.tolerance)
+    save_results(args.output, run(args))
+    print('Results saved to {}'.format(args.output))
+    if args.baseline:
+        return compare(args.baseline, load_results(args.output), args.tolerance)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+### Description
+# Benchmark of the stages of the in-memory data preparation pipeline (python src/data_preparation.py).
+# The stages of PIPELINE_STAGES (load, rules, iqr, encode, iso_forest, feb_29) are run in order on a generated raw
+# file, with the default parameters of main() and without the stage cache, followed by saving the processed data.
+# Every stage reports its wall time and the peak resident memory of the process while it ran, sampled in a
+# background thread, and how much the peak grew over the memory at the start of the stage.
+# Every number of rows is benchmarked in a new process, so the memory of one run does not affect the next one.
+
+import contextlib
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src'))
+
+import data_preparation
+from data_preparation import PIPELINE_STAGES, save_data
+
+MEMORY_SAMPLE_INTERVAL = 0.005
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def rss_bytes() -> int:
+    # Current resident memory of the process, or its peak so far where /proc is not available
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+class PeakMemory():
+    def __init__(self, interval: float = MEMORY_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.start_bytes = 0
+        self.peak_bytes = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.peak_bytes = max(self.peak_bytes, rss_bytes())
+
+    def __enter__(self) -> 'PeakMemory':
+        self.start_bytes = self.peak_bytes = rss_bytes()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stopped.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, rss_bytes())
+
+def default_parameters(raw_file_path: str) -> dict:
+    # The parameters main() of data_preparation.py passes to the pipeline without any options, the synthetic raw
+    # file has no appended rows
+    return {
+        'raw_file_path': raw_file_path,
+        'appended_file_path': None,
+        'max_price': float(data_preparation.MAX_PRICE_PER_ROOM),
+        'iqr_factor': float(data_preparation.IQR_FACTOR),
+        'contamination': float(data_preparation.ISO_FOREST_CONTAMINATION),
+        'random_state': data_preparation.ISO_FOREST_RANDOM_STATE,
+        'iso_forest_max_rows': None,
+        'n_jobs': None,
+        'score_workers': 1,
+    }
+
+def run_stages(raw_file_path: str, parameters: dict = None, output_format: str = 'csv') -> list:
+    parameters = default_parameters(raw_file_path) if parameters is None else parameters
+    results = []
+    outputs = {}
+    def measure(name: str, function, *arguments):
+        # The pipeline prints its progress, which is not part of the benchmark
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), PeakMemory() as memory:
+            start = time.perf_counter()
+            value = function(*arguments)
+            seconds = time.perf_counter() - start
+        results.append({
+            'stage': name,
+            'seconds': seconds,
+            'peak_memory_mb': memory.peak_bytes / 2 ** 20,
+            'memory_increase_mb': (memory.peak_bytes - memory.start_bytes) / 2 ** 20,
+        })
+        return value
+    for name, (inputs, parameter_names, function) in PIPELINE_STAGES.items():
+        arguments = [outputs[stage] for stage in inputs] + [parameters[parameter] for parameter in parameter_names]
+        outputs[name] = measure(name, function, *arguments)
+    data, _ = outputs['feb_29']
+    with tempfile.TemporaryDirectory() as directory:
+        measure('save', save_data, data, os.path.join(directory, 'processed.' + output_format), output_format)
+    results.append({
+        'stage': 'total',
+        'seconds': sum(result['seconds'] for result in results),
+        'peak_memory_mb': max(result['peak_memory_mb'] for result in results),
+        'rows_out': len(data),
+    })
+    return results
+
+def benchmark_pipeline(raw_file_path: str, n_rows: int, output_format: str = 'csv') -> list:
+    # Every stage of one run in a new process, as {'benchmark': 'pipeline', 'rows': ..., 'stage': ..., ...}
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+        results = executor.submit(run_stages, raw_file_path, None, output_format).result()
+    return [dict({'benchmark': 'pipeline', 'rows': n_rows}, **result) for result in results]
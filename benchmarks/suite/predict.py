@@ -0,0 +1,87 @@
+### Description
+# Benchmark of the serving path of the production service at batch sizes from 1 to 100k rows.
+# The raw bookings are encoded with the RawFeatureTransformer of /predict_raw ('transform') and predicted with both
+# engines of serve_model.py, the sklearn model ('sklearn', on a DataFrame with the model columns like the service)
+# and the flattened forest ('flat'). Every batch size is called repeatedly for at least 'min_time' seconds and the
+# median time of a call is reported, with the rows per second it corresponds to.
+# By default the model is trained on data/ml/hotel_reservations_train.csv with the parameters of store_model.py,
+# so the results do not depend on the models in the local BentoML model store, a stored model can be used instead.
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+sys.path.insert(0, os.path.join(ROOT_PATH, 'src'))
+sys.path.insert(0, os.path.join(ROOT_PATH, 'src', 'production'))
+
+from data_preparation import feature_spec
+from features import MODEL_COLUMNS, RawFeatureTransformer
+from forest import FlatForest
+
+TRAIN_FILE_PATH = os.path.join(ROOT_PATH, 'data', 'ml', 'hotel_reservations_train.csv')
+BATCH_SIZES = [1, 10, 100, 1000, 10000, 100000]
+ENGINES = ['transform', 'sklearn', 'flat']
+
+def train_model(file_path: str = TRAIN_FILE_PATH):
+    from sklearn.ensemble import RandomForestClassifier
+
+    data = pd.read_csv(file_path)
+    model = RandomForestClassifier(n_estimators=100, max_features='sqrt', random_state=42)
+    model.fit(data[MODEL_COLUMNS], data['booking_status'])
+    return model
+
+def load_model(tag: str):
+    import bentoml
+
+    return bentoml.sklearn.load_model(tag)
+
+def raw_records(bookings: pd.DataFrame, transformer: RawFeatureTransformer) -> list:
+    # Records with categories the transformer does not know are rejected by the service, they are left out
+    accepted = np.ones(len(bookings), dtype=bool)
+    for field, codes in transformer.category_codes.items():
+        accepted &= bookings[field].isin(list(codes)).to_numpy()
+    return bookings[accepted].to_dict('records')
+
+def time_call(function, argument, min_time: float, min_repeat: int = 3, max_repeat: int = 1000) -> float:
+    function(argument)
+    times = []
+    total = 0.0
+    while len(times) < min_repeat or (total < min_time and len(times) < max_repeat):
+        start = time.perf_counter()
+        function(argument)
+        times.append(time.perf_counter() - start)
+        total += times[-1]
+    return float(np.median(times))
+
+def benchmark_predict(bookings: pd.DataFrame, model=None, batch_sizes: list = BATCH_SIZES, engines: list = ENGINES, min_time: float = 0.5) -> list:
+    model = train_model() if model is None else model
+    forest = FlatForest.from_sklearn(model)
+    transformer = RawFeatureTransformer(feature_spec(MODEL_COLUMNS))
+    records = raw_records(bookings, transformer)
+    if len(records) < max(batch_sizes):
+        raise ValueError('Expected at least {} accepted records, got {}'.format(max(batch_sizes), len(records)))
+    features = transformer.transform(records[:max(batch_sizes)])
+    calls = {
+        'transform': lambda batch: transformer.transform(records[:batch]),
+        'sklearn': lambda batch: model.predict(pd.DataFrame(features[:batch], columns=MODEL_COLUMNS)),
+        'flat': lambda batch: forest.predict(features[:batch]),
+    }
+    # Both engines have to predict the same classes
+    if not np.array_equal(calls['sklearn'](len(features)), calls['flat'](len(features))):
+        raise AssertionError('The flattened forest does not match the sklearn model')
+    results = []
+    for engine in engines:
+        for batch_size in batch_sizes:
+            seconds = time_call(calls[engine], batch_size, min_time)
+            results.append({
+                'benchmark': 'predict',
+                'engine': engine,
+                'batch_size': batch_size,
+                'seconds': seconds,
+                'rows_per_second': batch_size / seconds,
+            })
+    return results
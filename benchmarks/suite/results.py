@@ -0,0 +1,88 @@
+### Description
+# Results of the benchmark suite as JSON and their comparison against a stored baseline.
+# A results file holds the environment the suite ran in (versions, platform, cores and the git commit) and a list
+# of results, each identified by its benchmark and parameters (e.g. the stage and the rows of the pipeline, or the
+# engine and the batch size of predict). A result of the new run is a regression when one of its metrics, where
+# lower is better, exceeds the baseline by more than the tolerance and by more than the absolute noise floor.
+
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+
+# Fields identifying a result, the other fields are metrics or additional information
+KEY_FIELDS = ['benchmark', 'rows', 'stage', 'engine', 'batch_size']
+# Metrics compared against the baseline, lower is better, with their absolute noise floor
+METRICS = {
+    'seconds': 0.001,
+    'peak_memory_mb': 16.0,
+}
+
+def environment() -> dict:
+    import numpy
+    import pandas
+    import sklearn
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': sys.version.split()[0],
+        'numpy': numpy.__version__,
+        'pandas': pandas.__version__,
+        'sklearn': sklearn.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+def save_results(file_path: str, results: list) -> None:
+    with open(file_path, 'w') as file:
+        json.dump({'environment': environment(), 'results': results}, file, indent=2)
+
+def load_results(file_path: str) -> dict:
+    with open(file_path) as file:
+        return json.load(file)
+
+def result_key(result: dict) -> tuple:
+    return tuple((field, result[field]) for field in KEY_FIELDS if field in result)
+
+def compare_results(baseline: dict, current: dict, tolerance: float = 0.1) -> list:
+    # One comparison per metric of every result found in both runs, as dicts with the ratio current / baseline
+    baseline_results = {result_key(result): result for result in baseline['results']}
+    comparisons = []
+    for result in current['results']:
+        previous = baseline_results.get(result_key(result))
+        if previous is None:
+            continue
+        for metric, noise_floor in METRICS.items():
+            if metric not in result or metric not in previous:
+                continue
+            old, new = previous[metric], result[metric]
+            comparisons.append({
+                'key': dict(result_key(result)),
+                'metric': metric,
+                'baseline': old,
+                'current': new,
+                'ratio': new / old if old else float('inf'),
+                'regression': new > old * (1 + tolerance) and new - old > noise_floor,
+            })
+    return comparisons
+
+def format_key(key: dict) -> str:
+    return ' '.join('{}={}'.format(field, value) for field, value in key.items())
+
+def print_comparison(comparisons: list) -> None:
+    print('{:<60} {:<15} {:>12} {:>12} {:>8}'.format('result', 'metric', 'baseline', 'current', 'ratio'))
+    for comparison in comparisons:
+        print('{:<60} {:<15} {:>12.4f} {:>12.4f} {:>7.2f}x{}'.format(
+            format_key(comparison['key']), comparison['metric'], comparison['baseline'], comparison['current'],
+            comparison['ratio'], '  REGRESSION' if comparison['regression'] else '',
+        ))
+    regressions = sum(comparison['regression'] for comparison in comparisons)
+    print('{} regressions in {} comparisons'.format(regressions, len(comparisons)))
@@ -0,0 +1,63 @@
+### Description
+# Generator of synthetic raw bookings with the schema of data/raw/hotel_reservations.csv.
+# The values are sampled with replacement from the raw dataset, so the value distributions (including the rare
+# values the cleaning rules drop) match the real data at any number of rows. The columns that depend on each other
+# are sampled together from the same raw row: the arrival date, the guests and the nights of a booking.
+# The rows are generated in chunks, so files with 10^7 rows are written without holding them in memory.
+# A file can be generated from the command line using the following command:
+# python -m benchmarks.suite generate --rows 1000000 --output bookings.csv
+
+import os
+
+import numpy as np
+import pandas as pd
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+RAW_FILE_PATH = os.path.join(ROOT_PATH, 'data', 'raw', 'hotel_reservations.csv')
+# Changing the generator changes the generated files, the version is part of their names
+GENERATOR_VERSION = 1
+CHUNK_ROWS = 1000000
+
+# Columns sampled together from the same raw row, every other column is sampled on its own
+COLUMN_GROUPS = [
+    ['arrival_year', 'arrival_month', 'arrival_date'],
+    ['no_of_adults', 'no_of_children'],
+    ['no_of_weekend_nights', 'no_of_week_nights'],
+]
+
+def load_raw(file_path: str = RAW_FILE_PATH) -> pd.DataFrame:
+    return pd.read_csv(file_path)
+
+def generate_chunks(raw: pd.DataFrame, n_rows: int, seed: int = 0, chunk_rows: int = CHUNK_ROWS):
+    rng = np.random.default_rng(seed)
+    grouped = {column for group in COLUMN_GROUPS for column in group}
+    groups = COLUMN_GROUPS + [[column] for column in raw.columns if column != 'Booking_ID' and column not in grouped]
+    for start in range(0, n_rows, chunk_rows):
+        size = min(chunk_rows, n_rows - start)
+        columns = {'Booking_ID': ['INN{:08d}'.format(i) for i in range(start + 1, start + size + 1)]}
+        for group in groups:
+            rows = rng.integers(0, len(raw), size=size)
+            for column in group:
+                columns[column] = raw[column].to_numpy()[rows]
+        yield pd.DataFrame(columns)[list(raw.columns)]
+
+def generate_bookings(n_rows: int, seed: int = 0, raw: pd.DataFrame = None) -> pd.DataFrame:
+    raw = load_raw() if raw is None else raw
+    return pd.concat(generate_chunks(raw, n_rows, seed), ignore_index=True)
+
+def write_bookings(file_path: str, n_rows: int, seed: int = 0, raw: pd.DataFrame = None) -> str:
+    raw = load_raw() if raw is None else raw
+    with open(file_path, 'w', newline='') as file:
+        for i, chunk in enumerate(generate_chunks(raw, n_rows, seed)):
+            chunk.to_csv(file, header=i == 0, index=False)
+    return file_path
+
+def bookings_file(directory: str, n_rows: int, seed: int = 0) -> str:
+    # Path of the generated file with the given number of rows, generated only if it does not exist yet
+    os.makedirs(directory, exist_ok=True)
+    file_path = os.path.join(directory, 'bookings_v{}_{}_{}.csv'.format(GENERATOR_VERSION, n_rows, seed))
+    if not os.path.exists(file_path):
+        temporary_path = file_path + '.tmp'
+        write_bookings(temporary_path, n_rows, seed)
+        os.replace(temporary_path, file_path)
+    return file_path
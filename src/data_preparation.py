@@ -36,329 +36,646 @@
 # The processed data is saved in the 'data/processed' directory as 'hotel_reservations.csv'
 # The script can be executed from the command line using the following command:
 # python src/data_preparation.py
+# The processed data can also be saved in a columnar format with compact dtypes (Parquet or Feather/Arrow IPC),
+# next to the CSV file with the matching extension, see src/production/columnar.py:
+# python src/data_preparation.py --format feather
+# Raw files that do not fit in memory can be processed in streaming mode, in chunks of the given number of rows:
+# python src/data_preparation.py --chunksize 100000
+# In streaming mode the row-local steps are applied chunk by chunk and the chunks are appended to the output.
+# The global steps are computed separately: the IQR bounds of 'avg_price_per_room' from the counts of its
+# distinct values collected in a first pass, and the Isolation Forest on a uniform sample of the rows.
+# The row filters (steps 7, 8, 10, 13, 24, 25 and the IQR filter) are declared in the row_rules table. They are
+# evaluated on the raw columns into one boolean mask, and the encoded frame is built once from the kept rows.
+# The Isolation Forest and the February 29 filter are then applied with a second mask.
+# In the in-memory mode the pipeline runs as the named stages of PIPELINE_STAGES (load, rules, iqr, encode,
+# iso_forest, feb_29). The output of every stage is cached in 'data/cache', keyed by a hash of the raw file and
+# the parameters it depends on, so that after changing e.g. the contamination only the last stages are recomputed:
+# python src/data_preparation.py --contamination 0.05
+# The Isolation Forest can be fitted on a bounded subsample of the rows, with the trees built on several cores,
+# and the rows scored in parallel chunks in a process pool (the results are the same for a fixed seed):
+# python src/data_preparation.py --iso-forest-max-rows 200000 --n-jobs -1 --score-workers 4
+# Every full run saves the state it fitted (the parameters of the rules, the IQR bounds, the Isolation Forest, the
+# one-hot categories and the columns and types of the output) to 'data/processed/hotel_reservations_state.pkl'.
+# New raw rows, e.g. the bookings of a day, are then transformed with that state and appended to the processed
+# CSV file, so the time depends only on the number of new rows:
+# python src/data_preparation.py --append new_bookings.csv
+# The raw rows are appended to 'data/raw/hotel_reservations_appended.csv' and not to the raw file, every full run
+# reads them after the rows of the raw file. The sizes of both files before an append are saved in the state first,
+# so an interrupted append is rolled back by truncating the files on the next run instead of being written twice.
+# The state is only refitted by a full run over all raw rows, e.g. when the data has drifted:
+# python src/data_preparation.py --refit
+# The raw files are parsed with the schema of src/production/data_schema.py: only the columns that are not dropped,
+# with compact types and the categorical columns as categories, by the pyarrow engine (by the C engine in chunks).
+# A raw category that is not in the schema is reported as an error instead of becoming a new one-hot column.
 # Copyright (c) 2024
 # Uvod u nauku o podacima, Prirodno-matematicki fakultet, Univerzitet u Kragujevcu
 # Authors: Radovan Draskovic, Marija Jolovic
 # Project: Predstavljanje i tumacenje skupa podataka Hotel Reservations
 
+import argparse
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 import numpy as np
 
+# The readers and writers of the data are shared with the production service in src/production
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'production'))
+from columnar import FILE_FORMATS, FrameWriter, save_frame
+from data_schema import RAW_COLUMNS, RAW_DTYPES, read_csv_columns
+from step_cache import StepCache, hash_file, hash_parts
+
 RAW_FILE_PATH = '../data/raw/hotel_reservations.csv'
+# Raw rows added by --append, read after the rows of RAW_FILE_PATH
+APPENDED_FILE_PATH = '../data/raw/hotel_reservations_appended.csv'
 PROCESSED_FILE_PATH = '../data/processed/hotel_reservations.csv'
+CACHE_DIR = '../data/cache'
+CACHE_SIZE_MB = 1024
 LINE_SEPARATOR = '-' * 80
 NEW_LINE = '\n'
 
-def load_data(file_path: str) -> pd.DataFrame:
-    return pd.read_csv(file_path)
+# Labels used to bin the count columns, the last label of each list is open-ended
+WEEKEND_NIGHTS_LABELS = ['0', '1', '2', '3+']
+WEEK_NIGHTS_LABELS = ['0', '1', '2', '3', '4', '5', '6+']
+SPECIAL_REQUESTS_LABELS = ['0', '1', '2+']
 
-def save_data(data: pd.DataFrame, file_path: str) -> None:
-    data.to_csv(file_path, index=False)
-    
-def perform_one_hot_encoding(data: pd.DataFrame, columns: list) -> pd.DataFrame:
-    return pd.get_dummies(data, columns=columns, drop_first=True, dtype=np.int64)
+# Categories of the one-hot encoded columns after the cleaning steps, fixed so that every chunk
+# in streaming mode gets the same columns (the first category is dropped as in get_dummies)
+# In the in-memory mode only the observed categories are encoded, as in the original script
+ONE_HOT_CATEGORIES = {
+    'type_of_meal_plan': ['Meal Plan 1', 'Meal Plan 2', 'Not Selected'],
+    'room_type_reserved': ['Room_Type 1', 'Room_Type 2', 'Room_Type 4', 'Room_Type 5', 'Room_Type 6', 'Room_Type 7'],
+    'market_segment_type': ['Aviation_Funded', 'Corporate', 'Offline', 'Online'],
+    'no_of_weekend_nights': WEEKEND_NIGHTS_LABELS,
+    'no_of_week_nights': WEEK_NIGHTS_LABELS,
+    'no_of_special_requests': SPECIAL_REQUESTS_LABELS,
+}
 
-def encoding_categorical_features(data: pd.DataFrame) -> pd.DataFrame:
-    # Delete rows with type_of_meal_plan = 'Meal Plan 3'
-    indices_meal_plan_3 = data[data['type_of_meal_plan'] == 'Meal Plan 3'].index
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mDeleting rows with 'type_of_meal_plan' = 'Meal Plan 3'...\033[0m")
-    print("\033[1;32mData shape before deleting rows with 'type_of_meal_plan' = 'Meal Plan 3': {}\033[0m".format(data.shape))
-    data = data.drop(indices_meal_plan_3)
-    print("\033[1;32mRows with 'type_of_meal_plan' = 'Meal Plan 3' deleted successfully!\033[0m")
-    print("\033[1;32mData shape after deleting rows with 'type_of_meal_plan' = 'Meal Plan 3': {}\033[0m".format(data.shape))
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    
-    # Encode 'type_of_meal_plan' column
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mPerforming one-hot encoding on 'type_of_meal_plan' column...\033[0m")
-    print("\033[1;32mData shape before one-hot encoding: {}\033[0m".format(data.shape))
-    data['type_of_meal_plan'] = data['type_of_meal_plan'].astype('category')
-    data = perform_one_hot_encoding(data, ['type_of_meal_plan'])
-    print("\033[1;32mOne-hot encoding on 'type_of_meal_plan' column performed successfully!\033[0m")
-    print("\033[1;32mData shape after one-hot encoding: {}\033[0m".format(data.shape))
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    
-    # Delete rows where 'room_type_reserved' = 'Room_Type 3'
-    indices_room_type_3 = data[data['room_type_reserved'] == 'Room_Type 3'].index
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mDeleting rows with 'room_type_reserved' = 'Room_Type 3'...\033[0m")
-    print("\033[1;32mData shape before deleting rows with 'room_type_reserved' = 'Room_Type 3': {}\033[0m".format(data.shape))
-    data = data.drop(indices_room_type_3)
-    print("\033[1;32mRows with 'room_type_reserved' = 'Room_Type 3' deleted successfully!\033[0m")
-    print("\033[1;32mData shape after deleting rows with 'room_type_reserved' = 'Room_Type 3': {}\033[0m".format(data.shape))
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    
-    # Encode 'room_type_reserved' column
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mPerforming one-hot encoding on 'room_type_reserved' column...\033[0m")
-    print("\033[1;32mData shape before one-hot encoding: {}\033[0m".format(data.shape))
-    data['room_type_reserved'] = data['room_type_reserved'].astype('category')
-    data = perform_one_hot_encoding(data, ['room_type_reserved'])
-    print("\033[1;32mOne-hot encoding on 'room_type_reserved' column performed successfully!\033[0m")
-    print("\033[1;32mData shape after one-hot encoding: {}\033[0m".format(data.shape))
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    
-    print("Number of rows where market_segment_type is Aviation: ", len(data[data['market_segment_type'] == 'Aviation']))
-    print("Number of rows where market_segment_type is Complementary: ", len(data[data['market_segment_type'] == 'Complementary']))
+# Raw categories joined into another category before the one-hot encoding
+ONE_HOT_ALIASES = {
+    'market_segment_type': {'Aviation': 'Aviation_Funded', 'Complementary': 'Aviation_Funded'},
+}
 
-    # Join Aviation and Complementary into new category called Aviation_Funded
-    data['market_segment_type'] = data['market_segment_type'].replace(['Aviation', 'Complementary'], 'Aviation_Funded')
+# Count columns binned into the labels before the one-hot encoding, the last label is open-ended
+BIN_LABELS = {
+    'no_of_weekend_nights': WEEKEND_NIGHTS_LABELS,
+    'no_of_week_nights': WEEK_NIGHTS_LABELS,
+    'no_of_special_requests': SPECIAL_REQUESTS_LABELS,
+}
 
-    print("Number of rows where market_segment_type is Aviation_Funded: ", len(data[data['market_segment_type'] == 'Aviation_Funded']))
+# Encoded columns copied from the raw columns of the same name
+VALUE_COLUMNS = ['lead_time', 'arrival_year', 'arrival_month', 'arrival_date', 'avg_price_per_room']
 
-    # Encode 'market_segment_type' column
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mPerforming one-hot encoding on 'market_segment_type' column...\033[0m")
-    print("\033[1;32mData shape before one-hot encoding: {}\033[0m".format(data.shape))
-    data['market_segment_type'] = data['market_segment_type'].astype('category')
-    data = perform_one_hot_encoding(data, ['market_segment_type'])
-    print("\033[1;32mOne-hot encoding on 'market_segment_type' column performed successfully!\033[0m")
-    print("\033[1;32mData shape after one-hot encoding: {}\033[0m".format(data.shape))
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    
-    # Encode 'booking_status' column
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mEncoding 'booking_status' column...\033[0m")
-    data['booking_status'] = data['booking_status'].apply(lambda x: 1 if x == 'Canceled' else 0)
-    print("\033[1;32m'booking_status' column encoded successfully!\033[0m")
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    
-    return data
+# Raw columns dropped by the steps 2 and 19 to 22, they are not parsed at all
+DROPPED_COLUMNS = ['Booking_ID', 'required_car_parking_space', 'repeated_guest', 'no_of_previous_cancellations', 'no_of_previous_bookings_not_canceled']
+# Raw columns the data is prepared from, parsed with the types of src/production/data_schema.py
+INPUT_COLUMNS = [column for column in RAW_COLUMNS if column not in DROPPED_COLUMNS]
 
-def remove_outliers_iso_forest(data: pd.DataFrame) -> pd.DataFrame:
-    from sklearn.ensemble import IsolationForest
-    
-    # Remove outliers using Isolation Forest
-    iso_forest = IsolationForest(contamination=0.075, random_state=0)
-    outliers = iso_forest.fit_predict(data.drop(columns=['booking_status'], axis=1))
-    
-    outlier_indices = data.index[outliers == -1]
-    data = data.drop(outlier_indices)
-    
-    return data
+STREAM_SAMPLE_SIZE = 100000
 
-def annomalies_detection_and_removal(data: pd.DataFrame) -> pd.DataFrame:
-    # Removing rows where number of children is 9 or 10
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mRemoving rows where number of children is 9 or 10...\033[0m")
-    index_children_9_10 = data[(data['no_of_children'] == 9) | (data['no_of_children'] == 10)].index
-    print("\033[1;32mData shape before removing rows where number of children is 9 or 10: {}\033[0m".format(data.shape))
-    data = data.drop(index_children_9_10)
-    print("\033[1;32mRows where number of children is 9 or 10 removed successfully!\033[0m")
-    print("\033[1;32mData shape after removing rows where number of children is 9 or 10: {}\033[0m".format(data.shape))
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    
-    # Swap the values of 'no_of_adults' and 'no_of_children' columns where 'no_of_adults' is 0 and 'no_of_children' is not 0
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mSwapping the values of 'no_of_adults' and 'no_of_children' columns where 'no_of_adults' is 0 and 'no_of_children' is not 0...\033[0m")
-    index_adults_0_children_not_0 = data[(data['no_of_adults'] == 0) & (data['no_of_children'] != 0)].index
-    print("\033[1;32mData shape before swapping the values of 'no_of_adults' and 'no_of_children' columns: {}\033[0m".format(data.shape))
-    data.loc[index_adults_0_children_not_0, ['no_of_adults', 'no_of_children']] = data.loc[index_adults_0_children_not_0, ['no_of_children', 'no_of_adults']].values
-    print("After check: {}".format(data[(data['no_of_adults'] == 0) & (data['no_of_children'] != 0)].shape))
-    print("\033[1;32mValues of 'no_of_adults' and 'no_of_children' columns swapped successfully!\033[0m")
-    print("\033[1;32mData shape after swapping the values of 'no_of_adults' and 'no_of_children' columns: {}\033[0m".format(data.shape))
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    
-    # Convert the 'no_of_children' column to a binary column 'with_children' where 0 means no children and 1 means at least 1 child
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mConverting the 'no_of_children' column to a binary column 'with_children' where 0 means no children and 1 means at least 1 child...\033[0m")
-    print("\033[1;32mData shape before converting the 'no_of_children' column to 'with_children' column: {}\033[0m".format(data.shape))
-    data['with_children'] = data['no_of_children'].apply(lambda x: 1 if x > 0 else 0)
-    data = data.drop('no_of_children', axis=1)
-    print("\033[1;32m'no_of_children' column converted to 'with_children' column successfully!\033[0m")
-    print("\033[1;32mData shape after converting the 'no_of_children' column to 'with_children' column: {}\033[0m".format(data.shape))
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    
-    # Drop the records where the 'no_of_weekend_nights' is 0 and the 'no_of_week_nights' is also 0
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mDropping the records where the 'no_of_weekend_nights' is 0 and the 'no_of_week_nights' is also 0...\033[0m")
-    index_weekend_nights_0_week_nights_0 = data[(data['no_of_weekend_nights'] == 0) & (data['no_of_week_nights'] == 0)].index
-    print("\033[1;32mData shape before dropping the records where the 'no_of_weekend_nights' is 0 and the 'no_of_week_nights' is also 0: {}\033[0m".format(data.shape))
-    data = data.drop(index_weekend_nights_0_week_nights_0)
-    print("\033[1;32mRecords where the 'no_of_weekend_nights' is 0 and the 'no_of_week_nights' is also 0 dropped successfully!\033[0m")
-    print("\033[1;32mData shape after dropping the records where the 'no_of_weekend_nights' is 0 and the 'no_of_week_nights' is also 0: {}\033[0m".format(data.shape))
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    
-    # Create categories for the 'no_of_weekend_nights' column as follows
-    # 0: 0 nights
-    # 1: 1 night
-    # 2: 2 nights
-    # 3+: 3 or more nights
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mCreating categories for the 'no_of_weekend_nights' column...\033[0m")
-    print("\033[1;32mData shape before creating categories for the 'no_of_weekend_nights' column: {}\033[0m".format(data.shape))
-    data['no_of_weekend_nights'] = data['no_of_weekend_nights'].apply(lambda x: '0' if x == 0 else '1' if x == 1 else '2' if x == 2 else '3+')
-    print("\033[1;32mCategories for the 'no_of_weekend_nights' column created successfully!\033[0m")
-    print("\033[1;32mData shape after creating categories for the 'no_of_weekend_nights' column: {}\033[0m".format(data.shape))
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    
-    # Encode 'no_of_weekend_nights' column
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mPerforming one-hot encoding on 'no_of_weekend_nights' column...\033[0m")
-    print("\033[1;32mData shape before one-hot encoding: {}\033[0m".format(data.shape))
-    data['no_of_weekend_nights'] = data['no_of_weekend_nights'].astype('category')
-    data = perform_one_hot_encoding(data, ['no_of_weekend_nights'])
-    print("\033[1;32mOne-hot encoding on 'no_of_weekend_nights' column performed successfully!\033[0m")
-    print("\033[1;32mData shape after one-hot encoding: {}\033[0m".format(data.shape))
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    
-    # Concvert the 'no_of_week_nights' column to category data type
-    data['no_of_week_nights'] = data['no_of_week_nights'].astype('category')
-    
-    # Apply the following categories to the 'no_of_week_nights' column
-    # 0: 0 nights
-    # 1: 1 night
-    # 2: 2 nights
-    # 3: 3 nights
-    # 4: 4 nights
-    # 5: 5 nights
-    # 6+: 6 or more nights
-    data['no_of_week_nights'] = data['no_of_week_nights'].apply(lambda x: '0' if x == 0 else '1' if x == 1 else '2' if x == 2 else '3' if x == 3 else '4' if x == 4 else '5' if x == 5 else '6+')
-    
-    # Encode 'no_of_week_nights' column
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mPerforming one-hot encoding on 'no_of_week_nights' column...\033[0m")
-    print("\033[1;32mData shape before one-hot encoding: {}\033[0m".format(data.shape))
-    data = perform_one_hot_encoding(data, ['no_of_week_nights'])
-    print("\033[1;32mOne-hot encoding on 'no_of_week_nights' column performed successfully!\033[0m")
-    print("\033[1;32mData shape after one-hot encoding: {}\033[0m".format(data.shape))
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    
-    # Drop the 'required_car_parking_space' column
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mDropping the 'required_car_parking_space' column...\033[0m")
-    print("\033[1;32mData shape before dropping the 'required_car_parking_space' column: {}\033[0m".format(data.shape))
-    data = data.drop('required_car_parking_space', axis=1)
-    print("\033[1;32m'required_car_parking_space' column dropped successfully!\033[0m")
-    print("\033[1;32mData shape after dropping the 'required_car_parking_space' column: {}\033[0m".format(data.shape))
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    
-    # Drop the 'repeated_guest' column
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mDropping the 'repeated_guest' column...\033[0m")
-    print("\033[1;32mData shape before dropping the 'repeated_guest' column: {}\033[0m".format(data.shape))
-    data = data.drop('repeated_guest', axis=1)
-    print("\033[1;32m'repeated_guest' column dropped successfully!\033[0m")
-    print("\033[1;32mData shape after dropping the 'repeated_guest' column: {}\033[0m".format(data.shape))
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    
-    # Drop the 'no_of_previous_cancellations' column
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mDropping the 'no_of_previous_cancellations' column...\033[0m")
-    print("\033[1;32mData shape before dropping the 'no_of_previous_cancellations' column: {}\033[0m".format(data.shape))
-    data = data.drop('no_of_previous_cancellations', axis=1)
-    print("\033[1;32m'no_of_previous_cancellations' column dropped successfully!\033[0m")
-    print("\033[1;32mData shape after dropping the 'no_of_previous_cancellations' column: {}\033[0m".format(data.shape))
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    
-    # Drop the 'no_of_previous_bookings_not_canceled' column
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mDropping the 'no_of_previous_bookings_not_canceled' column...\033[0m")
-    print("\033[1;32mData shape before dropping the 'no_of_previous_bookings_not_canceled' column: {}\033[0m".format(data.shape))
-    data = data.drop('no_of_previous_bookings_not_canceled', axis=1)
-    print("\033[1;32m'no_of_previous_bookings_not_canceled' column dropped successfully!\033[0m")
-    print("\033[1;32mData shape after dropping the 'no_of_previous_bookings_not_canceled' column: {}\033[0m".format(data.shape))
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    
-    # Filter the data to select rows where the average price per room is zero
-    zero_avg_price_per_room = data[data['avg_price_per_room'] == 0]
-    index_zero_avg_price_per_room = zero_avg_price_per_room[~(zero_avg_price_per_room['market_segment_type_Online'] == 0) & (zero_avg_price_per_room['market_segment_type_Offline'] == 0) & (zero_avg_price_per_room['market_segment_type_Corporate'] == 0)].index
+# Default parameters of the cleaning steps
+MAX_PRICE_PER_ROOM = 500
+IQR_FACTOR = 1.5
+ISO_FOREST_CONTAMINATION = 0.075
+ISO_FOREST_RANDOM_STATE = 0
+SCORE_CHUNK_ROWS = 50000
 
-    # Drop the rows where the average price per room is zero and the market segment type is not Online, Offline, or Corporate
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mDropping the rows where the average price per room is zero and the market segment type is not Online, Offline, or Corporate...\033[0m")
-    print("\033[1;32mData shape before dropping the rows where the average price per room is zero and the market segment type is not Online, Offline, or Corporate: {}\033[0m".format(data.shape))
-    data = data.drop(index_zero_avg_price_per_room)
-    print("\033[1;32mRows where the average price per room is zero and the market segment type is not Online, Offline, or Corporate dropped successfully!\033[0m")
-    print("\033[1;32mData shape after dropping the rows where the average price per room is zero and the market segment type is not Online, Offline, or Corporate: {}\033[0m".format(data.shape))
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    
-    # Drop records with avg price over 500
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mDropping records with average price per room over 500...\033[0m")
-    print("\033[1;32mData shape before dropping records with average price per room over 500: {}\033[0m".format(data.shape))
-    data = data[data['avg_price_per_room'] <= 500]
-    print("\033[1;32mRecords with average price per room over 500 dropped successfully!\033[0m")
-    print("\033[1;32mData shape after dropping records with average price per room over 500: {}\033[0m".format(data.shape))
-    
-    # Detect and remove outliers using the IQR method
-    Q1 = data['avg_price_per_room'].quantile(0.25)
-    Q3 = data['avg_price_per_room'].quantile(0.75)
+# Part of every cache key, has to be increased whenever the code of a stage changes its output
+PIPELINE_VERSION = 3
+
+# Fitted state of the last full run, used to append new raw rows without refitting
+STATE_FILE_PATH = '../data/processed/hotel_reservations_state.pkl'
+# Has to be increased whenever the contents of the state change
+STATE_VERSION = 2
+
+# Parameters that only change how fast a stage runs and not its output, so they are not part of the cache keys
+NON_KEY_PARAMETERS = ['n_jobs', 'score_workers']
+
+def raw_file_paths(file_path: str, appended_file_path: str = None) -> list:
+    # The raw file and the file of the appended raw rows, if rows were appended
+    return [file_path] + ([appended_file_path] if appended_file_path is not None and os.path.exists(appended_file_path) else [])
+
+def load_data(file_path: str, appended_file_path: str = None) -> pd.DataFrame:
+    frames = [read_csv_columns(path, INPUT_COLUMNS, RAW_DTYPES) for path in raw_file_paths(file_path, appended_file_path)]
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+def save_data(data: pd.DataFrame, file_path: str, file_format: str = 'csv') -> None:
+    save_frame(data, file_path, file_format)
+
+def processed_file_path(file_format: str) -> str:
+    return os.path.splitext(PROCESSED_FILE_PATH)[0] + FILE_FORMATS[file_format]
+
+def bin_counts(values: pd.Series, labels: list, unknown_label: str = None) -> pd.Series:
+    # Vectorized replacement for the chained lambdas ('0' if x == 0 else '1' if x == 1 else ... '3+')
+    # Integer counts below the last label are used directly as category codes, everything else
+    # falls into the last (open-ended) label, or into 'unknown_label' for negative/missing values
+    x = values.to_numpy()
+    last = len(labels) - 1
+    codes = np.where((x >= 0) & (x < last), x, last)
+    categories = list(labels)
+    if unknown_label is not None:
+        codes = np.where(x >= 0, codes, len(categories))
+        categories.append(unknown_label)
+    codes = codes.astype(np.int8)
+    # Keep only the observed categories, exactly as astype('category') on the labelled strings would
+    observed = np.bincount(codes, minlength=len(categories)) > 0
+    if not observed.all():
+        codes = (np.cumsum(observed) - 1).astype(np.int8)[codes]
+        categories = [category for category, is_observed in zip(categories, observed) if is_observed]
+    binned = pd.Categorical.from_codes(codes, categories=categories)
+    return pd.Series(binned, index=values.index, name=values.name)
+
+def one_hot_columns(column: str, values, fixed_categories: bool) -> dict:
+    # Same columns as pd.get_dummies(drop_first=True, dtype=np.int64), with the categories from
+    # ONE_HOT_CATEGORIES when 'fixed_categories' is set and the observed (sorted) ones otherwise
+    if fixed_categories:
+        categorical = pd.Categorical(values, categories=ONE_HOT_CATEGORIES[column])
+        unknown = categorical.codes == -1
+        if unknown.any():
+            raise ValueError("Unexpected values in column '{}': {}".format(column, sorted(pd.unique(np.asarray(values)[unknown]).astype(str))))
+    else:
+        categorical = pd.Categorical(values)
+    codes = categorical.codes
+    return {'{}_{}'.format(column, category): (codes == i).astype(np.int64) for i, category in enumerate(categorical.categories) if i > 0}
+
+def quantile_from_counts(counts: pd.Series, q: float) -> float:
+    # Same linear interpolation as Series.quantile, computed from the counts of the distinct values
+    counts = counts.sort_index()
+    values = counts.index.to_numpy()
+    cumulative = np.cumsum(counts.to_numpy())
+    n = int(cumulative[-1])
+    position = n * q + (1 - q) - 1
+    previous = int(np.floor(position))
+    t = position - previous
+    a = values[np.searchsorted(cumulative, previous, side='right')]
+    b = values[np.searchsorted(cumulative, min(previous + 1, n - 1), side='right')]
+    if t >= 0.5:
+        return b - (b - a) * (1 - t)
+    return a + (b - a) * t
+
+def iqr_bounds(Q1: float, Q3: float, factor: float = IQR_FACTOR) -> tuple:
     IQR = Q3 - Q1
-    
-    # Calculate the lower and upper bounds
-    lower_bound = Q1 - 1.5 * IQR
-    upper_bound = Q3 + 1.5 * IQR
-    
-    # Filter the data to remove outliers
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mRemoving outliers using the IQR method...\033[0m")
-    print("\033[1;32mData shape before removing outliers: {}\033[0m".format(data.shape))
-    data = data[(data['avg_price_per_room'] >= lower_bound) & (data['avg_price_per_room'] <= upper_bound)]
-    print("\033[1;32mOutliers removed successfully!\033[0m")
-    print("\033[1;32mData shape after removing outliers: {}\033[0m".format(data.shape))
-    
-    # Group the 'no_of_special_requests' column into categories
-    data['no_of_special_requests'] = data['no_of_special_requests'].apply(lambda x: '0' if x == 0 else '1' if x == 1 else '2+' if x >= 2 else 'Unknown')
+    return Q1 - factor * IQR, Q3 + factor * IQR
 
-    # Convert the 'no_of_special_requests' column to category data type
-    data['no_of_special_requests'] = data['no_of_special_requests'].astype('category')
-    
-    # Encode 'no_of_special_requests' column
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mPerforming one-hot encoding on 'no_of_special_requests' column...\033[0m")
-    print("\033[1;32mData shape before one-hot encoding: {}\033[0m".format(data.shape))
-    data = perform_one_hot_encoding(data, ['no_of_special_requests'])
-    print("\033[1;32mOne-hot encoding on 'no_of_special_requests' column performed successfully!\033[0m")
-    print("\033[1;32mData shape after one-hot encoding: {}\033[0m".format(data.shape))
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    
-    # Remove outliers using Isolation Forest
+def drop_zero_price(data: pd.DataFrame) -> pd.Series:
+    # The original rule on the encoded columns was
+    # (avg_price_per_room == 0) & ~(market_segment_type_Online == 0) & (market_segment_type_Offline == 0) & (market_segment_type_Corporate == 0)
+    # where '~' only negates the first comparison, so it drops the zero-price Online rows. It is kept as is,
+    # written on the raw 'market_segment_type' column.
+    segment = data['market_segment_type']
+    return (data['avg_price_per_room'] == 0) & ~(segment != 'Online') & (segment != 'Offline') & (segment != 'Corporate')
+
+def row_rules(max_price: float = MAX_PRICE_PER_ROOM) -> list:
+    # Cleaning rules that drop rows, in the order of the steps of the original script
+    # Each rule is a description of the dropped rows and a function returning their mask, evaluated on the raw columns
+    return [
+        ("'type_of_meal_plan' is 'Meal Plan 3'", lambda data: data['type_of_meal_plan'] == 'Meal Plan 3'),
+        ("'room_type_reserved' is 'Room_Type 3'", lambda data: data['room_type_reserved'] == 'Room_Type 3'),
+        ("number of children is 9 or 10", lambda data: (data['no_of_children'] == 9) | (data['no_of_children'] == 10)),
+        ("'no_of_weekend_nights' is 0 and 'no_of_week_nights' is also 0", lambda data: (data['no_of_weekend_nights'] == 0) & (data['no_of_week_nights'] == 0)),
+        ("average price per room is zero and the market segment type is not Online, Offline, or Corporate", drop_zero_price),
+        ("average price per room is over {:g}".format(max_price), lambda data: ~(data['avg_price_per_room'] <= max_price)),
+    ]
+
+def iqr_rule(lower_bound: float, upper_bound: float) -> tuple:
+    return ("average price per room is outside of the IQR bounds [{}, {}]".format(lower_bound, upper_bound),
+            lambda data: ~((data['avg_price_per_room'] >= lower_bound) & (data['avg_price_per_room'] <= upper_bound)))
+
+def evaluate_rules(data: pd.DataFrame, rules: list, keep: np.ndarray = None, report: list = None) -> tuple:
+    # Combines the rules into one mask of the kept rows, without copying the frame
+    # The report holds the number of rows dropped by each rule that were not dropped by the previous rules
+    keep = np.ones(len(data), dtype=bool) if keep is None else keep.copy()
+    report = [] if report is None else list(report)
+    for description, drop in rules:
+        dropped = keep & np.asarray(drop(data), dtype=bool)
+        keep &= ~dropped
+        report.append((description, int(dropped.sum())))
+    return keep, report
+
+def print_rule_report(report: list, n_rows: int) -> None:
     print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mRemoving outliers using Isolation Forest...\033[0m")
-    print("\033[1;32mData shape before removing outliers: {}\033[0m".format(data.shape))
-    data = remove_outliers_iso_forest(data)
-    print("\033[1;32mOutliers removed successfully!\033[0m")
-    print("\033[1;32mData shape after removing outliers: {}\033[0m".format(data.shape))
+    print("\033[1;32mRows before applying the cleaning rules: {}\033[0m".format(n_rows))
+    for description, dropped in report:
+        n_rows -= dropped
+        print("\033[1;32mDropped {} rows where {}, rows left: {}\033[0m".format(dropped, description, n_rows))
     print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
+
+def encode_features(data: pd.DataFrame, keep: np.ndarray, fixed_categories: bool = False) -> pd.DataFrame:
+    # Builds the encoded frame of the kept rows in one go, with the columns in the same order as the original
+    # script produced them (the one-hot columns are appended in the order the columns were encoded)
+    def column(name: str) -> np.ndarray:
+        return data[name].to_numpy()[keep]
+    
+    # Swap the values of 'no_of_adults' and 'no_of_children' where 'no_of_adults' is 0 and 'no_of_children' is not 0
+    adults = column('no_of_adults')
+    children = column('no_of_children')
+    swap = (adults == 0) & (children != 0)
+    
+    columns = {'no_of_adults': np.where(swap, children, adults)}
+    for name in VALUE_COLUMNS:
+        columns[name] = column(name)
+    columns['booking_status'] = (column('booking_status') == 'Canceled').astype(np.int64)
+    columns.update(one_hot_columns('type_of_meal_plan', column('type_of_meal_plan'), fixed_categories))
+    columns.update(one_hot_columns('room_type_reserved', column('room_type_reserved'), fixed_categories))
+    # Join Aviation and Complementary into new category called Aviation_Funded
+    segment = pd.Series(column('market_segment_type')).replace(ONE_HOT_ALIASES['market_segment_type'])
+    columns.update(one_hot_columns('market_segment_type', segment, fixed_categories))
+    columns['with_children'] = (np.where(swap, adults, children) > 0).astype(np.int64)
+    columns.update(one_hot_columns('no_of_weekend_nights', bin_counts(pd.Series(column('no_of_weekend_nights')), BIN_LABELS['no_of_weekend_nights']), fixed_categories))
+    columns.update(one_hot_columns('no_of_week_nights', bin_counts(pd.Series(column('no_of_week_nights')), BIN_LABELS['no_of_week_nights']), fixed_categories))
+    columns.update(one_hot_columns('no_of_special_requests', bin_counts(pd.Series(column('no_of_special_requests')), BIN_LABELS['no_of_special_requests'], unknown_label='Unknown'), fixed_categories))
+    return pd.DataFrame(columns, index=data.index[keep])
+
+def feature_spec(columns: list) -> dict:
+    # Encoding of the encoded columns from the raw columns, the same as in encode_features, for the feature
+    # transformer of the production service (src/production/features.py), which is saved with the model
+    features = []
+    for name in columns:
+        if name in VALUE_COLUMNS:
+            features.append({'column': name, 'kind': 'value', 'source': name})
+        elif name in ['no_of_adults', 'with_children']:
+            # The adults and children are swapped where there are children but no adults
+            features.append({'column': name, 'kind': name, 'source': 'no_of_adults', 'other': 'no_of_children'})
+        else:
+            source = next((column for column in ONE_HOT_CATEGORIES if name.startswith(column + '_')), None)
+            label = name[len(source) + 1:] if source is not None else None
+            if source is None or label not in ONE_HOT_CATEGORIES[source][1:]:
+                raise ValueError("Column '{}' is not produced by encode_features".format(name))
+            if source in BIN_LABELS:
+                # Counts from 'low' up to (excluding) 'high', the last label has no upper bound
+                labels = BIN_LABELS[source]
+                low = labels.index(label)
+                features.append({'column': name, 'kind': 'range', 'source': source, 'low': low, 'high': low + 1 if low < len(labels) - 1 else None})
+            else:
+                aliases = [alias for alias, category in ONE_HOT_ALIASES.get(source, {}).items() if category == label]
+                features.append({'column': name, 'kind': 'in', 'source': source, 'values': [label] + aliases})
+    # Raw categories that are accepted, a row with any other category would have been dropped or rejected when preparing the data
+    categories = {
+        column: categories + list(ONE_HOT_ALIASES.get(column, {}))
+        for column, categories in ONE_HOT_CATEGORIES.items() if column not in BIN_LABELS
+    }
+    return {'columns': list(columns), 'features': features, 'categories': categories}
+
+def fit_iso_forest(data: pd.DataFrame, contamination: float = ISO_FOREST_CONTAMINATION, random_state: int = ISO_FOREST_RANDOM_STATE, max_rows: int = None, n_jobs: int = None):
+    from sklearn.ensemble import IsolationForest
     
-    # Get indices where the arrival_date is 29 and arrival_month is 2
-    index_arrival_date_29_arrival_month_2 = data[(data['arrival_date'] == 29) & (data['arrival_month'] == 2)].index
-    
-    # Drop the rows where the arrival_date is 29 and the arrival_month is 2
+    features = data.drop(columns=['booking_status'], axis=1)
+    # Fit on a subsample of at most 'max_rows' rows, drawn with the same seed as the forest and kept in their order
+    if max_rows is not None and len(features) > max_rows:
+        rows = np.sort(np.random.default_rng(random_state).choice(len(features), size=max_rows, replace=False))
+        features = features.iloc[rows]
+    iso_forest = IsolationForest(contamination=contamination, random_state=random_state, n_jobs=n_jobs)
+    return iso_forest.fit(features)
+
+# Isolation Forest of the scoring worker processes, sent once to every worker instead of with every chunk
+_scoring_iso_forest = None
+
+def _init_scoring_worker(iso_forest) -> None:
+    global _scoring_iso_forest
+    _scoring_iso_forest = iso_forest
+
+def _predict_chunk(features: pd.DataFrame) -> np.ndarray:
+    return _scoring_iso_forest.predict(features)
+
+def predict_outliers(iso_forest, data: pd.DataFrame, workers: int = 1, chunk_rows: int = SCORE_CHUNK_ROWS) -> np.ndarray:
+    # Every row is scored independently, so scoring in chunks gives the same result as scoring all rows at once
+    features = data.drop(columns=['booking_status'], axis=1)
+    if workers <= 1 or len(features) <= chunk_rows:
+        return iso_forest.predict(features)
+    chunks = [features.iloc[start:start + chunk_rows] for start in range(0, len(features), chunk_rows)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_scoring_worker, initargs=(iso_forest,)) as executor:
+        return np.concatenate(list(executor.map(_predict_chunk, chunks)))
+
+def outlier_rule(iso_forest, workers: int = 1) -> tuple:
+    return ("the Isolation Forest detected an outlier",
+            lambda data: predict_outliers(iso_forest, data, workers) == -1)
+
+# Cleaning rules applied after the outliers detection, on the encoded columns
+FINAL_ROW_RULES = [
+    ("the arrival_date is 29 and the arrival_month is 2", lambda data: (data['arrival_date'] == 29) & (data['arrival_month'] == 2)),
+]
+
+def stage_rules(data: pd.DataFrame, max_price: float) -> tuple:
+    return evaluate_rules(data, row_rules(max_price))
+
+def stage_iqr(data: pd.DataFrame, rules_output: tuple, iqr_factor: float) -> tuple:
+    # IQR filter on the prices of the rows kept by the row rules
+    keep, report = rules_output
+    prices = data['avg_price_per_room'][keep]
+    bounds = iqr_bounds(prices.quantile(0.25), prices.quantile(0.75), iqr_factor)
+    keep, report = evaluate_rules(data, [iqr_rule(*bounds)], keep, report)
+    return keep, report, bounds
+
+def stage_encode(data: pd.DataFrame, iqr_output: tuple) -> pd.DataFrame:
+    return encode_features(data, iqr_output[0])
+
+def stage_iso_forest(data: pd.DataFrame, contamination: float, random_state: int, iso_forest_max_rows: int, n_jobs: int, score_workers: int) -> tuple:
+    import sklearn.ensemble  # imported before the timing starts, the import alone takes a few seconds
+    
+    start = time.perf_counter()
+    iso_forest = fit_iso_forest(data, contamination, random_state, iso_forest_max_rows, n_jobs)
+    fit_time = time.perf_counter() - start
+    fit_rows = len(data) if iso_forest_max_rows is None else min(len(data), iso_forest_max_rows)
+    print("\033[1;32mIsolation Forest fitted on {} rows in {:.3f} s (n_jobs={})\033[0m".format(fit_rows, fit_time, n_jobs))
+    
+    start = time.perf_counter()
+    outliers = predict_outliers(iso_forest, data, score_workers) == -1
+    score_time = time.perf_counter() - start
+    print("\033[1;32m{} rows scored in {:.3f} s ({:.0f} rows/s, {} workers)\033[0m".format(len(data), score_time, len(data) / max(score_time, 1e-9), score_workers))
+    keep, report = evaluate_rules(data, [("the Isolation Forest detected an outlier", lambda data: outliers)])
+    return keep, report, iso_forest
+
+def stage_feb_29(data: pd.DataFrame, iso_forest_output: tuple) -> tuple:
+    # Outliers and February 29 dropped with one mask
+    keep, report = evaluate_rules(data, FINAL_ROW_RULES, *iso_forest_output[:2])
+    return data[keep], report
+
+# Stages of the in-memory pipeline, in order: names of the stages whose outputs are passed to the stage,
+# names of the parameters passed to the stage and the function computing its output
+# The raw files enter the cache key through the hashes of their contents instead of their paths
+PIPELINE_STAGES = {
+    'load': ([], ['raw_file_path', 'appended_file_path'], load_data),
+    'rules': (['load'], ['max_price'], stage_rules),
+    'iqr': (['load', 'rules'], ['iqr_factor'], stage_iqr),
+    'encode': (['load', 'iqr'], [], stage_encode),
+    'iso_forest': (['encode'], ['contamination', 'random_state', 'iso_forest_max_rows', 'n_jobs', 'score_workers'], stage_iso_forest),
+    'feb_29': (['encode', 'iso_forest'], [], stage_feb_29),
+}
+
+def run_pipeline(parameters: dict, cache: StepCache = None) -> pd.DataFrame:
+    keys = {}
+    for name, (inputs, parameter_names, _) in PIPELINE_STAGES.items():
+        key_parameters = {parameter: parameters[parameter] for parameter in parameter_names if parameter not in NON_KEY_PARAMETERS}
+        for parameter in ['raw_file_path', 'appended_file_path']:
+            if parameter in key_parameters and cache is not None:
+                path = key_parameters[parameter]
+                key_parameters[parameter] = hash_file(path) if path is not None and os.path.exists(path) else None
+        keys[name] = hash_parts(PIPELINE_VERSION, name, [keys[stage] for stage in inputs], key_parameters)
+    
+    # Stages are evaluated lazily, starting from the last one, so the stages before a cached stage are skipped
+    outputs = {}
+    def output(name: str):
+        if name in outputs:
+            return outputs[name]
+        value = cache.get(name, keys[name]) if cache is not None else None
+        if value is not None:
+            print("\033[1;32mStage '{}' loaded from the cache\033[0m".format(name))
+        else:
+            inputs, parameter_names, function = PIPELINE_STAGES[name]
+            arguments = [output(stage) for stage in inputs] + [parameters[parameter] for parameter in parameter_names]
+            start = time.perf_counter()
+            value = function(*arguments)
+            print("\033[1;32mStage '{}' computed in {:.3f} s\033[0m".format(name, time.perf_counter() - start))
+            if cache is not None:
+                cache.put(name, keys[name], value)
+        outputs[name] = value
+        return value
+    
+    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
+    data, final_report = output('feb_29')
+    if cache is not None:
+        print("\033[1;32mCache hits: {}, misses: {}\033[0m".format(cache.hits, cache.misses))
+    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
+    
+    keep, report, bounds = output('iqr')
+    print_rule_report(report, len(keep))
+    print_rule_report(final_report, len(data) + sum(dropped for _, dropped in final_report))
+    return data, fitted_state(parameters, bounds, output('iso_forest')[2], data, len(keep))
+
+def read_raw_chunks(file_path: str, chunksize: int, appended_file_path: str = None):
+    for path in raw_file_paths(file_path, appended_file_path):
+        yield from read_csv_columns(path, INPUT_COLUMNS, RAW_DTYPES, chunksize)
+
+def stream_data_preparation(raw_file_path: str, processed_file_path: str, chunksize: int, parameters: dict, sample_size: int = STREAM_SAMPLE_SIZE, random_state: int = 0, file_format: str = 'csv') -> None:
+    # First pass: counts of the distinct prices of the kept rows for the IQR bounds and a uniform sample of the
+    # kept rows for the Isolation Forest (the rows with the smallest random keys, kept in their original order)
+    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
+    print("\033[1;32mFirst pass over '{}' in chunks of {} rows...\033[0m".format(raw_file_path, chunksize))
+    rng = np.random.default_rng(random_state)
+    rules = row_rules(parameters['max_price'])
+    price_counts = pd.Series(dtype=np.float64)
+    sample = None
+    n_raw_rows = 0
+    n_rows = 0
+    for chunk in read_raw_chunks(raw_file_path, chunksize, parameters['appended_file_path']):
+        n_raw_rows += len(chunk)
+        keep, _ = evaluate_rules(chunk, rules)
+        chunk = chunk[keep]
+        price_counts = price_counts.add(chunk['avg_price_per_room'].value_counts(), fill_value=0)
+        chunk = chunk.assign(_position=np.arange(n_rows, n_rows + len(chunk)), _key=rng.random(len(chunk)))
+        n_rows += len(chunk)
+        sample = chunk if sample is None else pd.concat([sample, chunk])
+        if len(sample) > sample_size:
+            sample = sample.nsmallest(sample_size, '_key')
+    sample = sample.sort_values('_position').drop(columns=['_position', '_key'])
+    print("\033[1;32mRows read: {}, rows after the row rules: {}\033[0m".format(n_raw_rows, n_rows))
+    
+    # Detect outliers using the IQR method
+    bounds = iqr_bounds(quantile_from_counts(price_counts, 0.25), quantile_from_counts(price_counts, 0.75), parameters['iqr_factor'])
+    rules = rules + [iqr_rule(*bounds)]
+    print("\033[1;32mRule added: {}\033[0m".format(rules[-1][0]))
+    
+    keep, _ = evaluate_rules(sample, rules[-1:])
+    sample = encode_features(sample, keep, fixed_categories=True)
+    print("\033[1;32mFitting Isolation Forest on a sample of {} rows...\033[0m".format(len(sample)))
+    iso_forest = fit_iso_forest(sample, parameters['contamination'], parameters['random_state'], n_jobs=parameters['n_jobs'])
+    final_rules = [outlier_rule(iso_forest)] + FINAL_ROW_RULES
+    del sample
+    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
+    
+    # Second pass: all the rules, chunk by chunk, appended to the output
+    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
+    print("\033[1;32mSecond pass over '{}', saving to '{}'...\033[0m".format(raw_file_path, processed_file_path))
+    report = None
+    n_rows = 0
+    n_kept_rows = 0
+    schema = None
+    writer = FrameWriter(processed_file_path, file_format)
+    for chunk in read_raw_chunks(raw_file_path, chunksize, parameters['appended_file_path']):
+        n_rows += len(chunk)
+        keep, chunk_report = evaluate_rules(chunk, rules)
+        chunk = encode_features(chunk, keep, fixed_categories=True)
+        if len(chunk) > 0:
+            keep, final_report = evaluate_rules(chunk, final_rules)
+            chunk = chunk[keep]
+            chunk_report += final_report
+        else:
+            chunk_report += [(description, 0) for description, _ in final_rules]
+        report = chunk_report if report is None else [(description, dropped + chunk_dropped) for (description, dropped), (_, chunk_dropped) in zip(report, chunk_report)]
+        writer.write(chunk)
+        n_kept_rows += len(chunk)
+        schema = chunk.iloc[:0] if schema is None else schema
+    writer.close()
+    print_rule_report(report, n_rows)
+    print("\033[1;32mProcessed data saved successfully!\033[0m")
     print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mDropping the rows where the arrival_date is 29 and the arrival_month is 2...\033[0m")
-    print("\033[1;32mData shape before dropping the rows where the arrival_date is 29 and the arrival_month is 2: {}\033[0m".format(data.shape))
-    data = data.drop(index_arrival_date_29_arrival_month_2)
-    print("\033[1;32mRows where the arrival_date is 29 and the arrival_month is 2 dropped successfully!\033[0m")
-    print("\033[1;32mData shape after dropping the rows where the arrival_date is 29 and the arrival_month is 2: {}\033[0m".format(data.shape))
+    return fitted_state(parameters, bounds, iso_forest, schema, n_rows, n_kept_rows)
+
+def fitted_state(parameters: dict, bounds: tuple, iso_forest, data: pd.DataFrame, n_raw_rows: int, n_rows: int = None) -> dict:
+    # Everything the appended rows are transformed with: the parameters of the row rules, the IQR bounds, the
+    # Isolation Forest, the categories of the one-hot encoding and the columns and types of the processed data
+    return {
+        'version': STATE_VERSION,
+        'parameters': {name: parameters[name] for name in ['max_price', 'iqr_factor', 'contamination', 'random_state']},
+        'iqr_bounds': [float(bound) for bound in bounds],
+        'iso_forest': iso_forest,
+        'categories': ONE_HOT_CATEGORIES,
+        'columns': list(data.columns),
+        'dtypes': {column: str(dtype) for column, dtype in data.dtypes.items()},
+        'raw_rows': int(n_raw_rows),
+        'rows': len(data) if n_rows is None else int(n_rows),
+        # Hashes of the appended raw files, so that the same file is not appended twice
+        'appended_files': [],
+        # The append in progress with the sizes of the files before it, None when no append is in progress
+        'pending_append': None,
+    }
+
+def save_state(state: dict, file_path: str = STATE_FILE_PATH) -> None:
+    # Written to a temporary file first, so that an interrupted run never leaves a truncated state
+    temporary_path = file_path + '.tmp'
+    with open(temporary_path, 'wb') as file:
+        pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_path, file_path)
+
+def load_state(file_path: str = STATE_FILE_PATH) -> dict:
+    if not os.path.exists(file_path):
+        raise FileNotFoundError("No fitted state at '{}', run the full data preparation (--refit) first".format(file_path))
+    with open(file_path, 'rb') as file:
+        state = pickle.load(file)
+    if state.get('version') != STATE_VERSION:
+        raise ValueError("The fitted state at '{}' was saved by another version of the script, run --refit".format(file_path))
+    return state
+
+def rollback_append(state: dict, state_file_path: str = STATE_FILE_PATH) -> dict:
+    # Truncates the processed data and the appended raw rows to their sizes before an interrupted append, which may
+    # have written its rows only in part, and saves the state without the append
+    pending = state['pending_append']
+    if pending is None:
+        return state
+    os.truncate(state['processed_file_path'], pending['processed_size'])
+    if pending['appended_size'] is None:
+        if os.path.exists(pending['appended_file_path']):
+            os.remove(pending['appended_file_path'])
+    else:
+        os.truncate(pending['appended_file_path'], pending['appended_size'])
+    print("\033[1;33mThe interrupted append of '{}' was rolled back\033[0m".format(pending['file_path']))
+    state['pending_append'] = None
+    save_state(state, state_file_path)
+    return state
+
+def previous_state(state_file_path: str = STATE_FILE_PATH) -> dict:
+    # The state of the last full run with an interrupted append rolled back, None if there is no usable state
+    try:
+        return rollback_append(load_state(state_file_path), state_file_path)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def append_data(new_file_path: str, state_file_path: str = STATE_FILE_PATH, raw_file_path: str = RAW_FILE_PATH, appended_file_path: str = APPENDED_FILE_PATH) -> None:
+    # Transforms only the new raw rows with the fitted state and appends them to the processed data, and the raw
+    # rows to the appended raw rows, so that the next full run (--refit) includes them
+    state = rollback_append(load_state(state_file_path), state_file_path)
+    if state['file_format'] != 'csv':
+        raise ValueError("Rows can only be appended to a CSV file, the last full run saved '{}'".format(state['processed_file_path']))
+    digest = hash_file(new_file_path)
+    if digest in state['appended_files']:
+        raise ValueError("'{}' was already appended".format(new_file_path))
+    raw_columns = list(pd.read_csv(raw_file_path, nrows=0).columns)
+    if list(pd.read_csv(new_file_path, nrows=0).columns) != raw_columns:
+        raise ValueError("Expected the columns of '{}': {}".format(raw_file_path, raw_columns))
+    new = read_csv_columns(new_file_path, INPUT_COLUMNS, RAW_DTYPES)
+    
+    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
+    print("\033[1;32mAppending {} rows of '{}' with the state fitted on {} raw rows...\033[0m".format(len(new), new_file_path, state['raw_rows']))
+    rules = row_rules(state['parameters']['max_price']) + [iqr_rule(*state['iqr_bounds'])]
+    keep, report = evaluate_rules(new, rules)
+    data = encode_features(new, keep, fixed_categories=True)
+    # Categories the full run did not see have no column in the processed data, the rows are kept without them
+    unseen = [column for column in data.columns if column not in state['columns'] and data[column].any()]
+    if unseen:
+        print("\033[1;33mCategories without a column in the processed data: {}, consider a refit\033[0m".format(unseen))
+    data = data.reindex(columns=state['columns'], fill_value=0).astype(state['dtypes'])
+    final_rules = [outlier_rule(state['iso_forest'])] + FINAL_ROW_RULES
+    if len(data) > 0:
+        keep, report = evaluate_rules(data, final_rules, report=report)
+        data = data[keep]
+    else:
+        report += [(description, 0) for description, _ in final_rules]
+    print_rule_report(report, len(new))
+    
+    with open(new_file_path, 'rb') as file:
+        header = file.readline()
+        lines = file.read()
+    if lines and not lines.endswith(b'\n'):
+        lines += b'\n'
+    # The sizes of the files are saved before anything is written, see rollback_append
+    state['pending_append'] = {
+        'file_path': new_file_path,
+        'processed_size': os.path.getsize(state['processed_file_path']),
+        'appended_file_path': appended_file_path,
+        'appended_size': os.path.getsize(appended_file_path) if os.path.exists(appended_file_path) else None,
+    }
+    save_state(state, state_file_path)
+    data.to_csv(state['processed_file_path'], mode='a', header=False, index=False)
+    with open(appended_file_path, 'ab') as file:
+        if state['pending_append']['appended_size'] is None:
+            file.write(header)
+        file.write(lines)
+    state['raw_rows'] += len(new)
+    state['rows'] += len(data)
+    state['appended_files'].append(digest)
+    state['pending_append'] = None
+    save_state(state, state_file_path)
+    print("\033[1;32m{} rows appended to '{}', {} rows in total\033[0m".format(len(data), state['processed_file_path'], state['rows']))
     print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    
-    return data
 
 def main() -> None:
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mLoading data...\033[0m")
-    data = load_data(RAW_FILE_PATH)
-    print("\033[1;32mData loaded successfully!\033[0m")
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mDrop the 'Booking_ID' column...\033[0m")
-    print("\033[1;32mData shape before droping the 'Booking_ID' column: {}\033[0m".format(data.shape))
-    data = data.drop('Booking_ID', axis=1)
-    print("\033[1;32m'Booking_ID' column dropped successfully!\033[0m")
-    print("\033[1;32mData shape after droping the 'Booking_ID' column: {}\033[0m".format(data.shape))
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    
-    data = encoding_categorical_features(data)
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    print("\033[1;32mData encoding completed!\033[0m")
-    print(data.info())
-    print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
-    
-    data = annomalies_detection_and_removal(data)
+    parser = argparse.ArgumentParser(description='Data preparation of the hotel reservations dataset')
+    parser.add_argument('--chunksize', type=int, default=None, help='Process the raw data in streaming mode, in chunks of the given number of rows')
+    parser.add_argument('--sample-size', type=int, default=STREAM_SAMPLE_SIZE, help='Number of rows the Isolation Forest is fitted on in streaming mode')
+    parser.add_argument('--format', choices=list(FILE_FORMATS), default='csv', help='Format of the processed data file')
+    parser.add_argument('--max-price', type=float, default=MAX_PRICE_PER_ROOM, help='Rows with a higher average price per room are dropped')
+    parser.add_argument('--iqr-factor', type=float, default=IQR_FACTOR, help='Factor of the IQR used for the bounds of the average price per room')
+    parser.add_argument('--contamination', type=float, default=ISO_FOREST_CONTAMINATION, help='Contamination of the Isolation Forest')
+    parser.add_argument('--iso-forest-max-rows', type=int, default=None, help='Fit the Isolation Forest on a random subsample of at most this many rows')
+    parser.add_argument('--n-jobs', type=int, default=None, help='Number of cores used to fit the Isolation Forest (-1 for all cores)')
+    parser.add_argument('--score-workers', type=int, default=1, help='Number of processes scoring the rows with the Isolation Forest')
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help='Directory of the stage cache')
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE_MB, help='Maximum size of the stage cache in MB')
+    parser.add_argument('--no-cache', action='store_true', help='Compute every stage without using the stage cache')
+    parser.add_argument('--append', default=None, help='Transform only the rows of this raw file with the fitted state and append them')
+    parser.add_argument('--refit', action='store_true', help='Reprocess the whole raw data and refit the state (what a run without --append does)')
+    args = parser.parse_args()
+    
+    if args.append is not None:
+        append_data(args.append)
+        return
+    
+    parameters = {
+        'raw_file_path': RAW_FILE_PATH,
+        'appended_file_path': APPENDED_FILE_PATH,
+        'max_price': float(args.max_price),
+        'iqr_factor': float(args.iqr_factor),
+        'contamination': float(args.contamination),
+        'random_state': ISO_FOREST_RANDOM_STATE,
+        'iso_forest_max_rows': args.iso_forest_max_rows,
+        'n_jobs': args.n_jobs,
+        'score_workers': args.score_workers,
+    }
+    
+    # The appended raw rows are part of the raw data of a full run, so the files they were appended from stay recorded
+    previous = previous_state()
+    appended_files = [] if previous is None else previous['appended_files']
+    
+    if args.chunksize is not None:
+        state = stream_data_preparation(RAW_FILE_PATH, processed_file_path(args.format), args.chunksize, parameters, args.sample_size, file_format=args.format)
+        save_state(dict(state, file_format=args.format, processed_file_path=processed_file_path(args.format), appended_files=appended_files))
+        return
+    
+    cache = None if args.no_cache else StepCache(args.cache_dir, args.cache_size * 1024 * 1024)
+    data, state = run_pipeline(parameters, cache)
     print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
     print("\033[1;32mData cleaning completed!\033[0m")
     print(data.info())
@@ -366,9 +683,10 @@ def main() -> None:
     
     print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
     print("\033[1;32mSaving processed data...\033[0m")
-    save_data(data, PROCESSED_FILE_PATH)
+    save_data(data, processed_file_path(args.format), args.format)
+    save_state(dict(state, file_format=args.format, processed_file_path=processed_file_path(args.format), appended_files=appended_files))
     print("\033[1;32mProcessed data saved successfully!\033[0m")
     print(NEW_LINE + LINE_SEPARATOR + NEW_LINE)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,256 @@
+### Description
+# Offline batch scoring of large booking files with the saved hotel_booking_model_1, on all cores.
+# The input is split into partitions: a CSV file into byte ranges of about 'partition_mb' MB, every partition
+# holding the lines that start in its range, and a Parquet file into consecutive row groups.
+# The partitions are scored in a process pool and every partition is written to its own part file in the work
+# directory, which are concatenated in the order of the input into the output file at the end.
+# The model is not sent to the workers: the sklearn model is loaded before the pool is started and inherited by the
+# forked workers, and the flattened forest (--engine flat) is memory-mapped by every worker from its .forest
+# artifact, so the workers share the pages of the model instead of holding a copy each.
+# A part file is only written once its partition is complete, so an interrupted run is resumed by running the same
+# command again, which scores only the partitions without a part file. The manifest in the work directory
+# records the input file, its partitions and the model, and a resumed run has to match it (--restart starts over).
+# The rows are identified by 'Booking_ID' or by their row number in the input file (starting from 0).
+# The lines of a CSV file must not contain quoted line breaks, as the byte ranges are split at line breaks.
+# The script can be executed from the command line using the following command:
+# python batch_score.py bookings.csv predictions.csv [--workers 8] [--partition-mb 32] [--engine sklearn]
+# Copyright (c) 2024
+# Uvod u nauku o podacima, Prirodno-matematicki fakultet, Univerzitet u Kragujevcu
+# Authors: Radovan Draskovic, Marija Jolovic
+# Project: Predstavljanje i tumacenje skupa podataka Hotel Reservations
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from columnar import file_format_of
+from data_schema import read_csv_columns
+from features import MODEL_COLUMNS
+from forest import FlatForest
+from streaming import ID_COLUMN, PREDICTION_COLUMN, ROW_COLUMN, input_dtypes
+
+MODEL_TAG = 'hotel_booking_model_1:latest'
+FOREST_PATH = 'hotel_booking_model_1.forest'
+PARTITION_MB = 32
+ENGINES = ['sklearn', 'flat']
+OUTPUT_FORMATS = {
+    '.csv': 'csv',
+    '.parquet': 'parquet',
+}
+MANIFEST_NAME = 'manifest.json'
+
+# Model of a worker process, inherited from the parent when the workers are forked
+_model = None
+
+def csv_partitions(file_path: str, partition_bytes: int) -> list:
+    # (start, end) byte ranges of the data lines after the header, a partition holds the lines starting in its range
+    with open(file_path, 'rb') as file:
+        data_start = len(file.readline())
+    size = os.path.getsize(file_path)
+    starts = list(range(data_start, size, partition_bytes)) or [data_start]
+    return [[start, min(start + partition_bytes, size)] for start in starts]
+
+def parquet_partitions(file_path: str, partition_rows: int) -> list:
+    # (first, last + 1) row groups, consecutive row groups are joined up to about 'partition_rows' rows
+    import pyarrow.parquet as parquet
+
+    metadata = parquet.ParquetFile(file_path).metadata
+    partitions = []
+    first, n_rows = 0, 0
+    for i in range(metadata.num_row_groups):
+        n_rows += metadata.row_group(i).num_rows
+        if n_rows >= partition_rows:
+            partitions.append([first, i + 1])
+            first, n_rows = i + 1, 0
+    if first < metadata.num_row_groups or not partitions:
+        partitions.append([first, metadata.num_row_groups])
+    return partitions
+
+def read_csv_partition(file_path: str, start: int, end: int, usecols: list) -> pd.DataFrame:
+    with open(file_path, 'rb') as file:
+        header = file.readline()
+        # A line that started before the range belongs to the previous partition
+        file.seek(start - 1)
+        if file.read(1) != b'\n':
+            file.readline()
+        position = file.tell()
+        if position >= end:
+            return read_csv_columns(io.BytesIO(header), usecols, input_dtypes(MODEL_COLUMNS))
+        data = file.read(end - position)
+        # The last line starting in the range is read to its end
+        if not data.endswith(b'\n'):
+            data += file.readline()
+    return read_csv_columns(io.BytesIO(header + data), usecols, input_dtypes(MODEL_COLUMNS))
+
+def read_parquet_partition(file_path: str, first: int, last: int, usecols: list) -> pd.DataFrame:
+    import pyarrow.parquet as parquet
+
+    return parquet.ParquetFile(file_path, memory_map=True).read_row_groups(list(range(first, last)), columns=usecols).to_pandas()
+
+def input_columns(file_path: str, file_format: str) -> list:
+    if file_format == 'csv':
+        return list(pd.read_csv(file_path, nrows=0).columns)
+    import pyarrow.parquet as parquet
+
+    return parquet.ParquetFile(file_path).schema_arrow.names
+
+def _init_worker(engine: str, forest_path: str, model_tag: str) -> None:
+    global _model
+    if engine == 'flat':
+        _model = FlatForest.load(forest_path, mmap=True)
+    elif _model is None:
+        # Workers that are not forked load the model themselves
+        import bentoml
+
+        _model = bentoml.sklearn.load_model(model_tag)
+    if engine != 'flat':
+        # The workers already run in parallel, a model stored with n_jobs=-1 would start a thread per core in each of them
+        _model.set_params(n_jobs=1)
+
+def _score_partition(file_path: str, file_format: str, partition: list, id_column: str, part_path: str) -> int:
+    usecols = MODEL_COLUMNS + [ID_COLUMN] if id_column == ID_COLUMN else MODEL_COLUMNS
+    if file_format == 'csv':
+        data = read_csv_partition(file_path, *partition, usecols)
+    else:
+        data = read_parquet_partition(file_path, *partition, usecols)
+    features = np.ascontiguousarray(data[MODEL_COLUMNS], dtype=np.float32)
+    if isinstance(_model, FlatForest):
+        predictions = _model.predict(features)
+    else:
+        predictions = _model.predict(pd.DataFrame(features, columns=MODEL_COLUMNS))
+    # The row numbers are relative to the partition, the offsets of the partitions are added when merging
+    ids = data[ID_COLUMN].to_numpy() if id_column == ID_COLUMN else np.arange(len(data))
+    scored = pd.DataFrame({id_column: ids, PREDICTION_COLUMN: predictions})
+    # Written under a temporary name first, so that a part file always holds a complete partition
+    scored.to_pickle(part_path + '.tmp')
+    os.replace(part_path + '.tmp', part_path)
+    return len(scored)
+
+def prepare_forest(bento_model, forest_path: str, work_dir: str) -> str:
+    # Path of a forest artifact of the model, flattened into the work directory if the given one is of another model
+    model_tag = str(bento_model.tag)
+    if os.path.isdir(forest_path) and FlatForest.load(forest_path).tag == model_tag:
+        return forest_path
+    forest_path = os.path.join(work_dir, 'model.forest')
+    if not os.path.isdir(forest_path) or FlatForest.load(forest_path).tag != model_tag:
+        FlatForest.from_sklearn(bento_model.load_model(), model_tag).save(forest_path)
+    return forest_path
+
+def open_manifest(work_dir: str, manifest: dict, restart: bool) -> None:
+    manifest_path = os.path.join(work_dir, MANIFEST_NAME)
+    if restart and os.path.isdir(work_dir):
+        shutil.rmtree(work_dir)
+    os.makedirs(work_dir, exist_ok=True)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as file:
+            previous = json.load(file)
+        if previous != manifest:
+            raise ValueError("The work directory '{}' belongs to another run (input file, partitions or model), use --restart to start over".format(work_dir))
+        return
+    with open(manifest_path, 'w') as file:
+        json.dump(manifest, file, indent=2)
+
+def merge_parts(part_paths: list, id_column: str, output_path: str, output_format: str) -> int:
+    # The part files in the order of the input, the columns are written as they are (not with the compact dtypes
+    # of the processed data)
+    writer = None
+    n_rows = 0
+    for i, part_path in enumerate(part_paths):
+        part = pd.read_pickle(part_path)
+        if id_column == ROW_COLUMN:
+            part[ROW_COLUMN] += n_rows
+        if output_format == 'csv':
+            part.to_csv(output_path, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as parquet
+
+            table = pa.Table.from_pandas(part, preserve_index=False)
+            if writer is None:
+                writer = parquet.ParquetWriter(output_path, table.schema)
+            writer.write_table(table)
+        n_rows += len(part)
+    if writer is not None:
+        writer.close()
+    return n_rows
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Score a booking file with the hotel booking model on all cores')
+    parser.add_argument('input', help='CSV or Parquet file with the model columns and optionally Booking_ID')
+    parser.add_argument('output', help='Output file, the format is taken from the extension ({})'.format(', '.join(OUTPUT_FORMATS)))
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes')
+    parser.add_argument('--partition-mb', type=float, default=PARTITION_MB, help='Size of the byte ranges of a CSV file in MB')
+    parser.add_argument('--partition-rows', type=int, default=250000, help='Rows of the row groups joined into a partition of a Parquet file')
+    parser.add_argument('--engine', choices=ENGINES, default='sklearn', help='Predict with the sklearn model or the flattened forest')
+    parser.add_argument('--model', default=MODEL_TAG, help='Tag of the saved model')
+    parser.add_argument('--forest', default=FOREST_PATH, help='Forest artifact of the model, flattened again if it is of another model')
+    parser.add_argument('--work-dir', default=None, help='Directory of the part files (default <output>.parts)')
+    parser.add_argument('--restart', action='store_true', help='Discard the part files of a previous run')
+    parser.add_argument('--keep-parts', action='store_true', help='Keep the work directory after the output is written')
+    args = parser.parse_args()
+
+    output_format = OUTPUT_FORMATS.get(os.path.splitext(args.output)[1])
+    if output_format is None:
+        parser.error('Unknown output file extension, expected one of {}'.format(list(OUTPUT_FORMATS)))
+    input_format = file_format_of(args.input)
+    if input_format not in ('csv', 'parquet'):
+        parser.error('Expected a CSV or Parquet input file')
+    columns = input_columns(args.input, input_format)
+    missing = [column for column in MODEL_COLUMNS if column not in columns]
+    if missing:
+        parser.error('Missing columns {}'.format(missing))
+    id_column = ID_COLUMN if ID_COLUMN in columns else ROW_COLUMN
+
+    import bentoml
+
+    global _model
+    bento_model = bentoml.sklearn.get(args.model)
+    model_tag = str(bento_model.tag)
+    if input_format == 'csv':
+        partitions = csv_partitions(args.input, int(args.partition_mb * 2 ** 20))
+    else:
+        partitions = parquet_partitions(args.input, args.partition_rows)
+    work_dir = args.work_dir or args.output + '.parts'
+    stat = os.stat(args.input)
+    open_manifest(work_dir, {
+        'input': os.path.abspath(args.input),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'partitions': partitions,
+        'model': model_tag,
+    }, args.restart)
+
+    part_paths = [os.path.join(work_dir, 'part-{:06d}.pkl'.format(i)) for i in range(len(partitions))]
+    pending = [i for i, part_path in enumerate(part_paths) if not os.path.exists(part_path)]
+    print("\033[1;32m{} partitions, {} already scored, {} to score with {} workers\033[0m".format(len(partitions), len(partitions) - len(pending), len(pending), args.workers))
+
+    start = time.perf_counter()
+    if pending:
+        forest_path = None
+        if args.engine == 'flat':
+            forest_path = prepare_forest(bento_model, args.forest, work_dir)
+        else:
+            _model = bento_model.load_model()
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        with ProcessPoolExecutor(max_workers=args.workers, mp_context=context, initializer=_init_worker, initargs=(args.engine, forest_path, model_tag)) as executor:
+            futures = {executor.submit(_score_partition, args.input, input_format, partitions[i], id_column, part_paths[i]): i for i in pending}
+            for n_done, future in enumerate(as_completed(futures), 1):
+                n_rows = future.result()
+                print("\033[1;32mPartition {} scored ({} rows), {}/{} done\033[0m".format(futures[future], n_rows, n_done, len(pending)))
+    n_rows = merge_parts(part_paths, id_column, args.output, output_format)
+    elapsed = time.perf_counter() - start
+    print("\033[1;32m{} rows written to '{}' in {:.1f} s ({:.0f} rows/s)\033[0m".format(n_rows, args.output, elapsed, n_rows / elapsed if elapsed else 0))
+    if not args.keep_parts:
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+### Description
+# Micro-batching of the single-record predictions of the production service.
+# Concurrent callers submit their records to a MicroBatcher, a background thread merges the queued records into
+# one batch of at most 'max_batch_size' rows, waiting at most 'max_wait_ms' after the first record for the batch to
+# fill up, calls the model once and hands every caller back its own predictions.
+# Under low traffic every batch holds a single request and only the wait is added to its latency, under high
+# traffic the requests queue up while the previous batch is predicted and the batches grow up to 'max_batch_size'.
+# Copyright (c) 2024
+# Uvod u nauku o podacima, Prirodno-matematicki fakultet, Univerzitet u Kragujevcu
+# Authors: Radovan Draskovic, Marija Jolovic
+# Project: Predstavljanje i tumacenje skupa podataka Hotel Reservations
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import pandas as pd
+
+class MicroBatcher():
+    def __init__(self, predict, max_batch_size: int = 64, max_wait_ms: float = 5.0):
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.n_batches = 0
+        self.n_rows = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, input_df) -> np.ndarray:
+        # 'input_df' is a DataFrame or a feature matrix, all the submitted inputs have to be of the same type
+        # Blocks the calling thread until the batch holding 'input_df' is predicted
+        future = Future()
+        self._queue.put((input_df, future))
+        return future.result()
+
+    def _run(self) -> None:
+        while True:
+            items = [self._queue.get()]
+            n_rows = len(items[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while n_rows < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                items.append(item)
+                n_rows += len(item[0])
+            self._predict_batch(items)
+
+    def _predict_batch(self, items: list) -> None:
+        try:
+            if len(items) == 1:
+                batch = items[0][0]
+            else:
+                inputs = [input_df for input_df, _ in items]
+                batch = np.concatenate(inputs) if isinstance(inputs[0], np.ndarray) else pd.concat(inputs, ignore_index=True)
+            predictions = np.asarray(self.predict(batch))
+        except Exception as e:
+            # One malformed request must not fail the others, so every request is predicted on its own
+            if len(items) > 1:
+                for item in items:
+                    self._predict_batch([item])
+            else:
+                items[0][1].set_exception(e)
+            return
+        self.n_batches += 1
+        self.n_rows += len(batch)
+        start = 0
+        for input_df, future in items:
+            future.set_result(predictions[start:start + len(input_df)])
+            start += len(input_df)
@@ -0,0 +1,123 @@
+### Description
+# Reading and writing of the processed hotel reservations data in CSV, Parquet or Feather (Arrow IPC) format.
+# The columnar formats are written with compact dtypes: uint8 for the one-hot encoded and binary columns,
+# int16 for 'lead_time' and the date parts and float32 for 'avg_price_per_room' (see data_schema.py).
+# CSV files are parsed with the same dtypes by the pyarrow engine.
+# Feather files are written uncompressed, so that load_frame can memory-map them and convert the
+# columns to pandas without copying them.
+# Used by src/data_preparation.py to save the processed data and by store_model.py and serve_model.py to load it.
+# A CSV file can be converted from the command line using the following command:
+# python columnar.py train.csv train.feather
+# Copyright (c) 2024
+# Uvod u nauku o podacima, Prirodno-matematicki fakultet, Univerzitet u Kragujevcu
+# Authors: Radovan Draskovic, Marija Jolovic
+# Project: Predstavljanje i tumacenje skupa podataka Hotel Reservations
+
+import os
+import sys
+
+import pandas as pd
+
+from data_schema import encoded_dtypes, read_csv_columns
+
+FILE_FORMATS = {
+    'csv': '.csv',
+    'parquet': '.parquet',
+    'feather': '.feather',
+}
+
+PARQUET_MAGIC = b'PAR1'
+ARROW_MAGIC = b'ARROW1'
+
+def compact_dtypes(data: pd.DataFrame) -> pd.DataFrame:
+    return data.astype(encoded_dtypes(data.columns), copy=False)
+
+def file_format_of(file_path: str) -> str:
+    # The format is detected from the magic bytes, so that uploaded files without an extension can be read
+    with open(file_path, 'rb') as file:
+        magic = file.read(len(ARROW_MAGIC))
+    if magic.startswith(PARQUET_MAGIC):
+        return 'parquet'
+    if magic == ARROW_MAGIC:
+        return 'feather'
+    return 'csv'
+
+def load_frame(file_path: str, columns: list = None) -> pd.DataFrame:
+    file_format = file_format_of(file_path)
+    if file_format == 'csv':
+        if columns is None:
+            columns = list(pd.read_csv(file_path, nrows=0).columns)
+        return read_csv_columns(file_path, columns, encoded_dtypes(columns))
+
+    import pyarrow.feather as feather
+    import pyarrow.parquet as parquet
+
+    if file_format == 'parquet':
+        table = parquet.read_table(file_path, columns=columns, memory_map=True)
+    else:
+        table = feather.read_table(file_path, columns=columns, memory_map=True)
+    # split_blocks keeps each column in its own block, so the memory-mapped columns are not copied
+    return table.to_pandas(split_blocks=True)
+
+def save_frame(data: pd.DataFrame, file_path: str, file_format: str = 'csv') -> None:
+    if file_format == 'csv':
+        data.to_csv(file_path, index=False)
+    elif file_format == 'parquet':
+        compact_dtypes(data).to_parquet(file_path, index=False)
+    elif file_format == 'feather':
+        compact_dtypes(data).reset_index(drop=True).to_feather(file_path, compression='uncompressed')
+    else:
+        raise ValueError("Unknown file format '{}', expected one of {}".format(file_format, list(FILE_FORMATS)))
+
+class FrameWriter():
+    # Appends frames with the same columns to one file, used by the streaming mode of src/data_preparation.py
+    def __init__(self, file_path: str, file_format: str = 'csv'):
+        if file_format not in FILE_FORMATS:
+            raise ValueError("Unknown file format '{}', expected one of {}".format(file_format, list(FILE_FORMATS)))
+        self.file_path = file_path
+        self.file_format = file_format
+        self.schema = None
+        self.writer = None
+        self.n_frames = 0
+
+    def write(self, data: pd.DataFrame) -> None:
+        if self.file_format == 'csv':
+            data.to_csv(self.file_path, mode='w' if self.n_frames == 0 else 'a', header=(self.n_frames == 0), index=False)
+        else:
+            import pyarrow as pa
+
+            table = pa.Table.from_pandas(compact_dtypes(data), schema=self.schema, preserve_index=False)
+            if self.writer is None:
+                self.schema = table.schema
+                self.writer = self._open_writer(table.schema)
+            self.writer.write_table(table)
+        self.n_frames += 1
+
+    def _open_writer(self, schema):
+        import pyarrow as pa
+        import pyarrow.parquet as parquet
+
+        if self.file_format == 'parquet':
+            return parquet.ParquetWriter(self.file_path, schema)
+        return pa.ipc.new_file(self.file_path, schema)
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Usage: python columnar.py <input file> <output file (.csv, .parquet or .feather)>")
+        sys.exit(1)
+    output_format = {extension: file_format for file_format, extension in FILE_FORMATS.items()}.get(os.path.splitext(sys.argv[2])[1])
+    if output_format is None:
+        print("Unknown output file extension, expected one of {}".format(list(FILE_FORMATS.values())))
+        sys.exit(1)
+    save_frame(load_frame(sys.argv[1]), sys.argv[2], output_format)
@@ -0,0 +1,196 @@
+### Description
+# Compaction of the production model: searches for a smaller forest that predicts the test data almost as well.
+# The candidates are the saved forest with fewer trees, forests refitted on the training data with a capped depth,
+# larger leaves or cost-complexity pruning (ccp_alpha), and small shallow forests distilled from the saved forest
+# (fitted on its predictions of the training data). Every fitted candidate is also tried with fewer of its trees,
+# which needs no refitting, as the trees of a random forest are independent of each other.
+# A candidate is accepted when its accuracy and F1 score on data/ml/hotel_reservations_test.csv are at most the
+# tolerances below the ones of the saved model, and the accepted candidate with the fewest nodes is chosen.
+# The chosen forest is saved as a new version of hotel_booking_model_1 (with the feature transformer of the saved
+# model) together with its memory-mappable forest artifact, and the report with the size, the load time and the
+# predict latency before and after the compaction is written to hotel_booking_model_1.compaction.json.
+# The script can be executed from the command line using the following command:
+# python compact_model.py [--model hotel_booking_model_1:latest] [--accuracy-tolerance 0.005] [--f1-tolerance 0.01]
+# Copyright (c) 2024
+# Uvod u nauku o podacima, Prirodno-matematicki fakultet, Univerzitet u Kragujevcu
+# Authors: Radovan Draskovic, Marija Jolovic
+# Project: Predstavljanje i tumacenje skupa podataka Hotel Reservations
+
+import argparse
+import copy
+import json
+import os
+import pickle
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import accuracy_score, f1_score
+
+from features import MODEL_COLUMNS
+from forest import FlatForest
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'ml')
+TRAIN_FILE_PATH = os.path.join(DATA_PATH, 'hotel_reservations_train.csv')
+TEST_FILE_PATH = os.path.join(DATA_PATH, 'hotel_reservations_test.csv')
+REPORT_PATH = 'hotel_booking_model_1.compaction.json'
+FOREST_PATH = 'hotel_booking_model_1.forest'
+ACCURACY_TOLERANCE = 0.005
+F1_TOLERANCE = 0.01
+# Numbers of trees every fitted candidate is also tried with
+TREE_COUNTS = [10, 20, 30, 50, 75]
+# Calls of predict with one row, the median is the latency of the model
+LATENCY_CALLS = 50
+
+# Parameters the saved forest is refitted with, and the parameters of the forests distilled from it
+REFIT_PARAMETERS = (
+    [{'max_depth': depth} for depth in [8, 10, 12, 15, 20]]
+    + [{'min_samples_leaf': leaf} for leaf in [2, 4, 8]]
+    + [{'ccp_alpha': alpha} for alpha in [1e-5, 3e-5, 1e-4, 3e-4]]
+)
+DISTILL_PARAMETERS = [
+    {'n_estimators': n_estimators, 'max_depth': depth}
+    for n_estimators in [10, 30] for depth in [8, 12, 16]
+]
+
+def with_trees(model: RandomForestClassifier, n_trees: int) -> RandomForestClassifier:
+    # The first n_trees trees of a fitted forest
+    subset = copy.copy(model)
+    subset.estimators_ = model.estimators_[:n_trees]
+    subset.n_estimators = n_trees
+    return subset
+
+def n_nodes(model: RandomForestClassifier) -> int:
+    return sum(estimator.tree_.node_count for estimator in model.estimators_)
+
+def scores(model, X: pd.DataFrame, y: pd.Series) -> dict:
+    predicted = model.predict(X)
+    return {'accuracy': accuracy_score(y, predicted), 'f1': f1_score(y, predicted)}
+
+def fitted_candidates(model: RandomForestClassifier, X_train: pd.DataFrame, y_train: pd.Series):
+    # (description, fitted forest) of the saved forest and of the refitted and the distilled forests
+    # The forests are fitted on all cores and predict on one thread (n_jobs=None) like the stored model
+    yield {'method': 'original'}, model
+    for parameters in REFIT_PARAMETERS:
+        refitted = clone(model).set_params(n_jobs=-1, verbose=0, **parameters)
+        yield dict({'method': 'refit'}, **parameters), refitted.fit(X_train, y_train).set_params(n_jobs=None)
+    # The students learn the decisions of the saved forest instead of the labels
+    teacher_labels = model.predict(X_train)
+    for parameters in DISTILL_PARAMETERS:
+        student = RandomForestClassifier(random_state=42, n_jobs=-1, **parameters)
+        yield dict({'method': 'distill'}, **parameters), student.fit(X_train, teacher_labels).set_params(n_jobs=None)
+
+def search(model: RandomForestClassifier, X_train, y_train, X_test, y_test, accuracy_tolerance: float, f1_tolerance: float) -> tuple:
+    # All evaluated candidates and the accepted candidate with the fewest nodes (None if there is none)
+    baseline = scores(model, X_test, y_test)
+    results = []
+    best = None
+    for description, fitted in fitted_candidates(model, X_train, y_train):
+        for n_trees in [count for count in TREE_COUNTS if count < len(fitted.estimators_)] + [len(fitted.estimators_)]:
+            candidate = with_trees(fitted, n_trees)
+            result = dict(description, n_trees=n_trees, n_nodes=n_nodes(candidate), **scores(candidate, X_test, y_test))
+            result['accepted'] = (
+                result['accuracy'] >= baseline['accuracy'] - accuracy_tolerance
+                and result['f1'] >= baseline['f1'] - f1_tolerance
+            )
+            results.append(result)
+            if result['accepted'] and (best is None or result['n_nodes'] < best[0]['n_nodes']):
+                best = (result, candidate)
+        print("\033[1;32mEvaluated {}\033[0m".format(description))
+    return baseline, results, best
+
+def serving_cost(model: RandomForestClassifier, X: pd.DataFrame) -> dict:
+    # Pickled size and load time of the model, load time of its forest artifact and the predict latency of both engines
+    with tempfile.TemporaryDirectory() as directory:
+        model_path = os.path.join(directory, 'model.pkl')
+        with open(model_path, 'wb') as file:
+            pickle.dump(model, file, protocol=pickle.HIGHEST_PROTOCOL)
+        start = time.perf_counter()
+        with open(model_path, 'rb') as file:
+            pickle.load(file)
+        load_time = time.perf_counter() - start
+        forest_path = os.path.join(directory, 'model.forest')
+        FlatForest.from_sklearn(model).save(forest_path)
+        start = time.perf_counter()
+        forest = FlatForest.load(forest_path)
+        forest_load_time = time.perf_counter() - start
+        forest_size = sum(os.path.getsize(os.path.join(forest_path, name)) for name in os.listdir(forest_path))
+        model_size = os.path.getsize(model_path)
+    features = np.ascontiguousarray(X[MODEL_COLUMNS], dtype=np.float32)
+    def latency(predict, rows) -> float:
+        predict(rows)
+        times = []
+        for _ in range(LATENCY_CALLS):
+            start = time.perf_counter()
+            predict(rows)
+            times.append(time.perf_counter() - start)
+        return float(np.median(times)) * 1000.0
+    start = time.perf_counter()
+    model.predict(X)
+    batch_time = time.perf_counter() - start
+    return {
+        'n_trees': len(model.estimators_),
+        'n_nodes': n_nodes(model),
+        'max_depth': max(estimator.tree_.max_depth for estimator in model.estimators_),
+        'model_size_mb': model_size / 2 ** 20,
+        'forest_size_mb': forest_size / 2 ** 20,
+        'load_time_s': load_time,
+        'forest_load_time_s': forest_load_time,
+        'sklearn_latency_ms': latency(model.predict, X.iloc[:1]),
+        'flat_latency_ms': latency(forest.predict, features[:1]),
+        'sklearn_us_per_row': batch_time / len(X) * 1e6,
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Search for a smaller version of the hotel booking model')
+    parser.add_argument('--model', default='hotel_booking_model_1:latest', help='Tag of the saved model')
+    parser.add_argument('--train-file', default=TRAIN_FILE_PATH, help='Training data of the refitted and distilled forests')
+    parser.add_argument('--test-file', default=TEST_FILE_PATH, help='Test data the candidates are scored on')
+    parser.add_argument('--accuracy-tolerance', type=float, default=ACCURACY_TOLERANCE, help='Largest accepted decrease of the accuracy')
+    parser.add_argument('--f1-tolerance', type=float, default=F1_TOLERANCE, help='Largest accepted decrease of the F1 score')
+    parser.add_argument('--no-save', action='store_true', help='Only report the chosen forest, do not save it')
+    args = parser.parse_args()
+
+    import bentoml
+
+    bento_model = bentoml.sklearn.get(args.model)
+    model = bento_model.load_model()
+    train = pd.read_csv(args.train_file)
+    test = pd.read_csv(args.test_file)
+    X_train, y_train = train[MODEL_COLUMNS], train['booking_status']
+    X_test, y_test = test[MODEL_COLUMNS], test['booking_status']
+
+    baseline, results, best = search(model, X_train, y_train, X_test, y_test, args.accuracy_tolerance, args.f1_tolerance)
+    report = {
+        'model': str(bento_model.tag),
+        'test_file': args.test_file,
+        'accuracy_tolerance': args.accuracy_tolerance,
+        'f1_tolerance': args.f1_tolerance,
+        'before': dict(baseline, **serving_cost(model, X_test)),
+        'candidates': results,
+    }
+    if best is None:
+        print("\033[1;31mNo candidate is within the tolerances\033[0m")
+    else:
+        chosen, compact = best
+        report['chosen'] = chosen
+        report['after'] = dict(scores(compact, X_test, y_test), **serving_cost(compact, X_test))
+        print(json.dumps({'before': report['before'], 'after': report['after'], 'chosen': chosen}, indent=2))
+        if not args.no_save:
+            saved_model = bentoml.sklearn.save_model(
+                name="hotel_booking_model_1",
+                model=compact,
+                custom_objects=bento_model.custom_objects,
+                metadata={'compacted_from': str(bento_model.tag), 'compaction': json.dumps(chosen)}
+            )
+            FlatForest.from_sklearn(compact, str(saved_model.tag)).save(FOREST_PATH)
+            report['saved_model'] = str(saved_model.tag)
+            print("\033[1;32mCompacted model saved as {}\033[0m".format(saved_model.tag))
+    with open(REPORT_PATH, 'w') as file:
+        json.dump(report, file, indent=2)
+
+if __name__ == '__main__':
+    main()
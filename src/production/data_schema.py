@@ -0,0 +1,112 @@
+### Description
+# Schema of the hotel reservations data: the columns of the raw data (data/raw/hotel_reservations.csv) with compact
+# dtypes and the levels of its categorical columns, and the types of the encoded columns the model is trained on.
+# read_csv_columns parses only the requested columns of a CSV file with the types of the schema, so pandas neither
+# infers the types nor parses the columns that are dropped right away, and the whole file is parsed by the
+# multi-threaded pyarrow engine. Files read in chunks are parsed by the C engine, which is the only one that can read in chunks.
+# The categorical columns are parsed as categories with the levels below, so that every file and every chunk has
+# the same categories, and a value that is not one of the levels is reported as an error.
+# Used by src/data_preparation.py to read the raw data, by columnar.py and by the CSV endpoints of serve_model.py.
+# Copyright (c) 2024
+# Uvod u nauku o podacima, Prirodno-matematicki fakultet, Univerzitet u Kragujevcu
+# Authors: Radovan Draskovic, Marija Jolovic
+# Project: Predstavljanje i tumacenje skupa podataka Hotel Reservations
+
+import numpy as np
+import pandas as pd
+
+# Levels of the categorical raw columns
+RAW_CATEGORIES = {
+    'type_of_meal_plan': ['Meal Plan 1', 'Meal Plan 2', 'Meal Plan 3', 'Not Selected'],
+    'room_type_reserved': ['Room_Type 1', 'Room_Type 2', 'Room_Type 3', 'Room_Type 4', 'Room_Type 5', 'Room_Type 6', 'Room_Type 7'],
+    'market_segment_type': ['Aviation', 'Complementary', 'Corporate', 'Offline', 'Online'],
+    'booking_status': ['Canceled', 'Not_Canceled'],
+}
+
+# Types of the raw columns, in the order of the raw file
+# The counts fit in int8 and 'lead_time' and 'arrival_year' in int16, the integer columns are parsed as int64 and
+# narrowed after checking the range, a value out of the range of the type is reported as an error
+# 'avg_price_per_room' stays float64, the prices are compared with the IQR bounds and written back as they are
+RAW_DTYPES = {
+    'Booking_ID': str,
+    'no_of_adults': np.int8,
+    'no_of_children': np.int8,
+    'no_of_weekend_nights': np.int8,
+    'no_of_week_nights': np.int8,
+    'type_of_meal_plan': 'category',
+    'required_car_parking_space': np.int8,
+    'room_type_reserved': 'category',
+    'lead_time': np.int16,
+    'arrival_year': np.int16,
+    'arrival_month': np.int8,
+    'arrival_date': np.int8,
+    'market_segment_type': 'category',
+    'repeated_guest': np.int8,
+    'no_of_previous_cancellations': np.int16,
+    'no_of_previous_bookings_not_canceled': np.int16,
+    'avg_price_per_room': np.float64,
+    'no_of_special_requests': np.int8,
+    'booking_status': 'category',
+}
+RAW_COLUMNS = list(RAW_DTYPES)
+
+# Types of the encoded columns that are not one-hot encoded, every other encoded column holds only 0 and 1 (uint8)
+ENCODED_DTYPES = {
+    'no_of_adults': np.int8,
+    'lead_time': np.int16,
+    'arrival_year': np.int16,
+    'arrival_month': np.int16,
+    'arrival_date': np.int16,
+    'avg_price_per_room': np.float32,
+}
+
+# Type the model columns of the uploaded files are parsed as, the type the model predicts on
+MODEL_INPUT_DTYPE = np.float32
+
+def encoded_dtypes(columns: list) -> dict:
+    return {column: ENCODED_DTYPES.get(column, np.uint8) for column in columns}
+
+def is_narrow_integer(dtype) -> bool:
+    return not isinstance(dtype, str) and np.issubdtype(dtype, np.integer) and np.dtype(dtype).itemsize < 8
+
+def narrowed(data: pd.DataFrame, dtype) -> pd.DataFrame:
+    # Casts the columns parsed as int64 to their narrow integer types, raises ValueError for a value out of range,
+    # which pandas would otherwise wrap around silently (e.g. 200 to -56 in int8)
+    if not isinstance(dtype, dict):
+        return data
+    for column, column_dtype in dtype.items():
+        if not is_narrow_integer(column_dtype) or column not in data.columns:
+            continue
+        limits = np.iinfo(column_dtype)
+        values = data[column].to_numpy()
+        out_of_range = values[(values < limits.min) | (values > limits.max)]
+        if len(out_of_range) > 0:
+            raise ValueError("Values out of the range [{}, {}] of column '{}': {}".format(limits.min, limits.max, column, sorted(set(out_of_range.tolist()))[:10]))
+        data[column] = values.astype(column_dtype)
+    return data
+
+def with_categories(data: pd.DataFrame) -> pd.DataFrame:
+    # Sets the levels of the schema on the categorical raw columns, raises ValueError for any other value
+    for column, levels in RAW_CATEGORIES.items():
+        if column in data.columns and isinstance(data[column].dtype, pd.CategoricalDtype):
+            unknown = [value for value in data[column].cat.categories if value not in levels]
+            if unknown:
+                raise ValueError("Unexpected values in column '{}': {}, expected one of {}".format(column, sorted(unknown), levels))
+            data[column] = data[column].cat.set_categories(levels)
+    return data
+
+def read_csv_columns(file_path, columns: list, dtypes, chunksize: int = None):
+    # Only 'columns' are parsed, with the types in 'dtypes' (a dict by column or one type for all of them)
+    # Returns a frame, or a generator of frames of 'chunksize' rows, closing it closes the file
+    dtype = {column: dtypes[column] for column in columns} if isinstance(dtypes, dict) else dtypes
+    # The narrow integer columns are parsed as int64 first, see narrowed
+    parse_dtype = {column: np.int64 if is_narrow_integer(column_dtype) else column_dtype for column, column_dtype in dtype.items()} if isinstance(dtype, dict) else dtype
+    if chunksize is None:
+        return with_categories(narrowed(pd.read_csv(file_path, usecols=columns, dtype=parse_dtype, engine='pyarrow'), dtype))
+    
+    def chunks():
+        with pd.read_csv(file_path, usecols=columns, dtype=parse_dtype, chunksize=chunksize) as reader:
+            for chunk in reader:
+                yield with_categories(narrowed(chunk, dtype))
+    
+    return chunks()
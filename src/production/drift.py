@@ -0,0 +1,277 @@
+### Description
+# Drift and data-quality monitoring of the rows served by the production service, computed incrementally.
+# A FeatureSketch summarizes rows of the model columns in a fixed amount of memory per column, whatever the number
+# of rows: a histogram of 'n_bins' equal-width bins between the minimum and the maximum of the training data, with
+# a bin for the values below, above and missing, the sum and the sum of squares, the minimum and the maximum.
+# The one-hot and binary columns are summarized the same way, the share of 1s being the frequency of the category.
+# Next to it the rows violating the assumptions of src/data_preparation.py are counted: prices over the maximum
+# price and February 29. The rows outside the training range of 'avg_price_per_room' are the rows the IQR filter
+# would have dropped.
+# store_model.py sketches the training data and saves the sketch with the model, the DriftMonitor of the service
+# updates a sketch with the same bins on every prediction, without buffering any rows, and reports the Population
+# Stability Index (PSI) of every column against the training sketch. The categories of the raw records of
+# /predict_raw are counted against the levels of data_schema.py, the data preparation drops some of these levels.
+# Copyright (c) 2024
+# Uvod u nauku o podacima, Prirodno-matematicki fakultet, Univerzitet u Kragujevcu
+# Authors: Radovan Draskovic, Marija Jolovic
+# Project: Predstavljanje i tumacenje skupa podataka Hotel Reservations
+
+import copy
+import json
+import threading
+import time
+
+import numpy as np
+
+from data_schema import RAW_CATEGORIES
+
+N_BINS = 20
+# Rows over this price are dropped by the data preparation (MAX_PRICE_PER_ROOM of src/data_preparation.py)
+MAX_PRICE = 500.0
+# PSI below 0.1 is no drift, up to 0.25 a moderate drift and above it a significant drift
+PSI_MODERATE = 0.1
+PSI_SIGNIFICANT = 0.25
+# Proportion of an empty bin in the PSI, so that a bin without rows on one side does not give an infinite PSI
+PSI_EPSILON = 1e-4
+# Raw fields of the records counted by DriftMonitor.update_records, the target is not sent to the service
+CATEGORY_FIELDS = [field for field in RAW_CATEGORIES if field != 'booking_status']
+
+def quality_rules(max_price: float) -> dict:
+    # Assumptions of the data preparation that can be checked on the model columns:
+    # name -> (description, columns, function of the columns returning the mask of the rows violating it)
+    return {
+        'price_over_max': ("'avg_price_per_room' is over {:g}".format(max_price), ['avg_price_per_room'], lambda price: price > max_price),
+        'feb_29': ('the arrival date is February 29', ['arrival_month', 'arrival_date'], lambda month, date: (month == 2) & (date == 29)),
+    }
+
+def psi(expected: np.ndarray, actual: np.ndarray) -> float:
+    # Population Stability Index of two histograms with the same bins
+    expected = np.maximum(expected / max(expected.sum(), 1), PSI_EPSILON)
+    actual = np.maximum(actual / max(actual.sum(), 1), PSI_EPSILON)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+def drift_status(value: float) -> str:
+    if value >= PSI_SIGNIFICANT:
+        return 'significant'
+    return 'moderate' if value >= PSI_MODERATE else 'stable'
+
+class FeatureSketch():
+    def __init__(self, columns: list, lows: list, highs: list, n_bins: int = N_BINS, max_price: float = MAX_PRICE):
+        self.columns = list(columns)
+        self.lows = np.asarray(lows, dtype=np.float64)
+        self.highs = np.asarray(highs, dtype=np.float64)
+        self.n_bins = n_bins
+        self.max_price = max_price
+        widths = (self.highs - self.lows) / n_bins
+        self.widths = np.where(widths > 0, widths, 1.0)
+        # Bins of a column: below the minimum, the n_bins bins, above the maximum and missing
+        self.n_slots = n_bins + 3
+        # Slot of the first bin (below the minimum) of every column in the flattened counts
+        self.offsets = np.arange(len(self.columns)) * self.n_slots + 1
+        self.rules = {
+            name: (description, [self.columns.index(column) for column in columns], function)
+            for name, (description, columns, function) in quality_rules(max_price).items()
+            if all(column in self.columns for column in columns)
+        }
+        self.reset()
+
+    def reset(self) -> None:
+        n_columns = len(self.columns)
+        self.n_rows = 0
+        self.counts = np.zeros((n_columns, self.n_slots), dtype=np.int64)
+        self.sums = np.zeros(n_columns)
+        self.squares = np.zeros(n_columns)
+        self.minimums = np.full(n_columns, np.inf)
+        self.maximums = np.full(n_columns, -np.inf)
+        self.violations = dict.fromkeys(self.rules, 0)
+        self.started = time.time()
+
+    @classmethod
+    def from_data(cls, columns: list, X: np.ndarray, n_bins: int = N_BINS, max_price: float = MAX_PRICE) -> 'FeatureSketch':
+        # Sketch of the rows of X, with the bins between the minimum and the maximum of every column
+        X = np.asarray(X, dtype=np.float32)
+        sketch = cls(columns, np.nanmin(X, axis=0), np.nanmax(X, axis=0), n_bins, max_price)
+        sketch.update(X)
+        return sketch
+
+    def update(self, X: np.ndarray) -> None:
+        # Adds the rows of the feature matrix (rows x columns, in the order of the columns), a handful of vectorized
+        # operations whatever the number of rows, so it can run on every request
+        X = np.asarray(X)
+        if len(X) == 0:
+            return
+        missing = np.isnan(X)
+        scaled = np.floor((X - self.lows) / self.widths)
+        # The maximum is in the last bin and not above it
+        scaled[X == self.highs] = self.n_bins - 1
+        np.maximum(scaled, -1, out=scaled)
+        np.minimum(scaled, self.n_bins, out=scaled)
+        scaled[missing] = self.n_bins + 1
+        slots = scaled.astype(np.int64) + self.offsets
+        self.counts += np.bincount(slots.ravel(), minlength=self.counts.size).reshape(self.counts.shape)
+        self.n_rows += len(X)
+        values = np.where(missing, 0, X) if missing.any() else X
+        self.sums += values.sum(axis=0, dtype=np.float64)
+        self.squares += np.square(values, dtype=np.float64).sum(axis=0)
+        # fmin and fmax skip the missing values
+        self.minimums = np.fmin(self.minimums, np.fmin.reduce(X, axis=0))
+        self.maximums = np.fmax(self.maximums, np.fmax.reduce(X, axis=0))
+        for name, (_, indices, function) in self.rules.items():
+            self.violations[name] += int(np.count_nonzero(function(*(X[:, i] for i in indices))))
+
+    def empty_like(self) -> 'FeatureSketch':
+        return FeatureSketch(self.columns, self.lows, self.highs, self.n_bins, self.max_price)
+
+    def to_dict(self) -> dict:
+        return {
+            'columns': self.columns,
+            'lows': self.lows.tolist(),
+            'highs': self.highs.tolist(),
+            'n_bins': self.n_bins,
+            'max_price': self.max_price,
+            'n_rows': self.n_rows,
+            'counts': self.counts.tolist(),
+            'sums': self.sums.tolist(),
+            'squares': self.squares.tolist(),
+            'minimums': self.minimums.tolist(),
+            'maximums': self.maximums.tolist(),
+            'violations': self.violations,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'FeatureSketch':
+        sketch = cls(data['columns'], data['lows'], data['highs'], data['n_bins'], data['max_price'])
+        sketch.n_rows = data['n_rows']
+        sketch.counts = np.asarray(data['counts'], dtype=np.int64)
+        sketch.sums = np.asarray(data['sums'])
+        sketch.squares = np.asarray(data['squares'])
+        sketch.minimums = np.asarray(data['minimums'])
+        sketch.maximums = np.asarray(data['maximums'])
+        sketch.violations = dict(data['violations'])
+        return sketch
+
+    def save(self, file_path: str) -> None:
+        with open(file_path, 'w') as file:
+            json.dump(self.to_dict(), file)
+
+    @classmethod
+    def load(cls, file_path: str) -> 'FeatureSketch':
+        with open(file_path) as file:
+            return cls.from_dict(json.load(file))
+
+    def means(self) -> np.ndarray:
+        n_values = np.maximum(self.n_rows - self.counts[:, -1], 1)
+        return self.sums / n_values
+
+    def stds(self) -> np.ndarray:
+        n_values = np.maximum(self.n_rows - self.counts[:, -1], 1)
+        return np.sqrt(np.maximum(self.squares / n_values - self.means() ** 2, 0.0))
+
+    def quantile(self, column: int, q: float) -> float:
+        # Estimated from the histogram, linear within a bin, the values out of range are put at the minimum/maximum
+        counts = self.counts[column, :-1]
+        n_values = counts.sum()
+        if n_values == 0:
+            return float('nan')
+        cumulative = np.cumsum(counts)
+        slot = int(np.searchsorted(cumulative, q * n_values))
+        if slot == 0:
+            return float(self.minimums[column])
+        if slot > self.n_bins:
+            return float(self.maximums[column])
+        before = cumulative[slot] - counts[slot]
+        fraction = (q * n_values - before) / counts[slot] if counts[slot] else 0.0
+        return float(self.lows[column] + (slot - 1 + fraction) * self.widths[column])
+
+class DriftMonitor():
+    def __init__(self, reference: FeatureSketch):
+        self.reference = reference
+        self.served = reference.empty_like()
+        # Counts of the levels of every raw category field of data_schema.py and of any other value (the last count)
+        self.levels = {field: {level: i for i, level in enumerate(RAW_CATEGORIES[field])} for field in CATEGORY_FIELDS}
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.served.reset()
+        self.categories = {field: np.zeros(len(levels) + 1, dtype=np.int64) for field, levels in self.levels.items()}
+        self.n_records = 0
+
+    def reset(self) -> None:
+        with self._lock:
+            self._reset()
+
+    def update(self, features: np.ndarray) -> None:
+        with self._lock:
+            self.served.update(features)
+
+    def update_records(self, records: list) -> None:
+        # Raw records of /predict_raw, counted before they are encoded, so the rejected categories are counted too
+        counts = {}
+        for field, levels in self.levels.items():
+            other = len(levels)
+            values = [record.get(field) for record in records]
+            counts[field] = np.bincount([levels.get(value, other) if isinstance(value, str) else other for value in values], minlength=other + 1)
+        with self._lock:
+            for field, field_counts in counts.items():
+                self.categories[field] += field_counts
+            self.n_records += len(records)
+
+    def report(self, accepted_categories: dict = None, reset: bool = False) -> dict:
+        # PSI and summary of every column against the training sketch, the violations of the data preparation
+        # assumptions and the raw categories, 'accepted_categories' are the categories the model was trained on
+        # With 'reset' the sketches start over, without losing the rows added while the report is computed
+        with self._lock:
+            served = copy.deepcopy(self.served)
+            categories = {field: counts.copy() for field, counts in self.categories.items()}
+            n_records = self.n_records
+            if reset:
+                self._reset()
+        reference = self.reference
+        features = {}
+        served_means, reference_means = served.means(), reference.means()
+        served_stds, reference_stds = served.stds(), reference.stds()
+        for i, column in enumerate(served.columns):
+            value = psi(reference.counts[i], served.counts[i]) if served.n_rows else 0.0
+            n_rows = max(served.n_rows, 1)
+            features[column] = {
+                'psi': value,
+                'status': drift_status(value) if served.n_rows else 'no_data',
+                'mean': float(served_means[i]),
+                'training_mean': float(reference_means[i]),
+                'std': float(served_stds[i]),
+                'training_std': float(reference_stds[i]),
+                'median': served.quantile(i, 0.5),
+                'training_median': reference.quantile(i, 0.5),
+                'below_training_range': int(served.counts[i, 0]) / n_rows,
+                'above_training_range': int(served.counts[i, -2]) / n_rows,
+                'missing': int(served.counts[i, -1]) / n_rows,
+            }
+        quality = {
+            name: {
+                'description': description,
+                'rows': served.violations[name],
+                'fraction': served.violations[name] / max(served.n_rows, 1),
+                'training_fraction': reference.violations.get(name, 0) / max(reference.n_rows, 1),
+            }
+            for name, (description, _, _) in served.rules.items()
+        }
+        raw_categories = {}
+        for field, levels in self.levels.items():
+            counts = categories[field]
+            accepted = (accepted_categories or {}).get(field)
+            raw_categories[field] = {
+                'counts': dict(zip(list(levels) + ['other'], counts.tolist())),
+                # Records with a category the data preparation dropped or the schema does not know
+                'not_in_training': int(sum(count for level, count in zip(levels, counts) if accepted is not None and level not in accepted) + counts[-1]),
+            }
+        return {
+            'since': served.started,
+            'rows': served.n_rows,
+            'training_rows': reference.n_rows,
+            'drifted': sorted(column for column, feature in features.items() if feature['status'] == 'significant'),
+            'features': features,
+            'quality': quality,
+            'raw_records': n_records,
+            'raw_categories': raw_categories,
+        }
@@ -0,0 +1,116 @@
+### Description
+# Columns of the model and the transformer encoding raw booking records into them for the production service.
+# The transformer is compiled from the encoding specification produced by feature_spec in src/data_preparation.py,
+# so the rows are encoded with the same bins and categories as the training data, and writes the features straight
+# into a preallocated float32 matrix, one raw field at a time, without building an intermediate DataFrame.
+# The specification is saved with the model by store_model.py and loaded by serve_model.py for /predict_raw.
+# Copyright (c) 2024
+# Uvod u nauku o podacima, Prirodno-matematicki fakultet, Univerzitet u Kragujevcu
+# Authors: Radovan Draskovic, Marija Jolovic
+# Project: Predstavljanje i tumacenje skupa podataka Hotel Reservations
+
+import json
+
+import numpy as np
+
+# Columns the model is trained on, in the order of the training data of the model
+MODEL_COLUMNS = [
+    'lead_time',
+    'avg_price_per_room',
+    'arrival_date',
+    'arrival_month',
+    'no_of_special_requests_1',
+    'no_of_special_requests_2+',
+    'market_segment_type_Online',
+    'no_of_weekend_nights_1',
+    'no_of_weekend_nights_2',
+    'type_of_meal_plan_Not Selected',
+    'room_type_reserved_Room_Type 5',
+    'no_of_week_nights_3',
+    'arrival_year',
+    'type_of_meal_plan_Meal Plan 2',
+    'no_of_adults',
+    'room_type_reserved_Room_Type 6',
+    'room_type_reserved_Room_Type 4',
+]
+
+class RawFeatureTransformer():
+    def __init__(self, spec: dict):
+        self.spec = spec
+        self.columns = list(spec['columns'])
+        # (output index, feature) of every feature of the specification
+        self.features = [(self.columns.index(feature['column']), feature) for feature in spec['features']]
+        numeric = {feature['source'] for _, feature in self.features if feature['kind'] != 'in'}
+        numeric |= {feature['other'] for _, feature in self.features if 'other' in feature}
+        self.numeric_fields = sorted(numeric)
+        self.category_fields = sorted({feature['source'] for _, feature in self.features if feature['kind'] == 'in'})
+        # Accepted raw values of every category field mapped to a code, and a table of the codes every 'in' feature matches
+        self.category_codes = {field: {value: code for code, value in enumerate(sorted(spec['categories'][field]))} for field in self.category_fields}
+        self.matching_codes = {}
+        for index, feature in self.features:
+            if feature['kind'] == 'in':
+                codes = self.category_codes[feature['source']]
+                self.matching_codes[index] = np.isin(np.arange(len(codes)), [codes[value] for value in feature['values']])
+
+    def to_dict(self) -> dict:
+        return self.spec
+
+    @classmethod
+    def from_dict(cls, spec: dict) -> 'RawFeatureTransformer':
+        return cls(spec)
+
+    def save(self, file_path: str) -> None:
+        with open(file_path, 'w') as file:
+            json.dump(self.spec, file, indent=2)
+
+    @classmethod
+    def load(cls, file_path: str) -> 'RawFeatureTransformer':
+        with open(file_path) as file:
+            return cls(json.load(file))
+
+    def _numeric_field(self, records: list, field: str) -> np.ndarray:
+        try:
+            return np.fromiter((record[field] for record in records), dtype=np.float64, count=len(records))
+        except KeyError:
+            raise ValueError("Missing field '{}'".format(field))
+        except (TypeError, ValueError):
+            raise ValueError("Field '{}' has to be a number".format(field))
+
+    def _category_field(self, records: list, field: str) -> np.ndarray:
+        codes = self.category_codes[field]
+        try:
+            return np.fromiter((codes[record[field]] for record in records), dtype=np.int8, count=len(records))
+        except KeyError:
+            if any(field not in record for record in records):
+                raise ValueError("Missing field '{}'".format(field))
+            unknown = sorted({str(record[field]) for record in records if record[field] not in codes})
+            raise ValueError("Unexpected values in field '{}': {}, expected one of {}".format(field, unknown, sorted(codes)))
+
+    def transform(self, records: list, out: np.ndarray = None) -> np.ndarray:
+        # Raw records (dicts with the raw fields of data/raw/hotel_reservations.csv, other fields are ignored)
+        # to a float32 matrix with the model columns, written into 'out' when it is given
+        n_rows = len(records)
+        if out is None:
+            out = np.empty((n_rows, len(self.columns)), dtype=np.float32)
+        elif out.shape != (n_rows, len(self.columns)) or out.dtype != np.float32:
+            raise ValueError("Expected a float32 matrix of shape {}".format((n_rows, len(self.columns))))
+        fields = {field: self._numeric_field(records, field) for field in self.numeric_fields}
+        fields.update({field: self._category_field(records, field) for field in self.category_fields})
+        for index, feature in self.features:
+            values = fields[feature['source']]
+            kind = feature['kind']
+            if kind == 'value':
+                out[:, index] = values
+            elif kind == 'range':
+                matches = values >= feature['low']
+                if feature['high'] is not None:
+                    matches &= values < feature['high']
+                out[:, index] = matches
+            elif kind == 'in':
+                out[:, index] = self.matching_codes[index][values]
+            else:
+                # The adults and children are swapped where there are children but no adults
+                other = fields[feature['other']]
+                swap = (values == 0) & (other != 0)
+                out[:, index] = np.where(swap, other, values) if kind == 'no_of_adults' else np.where(swap, values, other) > 0
+        return out
@@ -0,0 +1,178 @@
+### Description
+# Flattened inference engine for the RandomForestClassifier of the production service.
+# The fitted trees are concatenated into contiguous NumPy arrays with one entry per node (split feature, threshold,
+# left child, missing value direction and the class fractions of the leaves) and the rows of a batch are
+# routed through all trees at once: every iteration moves each (row, tree) pair that has not reached a leaf one level
+# down, so a batch takes as many vectorized steps as the deepest path it follows.
+# The predictions match the sklearn model exactly: the rows are compared as float32 against the float64 thresholds
+# like in sklearn, and the class fractions of the trees are summed in the order of the trees before averaging.
+# The flattened forest is saved as a directory with one uncompressed .npy file per array, which load memory-maps,
+# so the worker processes of the service share the pages of the arrays instead of unpickling a copy of the forest each.
+# It is saved next to the model by store_model.py and can be exported from the local BentoML model store using:
+# python forest.py hotel_booking_model_1 hotel_booking_model_1.forest
+# Copyright (c) 2024
+# Uvod u nauku o podacima, Prirodno-matematicki fakultet, Univerzitet u Kragujevcu
+# Authors: Radovan Draskovic, Marija Jolovic
+# Project: Predstavljanje i tumacenje skupa podataka Hotel Reservations
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Rows routed at a time, so that the (row, tree) pairs of a block stay small enough for the CPU caches
+BLOCK_ROWS = 1024
+# Levels descended between two removals of the pairs that reached a leaf, the leaves point to themselves,
+# so a pair that reached its leaf earlier just stays there
+STEPS_PER_COMPACTION = 6
+
+def _sibling_order(left: np.ndarray, right: np.ndarray, root: int) -> list:
+    # Nodes of one tree in breadth-first order, so that the right child of every node directly follows its left child
+    order = [root]
+    for node in order:
+        if left[node] >= 0:
+            order.append(left[node])
+            order.append(right[node])
+    return order
+
+def _float32_thresholds(threshold: np.ndarray) -> np.ndarray:
+    # Largest float32 not greater than every threshold, so that comparing float32 values against them
+    # gives the same result as comparing the values against the float64 thresholds
+    rounded = threshold.astype(np.float32)
+    return np.where(rounded.astype(np.float64) > threshold, np.nextafter(rounded, np.float32(-np.inf)), rounded)
+
+class FlatForest():
+    ARRAYS = ['feature', 'threshold', 'left', 'missing_go_right', 'value', 'roots', 'classes', 'feature_names', 'tag']
+
+    def __init__(self, feature, threshold, left, missing_go_right, value, roots, classes, feature_names, tag=''):
+        # One entry per node of all trees: the nodes of a tree are stored after each other with the right child of
+        # every inner node next to its left child, so a row moves to left[node] + (value > threshold[node])
+        # Leaves point to themselves and have an infinite threshold
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.missing_go_right = missing_go_right
+        self.value = value
+        self.roots = roots
+        self.classes = classes
+        self.feature_names = feature_names
+        # Tag of the BentoML model the forest was flattened from
+        self.tag = str(tag)
+        self.is_leaf = left == np.arange(len(left), dtype=left.dtype)
+
+    @classmethod
+    def from_sklearn(cls, model, tag: str = '') -> 'FlatForest':
+        trees = [estimator.tree_ for estimator in model.estimators_]
+        n_nodes = sum(tree.node_count for tree in trees)
+        feature = np.zeros(n_nodes, dtype=np.min_scalar_type(max(model.n_features_in_ - 1, 0)))
+        threshold = np.empty(n_nodes, dtype=np.float32)
+        left = np.empty(n_nodes, dtype=np.int32)
+        missing_go_right = np.zeros(n_nodes, dtype=bool)
+        value = np.empty((n_nodes, model.n_classes_), dtype=np.float64)
+        roots = np.empty(len(trees), dtype=np.int32)
+        offset = 0
+        for i, tree in enumerate(trees):
+            order = np.array(_sibling_order(tree.children_left.tolist(), tree.children_right.tolist(), 0))
+            # New index of every node of the tree
+            position = np.empty(tree.node_count, dtype=np.int32)
+            position[order] = np.arange(offset, offset + tree.node_count)
+            nodes = slice(offset, offset + tree.node_count)
+            inner = tree.children_left[order] >= 0
+            left[nodes] = np.where(inner, position[np.maximum(tree.children_left[order], 0)], position[order])
+            feature[nodes] = np.where(inner, tree.feature[order], 0)
+            threshold[nodes] = np.where(inner, _float32_thresholds(tree.threshold[order]), np.inf)
+            missing_go_right[nodes] = inner & ~tree.missing_go_to_left[order].astype(bool)
+            # The class fractions of every node, as returned by the predict_proba of the trees
+            value[nodes] = tree.value[order, 0, :model.n_classes_]
+            roots[i] = offset
+            offset += tree.node_count
+        return cls(
+            feature=feature,
+            threshold=threshold,
+            left=left,
+            missing_go_right=missing_go_right,
+            value=value,
+            roots=roots,
+            classes=np.asarray(model.classes_),
+            feature_names=np.asarray(getattr(model, 'feature_names_in_', np.arange(model.n_features_in_)), dtype=str),
+            tag=tag,
+        )
+
+    def save(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(directory, name + '.npy'), np.asarray(getattr(self, name)), allow_pickle=False)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> 'FlatForest':
+        arrays = {}
+        for name in cls.ARRAYS:
+            array = np.load(os.path.join(directory, name + '.npy'), mmap_mode='r' if mmap else None, allow_pickle=False)
+            # A plain ndarray view of the mapping, np.take on np.memmap instances is noticeably slower
+            arrays[name] = np.asarray(array)
+        return cls(**arrays)
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    def _to_matrix(self, X) -> np.ndarray:
+        if isinstance(X, pd.DataFrame):
+            X = X[list(self.feature_names)]
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != len(self.feature_names):
+            raise ValueError("Expected {} features, got an array of shape {}".format(len(self.feature_names), X.shape))
+        return X
+
+    def _apply_block(self, X: np.ndarray) -> np.ndarray:
+        # Leaf of every (row, tree) pair of the block, shape (n_rows, n_trees)
+        n_rows, n_features = X.shape
+        values = X.ravel()
+        has_nan = bool(np.isnan(values).any())
+        # The pairs are ordered by tree, so the pairs of one step visit the nodes of one tree after each other
+        nodes = np.repeat(self.roots, n_rows)
+        row_offsets = np.tile(np.arange(n_rows, dtype=np.int32) * n_features, self.n_trees)
+        pairs = np.arange(n_rows * self.n_trees, dtype=np.int32)
+        leaves = np.empty(n_rows * self.n_trees, dtype=np.int32)
+        # np.take is considerably faster than fancy indexing for 1-D gathers
+        take = np.take
+        while nodes.size:
+            for _ in range(STEPS_PER_COMPACTION):
+                x = take(values, row_offsets + take(self.feature, nodes))
+                go_right = x > take(self.threshold, nodes)
+                if has_nan:
+                    go_right |= np.isnan(x) & take(self.missing_go_right, nodes)
+                nodes = take(self.left, nodes) + go_right
+            done = take(self.is_leaf, nodes)
+            leaves[pairs[done]] = nodes[done]
+            running = ~done
+            nodes = nodes[running]
+            row_offsets = row_offsets[running]
+            pairs = pairs[running]
+        return leaves.reshape(self.n_trees, n_rows).T
+
+    def apply(self, X) -> np.ndarray:
+        X = self._to_matrix(X)
+        blocks = [self._apply_block(X[start:start + BLOCK_ROWS]) for start in range(0, len(X), BLOCK_ROWS)]
+        return np.concatenate(blocks) if blocks else np.empty((0, self.n_trees), dtype=np.int32)
+
+    def predict_proba(self, X) -> np.ndarray:
+        leaf_values = np.take(self.value, self.apply(X), axis=0)
+        # cumsum adds the trees one after another like the sklearn forest does, a pairwise sum could differ in the last bit
+        proba = np.cumsum(leaf_values, axis=1)[:, -1]
+        proba /= self.n_trees
+        return proba
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes.take(np.argmax(self.predict_proba(X), axis=1), axis=0)
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Usage: python forest.py <BentoML model tag> <output directory>")
+        sys.exit(1)
+
+    import bentoml
+
+    model = bentoml.sklearn.get(sys.argv[1])
+    FlatForest.from_sklearn(model.load_model(), str(model.tag)).save(sys.argv[2])
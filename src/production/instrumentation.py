@@ -0,0 +1,138 @@
+### Description
+# Instrumentation of the hot path of the production service and a sampling profiler.
+# Every endpoint times its stages (parsing, column selection, encoding, prediction and serialization) with 'stage',
+# which records the duration in a latency histogram and counts the errors raised in the stage. The rows predicted
+# are recorded as batch sizes, row counters and the throughput of the last batch, per endpoint and per engine.
+# The metrics are registered with prometheus_client, so BentoML serves them on its Prometheus /metrics route
+# (rows/s over time is rate(hotel_booking_rows_total[1m])).
+# The SamplingProfiler samples the stacks of all threads of the service at a fixed interval while it is running and
+# reports the collapsed stacks (the input format of flame graph tools) with their sample counts, threads waiting for work
+# are left out.
+# Copyright (c) 2024
+# Uvod u nauku o podacima, Prirodno-matematicki fakultet, Univerzitet u Kragujevcu
+# Authors: Radovan Draskovic, Marija Jolovic
+# Project: Predstavljanje i tumacenje skupa podataka Hotel Reservations
+
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from prometheus_client import Counter as CounterMetric
+from prometheus_client import Gauge, Histogram
+
+# From 100 us to about 13 s
+LATENCY_BUCKETS = [0.0001 * 2 ** i for i in range(18)]
+# From 1 row to 131072 rows
+BATCH_SIZE_BUCKETS = [2 ** i for i in range(18)]
+# Innermost frames (file:function) of threads that wait for work, their stacks are not sampled
+IDLE_FRAMES = {'threading.py:wait', 'queue.py:get', 'selectors.py:select', 'core.py:_connection_worker_thread'}
+
+STAGE_DURATION = Histogram(
+    'hotel_booking_stage_duration_seconds', 'Duration of a stage of an endpoint',
+    ['endpoint', 'stage'], buckets=LATENCY_BUCKETS,
+)
+STAGE_ERRORS = CounterMetric(
+    'hotel_booking_stage_errors', 'Errors raised in a stage of an endpoint',
+    ['endpoint', 'stage', 'error'],
+)
+BATCH_SIZE = Histogram(
+    'hotel_booking_batch_size_rows', 'Rows of a request or of a batch predicted by an engine',
+    ['endpoint'], buckets=BATCH_SIZE_BUCKETS,
+)
+ROWS = CounterMetric(
+    'hotel_booking_rows', 'Rows of the requests or the rows predicted by an engine',
+    ['endpoint'],
+)
+ROWS_PER_SECOND = Gauge(
+    'hotel_booking_rows_per_second', 'Rows per second of the last batch predicted by an engine',
+    ['endpoint'], multiprocess_mode='livemax',
+)
+CACHE_ROWS = CounterMetric(
+    'hotel_booking_prediction_cache_rows', 'Rows looked up in the prediction cache',
+    ['result'],
+)
+
+@contextmanager
+def stage(endpoint: str, name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        STAGE_ERRORS.labels(endpoint, name, type(e).__name__).inc()
+        raise
+    finally:
+        STAGE_DURATION.labels(endpoint, name).observe(time.perf_counter() - start)
+
+def record_rows(endpoint: str, n_rows: int, seconds: float = None) -> None:
+    BATCH_SIZE.labels(endpoint).observe(n_rows)
+    ROWS.labels(endpoint).inc(n_rows)
+    if seconds:
+        ROWS_PER_SECOND.labels(endpoint).set(n_rows / seconds)
+
+def record_cache_lookup(n_rows: int, n_missed: int) -> None:
+    CACHE_ROWS.labels('hit').inc(n_rows - n_missed)
+    CACHE_ROWS.labels('miss').inc(n_missed)
+
+class SamplingProfiler():
+    def __init__(self, interval_ms: float = 5.0, max_depth: int = 64):
+        self.interval = interval_ms / 1000.0
+        self.max_depth = max_depth
+        self.samples = Counter()
+        self.n_samples = 0
+        self._thread = None
+        self._running = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._running.is_set()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def reset(self) -> None:
+        with self._lock:
+            self.samples = Counter()
+            self.n_samples = 0
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while self._running.is_set():
+            stacks = [
+                self._collapse(frame) for thread_id, frame in sys._current_frames().items()
+                if thread_id != own_id and '{}:{}'.format(frame.f_code.co_filename.rsplit('/', 1)[-1], frame.f_code.co_name) not in IDLE_FRAMES
+            ]
+            with self._lock:
+                self.samples.update(stacks)
+                self.n_samples += 1
+            time.sleep(self.interval)
+
+    def _collapse(self, frame) -> str:
+        # 'outermost;...;innermost' with the file name, function and line of every frame
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append('{}:{}:{}'.format(code.co_filename.rsplit('/', 1)[-1], code.co_name, frame.f_lineno))
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def report(self, top: int = 50) -> dict:
+        with self._lock:
+            return {
+                'running': self.running,
+                'interval_ms': self.interval * 1000.0,
+                'samples': self.n_samples,
+                'stacks': [{'stack': stack, 'count': count} for stack, count in self.samples.most_common(top)],
+            }
@@ -0,0 +1,175 @@
+### Description
+# Cross-validated hyperparameter search and model comparison for store_model.py.
+# The RandomForest hyperparameters are searched with successive halving: every candidate is evaluated on the
+# folds with a small part of the training rows, only the best 1/factor of the candidates are evaluated again with
+# factor times more rows, until the last candidates are evaluated on all rows of the training folds.
+# The (candidate, fold) fits run in a process pool, the training data and the folds are sent to every worker once.
+# The fold splits are cached in data/cache (see src/step_cache.py), keyed by a hash of the training data, so
+# every run and every compared model is evaluated on the same folds.
+# Next to the accuracy and the F1 score every evaluation records the serving cost of the model: the fit time,
+# the latency of predicting one row, the time per row of predicting the validation fold and the pickled size.
+# Copyright (c) 2024
+# Uvod u nauku o podacima, Prirodno-matematicki fakultet, Univerzitet u Kragujevcu
+# Authors: Radovan Draskovic, Marija Jolovic
+# Project: Predstavljanje i tumacenje skupa podataka Hotel Reservations
+
+import hashlib
+import itertools
+import math
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.metrics import accuracy_score, f1_score
+from sklearn.model_selection import StratifiedKFold
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from step_cache import StepCache, hash_parts
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'data', 'cache')
+CACHE_SIZE_MB = 1024
+# Changing how the folds are split changes the cached folds, the version is part of their key
+FOLDS_VERSION = 1
+N_FOLDS = 5
+FOLDS_RANDOM_STATE = 42
+HALVING_FACTOR = 3
+N_CANDIDATES = 27
+# Calls of predict with one row, the median is the latency of the model
+LATENCY_CALLS = 20
+
+# Hyperparameters of the RandomForest searched by store_model.py --search
+RF_PARAMETER_SPACE = {
+    'n_estimators': [50, 100, 200, 400],
+    'max_depth': [None, 12, 20, 30],
+    'min_samples_leaf': [1, 2, 4],
+    'max_features': ['sqrt', 'log2', 0.5],
+    'max_samples': [None, 0.7],
+}
+
+def sample_candidates(space: dict, n_candidates: int, random_state: int = 0) -> list:
+    # Distinct combinations of the hyperparameters drawn at random, all of them if there are fewer
+    combinations = [dict(zip(space, values)) for values in itertools.product(*space.values())]
+    if n_candidates >= len(combinations):
+        return combinations
+    rng = np.random.default_rng(random_state)
+    return [combinations[i] for i in sorted(rng.choice(len(combinations), n_candidates, replace=False))]
+
+def fold_splits(X: pd.DataFrame, y: pd.Series, n_folds: int = N_FOLDS, random_state: int = FOLDS_RANDOM_STATE, cache: StepCache = None) -> list:
+    # (training rows, validation rows) of every fold, the training rows are shuffled, so that the first n of them
+    # are a random subset of the fold for successive halving
+    digest = hashlib.sha256(pd.util.hash_pandas_object(pd.concat([X, y], axis=1), index=False).to_numpy().tobytes()).hexdigest()
+    key = hash_parts(FOLDS_VERSION, digest, n_folds, random_state)
+    folds = cache.get('folds', key) if cache is not None else None
+    if folds is not None:
+        return folds
+    rng = np.random.default_rng(random_state)
+    splitter = StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=random_state)
+    folds = [(rng.permutation(train).astype(np.int32), validation.astype(np.int32)) for train, validation in splitter.split(X, y)]
+    if cache is not None:
+        cache.put('folds', key, folds)
+    return folds
+
+def default_cache() -> StepCache:
+    return StepCache(CACHE_DIR, CACHE_SIZE_MB * 1024 * 1024)
+
+# Training data and folds of a worker process, set by the initializer of the process pool
+_X = _y = _folds = None
+
+def _init_worker(X: pd.DataFrame, y: pd.Series, folds: list) -> None:
+    global _X, _y, _folds
+    _X, _y, _folds = X, y, folds
+
+def _evaluate(estimator, fold: int, n_rows: int = None) -> dict:
+    train, validation = _folds[fold]
+    train = train[:n_rows]
+    start = time.perf_counter()
+    model = estimator.fit(_X.iloc[train], _y.iloc[train])
+    fit_time = time.perf_counter() - start
+    X_validation = _X.iloc[validation]
+    start = time.perf_counter()
+    predicted = model.predict(X_validation)
+    batch_time = time.perf_counter() - start
+    # One row at a time, like a /predict_from_record request
+    row = X_validation.iloc[:1]
+    latencies = []
+    for _ in range(LATENCY_CALLS):
+        start = time.perf_counter()
+        model.predict(row)
+        latencies.append(time.perf_counter() - start)
+    y_validation = _y.iloc[validation]
+    return {
+        'accuracy': accuracy_score(y_validation, predicted),
+        'f1': f1_score(y_validation, predicted),
+        'fit_time': fit_time,
+        'predict_latency_ms': float(np.median(latencies)) * 1000.0,
+        'predict_us_per_row': batch_time / len(validation) * 1e6,
+        'model_size_mb': len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)) / 2 ** 20,
+    }
+
+def _summarize(evaluations: list) -> dict:
+    # Mean of the metrics over the folds, and the standard deviation of the accuracy
+    summary = {metric: float(np.mean([evaluation[metric] for evaluation in evaluations])) for metric in evaluations[0]}
+    summary['accuracy_std'] = float(np.std([evaluation['accuracy'] for evaluation in evaluations]))
+    return summary
+
+def _evaluate_all(executor: ProcessPoolExecutor, estimators: list, n_folds: int, n_rows: int = None) -> list:
+    futures = [[executor.submit(_evaluate, estimator, fold, n_rows) for fold in range(n_folds)] for estimator in estimators]
+    return [_summarize([future.result() for future in estimator_futures]) for estimator_futures in futures]
+
+def successive_halving(estimator, candidates: list, X: pd.DataFrame, y: pd.Series, folds: list, factor: int = HALVING_FACTOR, workers: int = None) -> list:
+    # Results of every candidate at every rung it reached, as dicts with the hyperparameters, the rung, the training
+    # rows per fold and the mean metrics over the folds
+    # As many rungs as it takes to get down to at most 'factor' candidates
+    n_rungs = 1
+    while factor ** n_rungs < len(candidates):
+        n_rungs += 1
+    max_rows = min(len(train) for train, _ in folds)
+    results = []
+    remaining = list(range(len(candidates)))
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker, initargs=(X, y, folds)) as executor:
+        for rung in range(n_rungs):
+            n_rows = max_rows if rung == n_rungs - 1 else max(1, max_rows // factor ** (n_rungs - 1 - rung))
+            start = time.perf_counter()
+            estimators = [clone(estimator).set_params(**candidates[i]) for i in remaining]
+            summaries = _evaluate_all(executor, estimators, len(folds), n_rows)
+            rung_results = [dict({'candidate': i, 'params': candidates[i], 'rung': rung, 'n_rows': n_rows}, **summary) for i, summary in zip(remaining, summaries)]
+            results += rung_results
+            print("\033[1;32mRung {}: {} candidates on {} rows per fold in {:.1f} s, best accuracy {:.4f}\033[0m".format(
+                rung, len(remaining), n_rows, time.perf_counter() - start, max(result['accuracy'] for result in rung_results)))
+            # The best candidates continue, ties are broken by the lower latency
+            ranked = sorted(rung_results, key=lambda result: (-result['accuracy'], result['predict_latency_ms']))
+            remaining = [result['candidate'] for result in ranked[:max(1, math.ceil(len(ranked) / factor))]]
+    return results
+
+def select_best(results: list, max_latency_ms: float = None, max_size_mb: float = None) -> dict:
+    # Most accurate candidate of the last rung within the serving limits
+    last_rung = max(result['rung'] for result in results)
+    finalists = [result for result in results if result['rung'] == last_rung]
+    allowed = [
+        result for result in finalists
+        if (max_latency_ms is None or result['predict_latency_ms'] <= max_latency_ms)
+        and (max_size_mb is None or result['model_size_mb'] <= max_size_mb)
+    ]
+    if not allowed:
+        raise ValueError('None of the {} final candidates is within the latency and size limits'.format(len(finalists)))
+    return max(allowed, key=lambda result: (result['accuracy'], -result['predict_latency_ms']))
+
+def compare_models(models: dict, X: pd.DataFrame, y: pd.Series, folds: list, workers: int = None) -> list:
+    # Every model evaluated on all rows of the folds, as dicts with the name of the model and the mean metrics
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker, initargs=(X, y, folds)) as executor:
+        summaries = _evaluate_all(executor, list(models.values()), len(folds))
+    return [dict({'model': name}, **summary) for name, summary in zip(models, summaries)]
+
+def print_results(results: list, label) -> None:
+    labels = [label(result) for result in results]
+    width = max(len(text) for text in labels)
+    print('{:<{}} {:>9} {:>7} {:>9} {:>11} {:>11} {:>9}'.format('', width, 'accuracy', 'f1', 'fit [s]', 'latency[ms]', 'us per row', 'size[MB]'))
+    for text, result in zip(labels, results):
+        print('{:<{}} {:>9.4f} {:>7.4f} {:>9.2f} {:>11.2f} {:>11.2f} {:>9.2f}'.format(
+            text, width, result['accuracy'], result['f1'], result['fit_time'], result['predict_latency_ms'],
+            result['predict_us_per_row'], result['model_size_mb']))
@@ -0,0 +1,84 @@
+### Description
+# In-process cache of the predictions of the production service.
+# The key of a row is a hash of the tag of the model and the 17 features of the row as float32 (the precision the
+# model compares them in), so a re-scored booking is a hit regardless of how its features were sent.
+# At most 'max_entries' predictions are kept, the least recently used ones are evicted first and a prediction
+# older than 'ttl' seconds is predicted again. Setting another model tag empties the cache.
+# Copyright (c) 2024
+# Uvod u nauku o podacima, Prirodno-matematicki fakultet, Univerzitet u Kragujevcu
+# Authors: Radovan Draskovic, Marija Jolovic
+# Project: Predstavljanje i tumacenje skupa podataka Hotel Reservations
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+class PredictionCache():
+    def __init__(self, max_entries: int = 100000, ttl: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.model_tag = ''
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (prediction, expiry time), in the order of the last use
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set_model_tag(self, model_tag: str) -> None:
+        with self._lock:
+            if model_tag != self.model_tag:
+                self._entries.clear()
+                self.model_tag = model_tag
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'model_tag': self.model_tag,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _keys(self, features: np.ndarray, model_tag: str) -> list:
+        prefix = model_tag.encode('utf-8') + b'\0'
+        rows = np.ascontiguousarray(features, dtype=np.float32)
+        return [hashlib.blake2b(prefix + row.tobytes(), digest_size=16).digest() for row in rows]
+
+    def predict(self, features: np.ndarray, predict) -> np.ndarray:
+        # Predictions of the rows of the feature matrix, only the rows that are not cached are passed to 'predict'
+        model_tag = self.model_tag
+        keys = self._keys(features, model_tag)
+        predictions = [None] * len(keys)
+        missing = []
+        now = time.monotonic()
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] > now:
+                    self._entries.move_to_end(key)
+                    predictions[i] = entry[0]
+                else:
+                    missing.append(i)
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        if missing:
+            predicted = predict(features[missing])
+            with self._lock:
+                # Predictions of a model that was replaced in the meantime are not cached
+                if self.model_tag == model_tag:
+                    for i, prediction in zip(missing, predicted):
+                        self._entries[keys[i]] = (prediction, now + self.ttl)
+                        self._entries.move_to_end(keys[i])
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                        self.evictions += 1
+            for i, prediction in zip(missing, predicted):
+                predictions[i] = prediction
+        return np.asarray(predictions)
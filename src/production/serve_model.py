@@ -1,21 +1,149 @@
+import time
+# Start of the module import, the first phase of the startup timing
+IMPORT_START = time.perf_counter()
+
+import asyncio
+import os
+import threading
 import bentoml
 import bentoml.types
+import numpy as np
 import pandas as pd
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
 from typing import Annotated
 from bentoml.validators import DataframeSchema
 from bentoml.validators import ContentType
+from bentoml.exceptions import InvalidArgument, ServiceUnavailable
+from columnar import load_frame
+from data_schema import read_csv_columns
+from drift import DriftMonitor, FeatureSketch
+from batching import MicroBatcher
+from features import MODEL_COLUMNS, RawFeatureTransformer
+from forest import FlatForest
+from instrumentation import SamplingProfiler, record_cache_lookup, record_rows, stage
+from prediction_cache import PredictionCache
+from streaming import OUTPUT_MEDIA_TYPES, check_csv_columns, input_dtypes, score_csv_chunks, score_csv_chunks_async, serialize_chunks
+
+# Micro-batching of /predict_from_record: concurrent requests are merged into one predict call of at most
+# PREDICT_MAX_BATCH_SIZE rows, waiting at most PREDICT_MAX_WAIT_MS for a batch to fill up
+# Set PREDICT_BATCHING=0 to predict every request on its own
+PREDICT_BATCHING = os.environ.get("PREDICT_BATCHING", "1") == "1"
+PREDICT_MAX_BATCH_SIZE = int(os.environ.get("PREDICT_MAX_BATCH_SIZE", "64"))
+PREDICT_MAX_WAIT_MS = float(os.environ.get("PREDICT_MAX_WAIT_MS", "5"))
+# Threads serving the sync endpoints, BentoML serves them one at a time by default,
+# which would leave the batcher only one request to batch
+SERVICE_THREADS = int(os.environ.get("SERVICE_THREADS", "32"))
+SERVICE_WORKERS = int(os.environ.get("SERVICE_WORKERS", "1"))
+# Engine predicting the rows: "flat" uses the flattened forest (forest.py) for batches of at most FLAT_FOREST_MAX_ROWS
+# rows and the sklearn model for larger ones, "sklearn" always uses the sklearn model
+# The flattened forest is several times faster for small batches, the sklearn trees catch up at about a thousand rows
+PREDICT_ENGINE = os.environ.get("PREDICT_ENGINE", "flat")
+FLAT_FOREST_MAX_ROWS = int(os.environ.get("FLAT_FOREST_MAX_ROWS", "2048"))
+# Fast start: with PREDICT_ENGINE=flat the service starts from the memory-mappable forest written by store_model.py
+# (see forest.py), the pages of which are shared by all worker processes, and loads the pickled sklearn model
+# (and imports sklearn) in a background thread, large batches are predicted by the flattened forest until then
+MODEL_ARTIFACT_PATH = os.environ.get("MODEL_ARTIFACT_PATH", "hotel_booking_model_1.forest")
+# Encoding of the raw records for /predict_raw written by store_model.py, read from the BentoML model if the file is missing
+FEATURES_PATH = os.environ.get("FEATURES_PATH", "hotel_booking_model_1.features.json")
+# Cache of the predictions of /predict_from_record and /predict_raw, keyed by the model tag and the features of a row,
+# PREDICTION_CACHE_SIZE=0 turns it off
+# The file endpoints bypass it, hashing every row of a bulk upload costs more than it saves and evicts the hot rows
+PREDICTION_CACHE_SIZE = int(os.environ.get("PREDICTION_CACHE_SIZE", "100000"))
+PREDICTION_CACHE_TTL = float(os.environ.get("PREDICTION_CACHE_TTL", "3600"))
+# Seconds between the checks for a new version of the model in the BentoML model store, 0 turns the checks off
+# A new version is loaded in the background and replaces the served model (and empties the prediction cache)
+MODEL_RELOAD_INTERVAL = float(os.environ.get("MODEL_RELOAD_INTERVAL", "0"))
+# The sampling profiler of /profiler can only be started with PROFILER_ENABLED=1, it samples the stacks of all threads
+# every PROFILER_INTERVAL_MS milliseconds while it is running
+PROFILER_ENABLED = os.environ.get("PROFILER_ENABLED", "0") == "1"
+PROFILER_INTERVAL_MS = float(os.environ.get("PROFILER_INTERVAL_MS", "5"))
+# Rows scored at a time by /predict_from_file_stream and /predict_from_file_async
+PREDICT_FILE_CHUNK_ROWS = int(os.environ.get("PREDICT_FILE_CHUNK_ROWS", "10000"))
+# /predict_from_file_async parses the next chunk of an upload while the current one is predicted, in a pool of
+# FILE_INGEST_THREADS threads of its own, with at most FILE_QUEUE_CHUNKS parsed chunks waiting per upload
+# At most FILE_MAX_CONCURRENT uploads are scored at a time, the others wait without holding a thread, so uploads
+# never take the threads of the sync endpoints and leave CPU time for /predict_from_record
+FILE_INGEST_THREADS = int(os.environ.get("FILE_INGEST_THREADS", "2"))
+FILE_QUEUE_CHUNKS = int(os.environ.get("FILE_QUEUE_CHUNKS", "2"))
+FILE_MAX_CONCURRENT = int(os.environ.get("FILE_MAX_CONCURRENT", "1"))
+# Drift monitoring: the features of every predicted row are added to fixed-size histograms (see drift.py), which
+# /drift compares with the sketch of the training data written by store_model.py, read from the BentoML model if
+# the file is missing, DRIFT_MONITORING=0 turns it off
+DRIFT_MONITORING = os.environ.get("DRIFT_MONITORING", "1") == "1"
+DRIFT_STATISTICS_PATH = os.environ.get("DRIFT_STATISTICS_PATH", "hotel_booking_model_1.statistics.json")
 
 @bentoml.service(
     resources={"cpu": "2"},
     traffic={"timeout": 10},
+    threads=SERVICE_THREADS,
+    workers=SERVICE_WORKERS,
 )
 class ProductionService():
     def __init__(self):
+        init_start = time.perf_counter()
+        self.startup_timings = {"import": init_start - IMPORT_START}
+        self.model = None
+        self.model_tag = ""
+        self.forest = None
+        self.cache = PredictionCache(PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL) if PREDICTION_CACHE_SIZE > 0 else None
+        if PREDICT_ENGINE == "flat" and os.path.isdir(MODEL_ARTIFACT_PATH):
+            self.forest = FlatForest.load(MODEL_ARTIFACT_PATH)
+            self._set_model_tag(self.forest.tag)
+            self.startup_timings["load_forest"] = time.perf_counter() - init_start
+            threading.Thread(target=self._load_model, name="model-loader", daemon=True).start()
+        else:
+            self._load_model()
+            self.startup_timings["load_model"] = time.perf_counter() - init_start
+        self.transformer = self._load_transformer()
+        self.drift_monitor = self._load_drift_monitor() if DRIFT_MONITORING else None
+        self.sampling_profiler = SamplingProfiler(PROFILER_INTERVAL_MS) if PROFILER_ENABLED else None
+        self.batcher = MicroBatcher(self._predict, PREDICT_MAX_BATCH_SIZE, PREDICT_MAX_WAIT_MS) if PREDICT_BATCHING else None
+        self.ingest_executor = ThreadPoolExecutor(FILE_INGEST_THREADS, thread_name_prefix="file-ingest")
+        self.ingest_slots = asyncio.Semaphore(FILE_MAX_CONCURRENT)
+        if MODEL_RELOAD_INTERVAL > 0:
+            threading.Thread(target=self._watch_model, name="model-watcher", daemon=True).start()
+        self.startup_timings["total"] = time.perf_counter() - IMPORT_START
+        print("Startup " + ", ".join(f"{phase}: {seconds:.3f} s" for phase, seconds in self.startup_timings.items()))
+    
+    def _load_model(self):
+        start = time.perf_counter()
         try:
-            self.model = bentoml.sklearn.load_model("hotel_booking_model_1")
+            bento_model = bentoml.sklearn.get("hotel_booking_model_1")
+            model = bentoml.sklearn.load_model(bento_model)
         except Exception as e:
-            self.model = bentoml.models.import_model("./hotel_booking_model_1.bentomodel").to_runner()
+            bento_model = bentoml.models.import_model("./hotel_booking_model_1.bentomodel")
+            model = bento_model.to_runner()
+        tag = str(bento_model.tag)
+        # The forest is flattened again when there is none yet or it was flattened from another version of the model
+        # The model imported as a runner has no trees to flatten
+        forest = self.forest
+        if PREDICT_ENGINE == "flat" and hasattr(model, "estimators_") and (forest is None or forest.tag != tag):
+            flatten_start = time.perf_counter()
+            forest = FlatForest.from_sklearn(model, tag)
+            self.startup_timings["flatten"] = time.perf_counter() - flatten_start
+        background = self.forest is not None
+        self.model = model
+        self.forest = forest
+        self._set_model_tag(tag)
+        if background:
+            print(f"Model {tag} loaded in the background in {time.perf_counter() - start:.3f} s")
+    
+    def _set_model_tag(self, tag):
+        self.model_tag = tag
+        if self.cache is not None:
+            self.cache.set_model_tag(tag)
+    
+    def _watch_model(self):
+        while True:
+            time.sleep(MODEL_RELOAD_INTERVAL)
+            try:
+                latest_tag = str(bentoml.models.get("hotel_booking_model_1:latest").tag)
+                if self.model is not None and latest_tag != self.model_tag:
+                    self._load_model()
+            except Exception as e:
+                print(f"Checking for a new model version failed: {e}")
     
     @bentoml.api(route="/predict_from_record")
     def predict_record(
@@ -24,65 +152,224 @@ class ProductionService():
             pd.DataFrame, 
             DataframeSchema(
                 orient="records",
-                columns=[
-                    'lead_time',
-                    'avg_price_per_room',
-                    'arrival_date',
-                    'arrival_month',
-                    'no_of_special_requests_1',
-                    'no_of_special_requests_2+',
-                    'market_segment_type_Online',
-                    'no_of_weekend_nights_1',
-                    'no_of_weekend_nights_2',
-                    'type_of_meal_plan_Not Selected',
-                    'room_type_reserved_Room_Type 5',
-                    'no_of_week_nights_3',
-                    'arrival_year',
-                    'type_of_meal_plan_Meal Plan 2',
-                    'no_of_adults',
-                    'room_type_reserved_Room_Type 6',
-                    'room_type_reserved_Room_Type 4'
-                ]
+                columns=MODEL_COLUMNS
             )]
-        ) -> int:
-        return self.model.predict(input)
+        ) -> np.ndarray:
+        endpoint = "predict_from_record"
+        record_rows(endpoint, len(input))
+        with stage(endpoint, "select_columns"):
+            features = self._feature_matrix(input)
+        with stage(endpoint, "predict"):
+            predict = self.batcher.submit if self.batcher is not None else self._predict
+            return self._predict_cached(features, predict)
+
+    @bentoml.api(route="/predict_raw")
+    def predict_raw(self, input: list[dict]) -> np.ndarray:
+        # Raw booking records with the fields of data/raw/hotel_reservations.csv, encoded by the transformer saved with the model
+        endpoint = "predict_raw"
+        if self.transformer is None:
+            raise ServiceUnavailable("The model has no feature transformer, store it again with store_model.py")
+        record_rows(endpoint, len(input))
+        if self.drift_monitor is not None:
+            with stage("drift", "update_records"):
+                self.drift_monitor.update_records(input)
+        try:
+            with stage(endpoint, "encode"):
+                features = self.transformer.transform(input)
+        except ValueError as e:
+            raise InvalidArgument(str(e))
+        with stage(endpoint, "predict"):
+            return self._predict_cached(features, self._predict)
 
     @bentoml.api(route="/predict_from_file")
     def predict_file(self, file: Annotated[Path, ContentType("text/csv")]):
-        input_df = pd.read_csv(file)
+        endpoint = "predict_from_file"
+        try:
+            with stage(endpoint, "parse"):
+                # Only the model columns are parsed, the target and the other columns are skipped by the parser
+                columns = self._model_columns()
+                check_csv_columns(str(file), columns)
+                input_df = read_csv_columns(str(file), columns, input_dtypes(columns))
+            record_rows(endpoint, len(input_df))
+            with stage(endpoint, "select_columns"):
+                features = self._feature_matrix(input_df)
+            self._observe(features)
+            with stage(endpoint, "predict"):
+                prediction = self._predict(features)
+            with stage(endpoint, "serialize"):
+                serialized_prediction = prediction.tolist()  # Serialize ndarray to nested list
+            return {"prediction": serialized_prediction}
+        except Exception as e:
+            # Counted in the errors of the stage it was raised in, see /metrics
+            print(f"{endpoint} failed: {e!r}")
+            return {"error": str(e)}
+    
+    @bentoml.api(route="/predict_from_file_async")
+    async def predict_file_async(self, file: Annotated[Path, ContentType("text/csv")]):
+        # Same response as /predict_from_file, the file is parsed and predicted chunk by chunk in the ingest threads
+        # while the event loop keeps serving the other requests
+        endpoint = "predict_from_file_async"
+        
+        def predict(input_df):
+            record_rows(endpoint, len(input_df))
+            features = self._feature_matrix(input_df)
+            self._observe(features)
+            return self._predict(features)
         
-        # Drop the target column if it exists
-        if "booking_status" in input_df.columns:
-            input_df = input_df.drop("booking_status", axis=1)
+        def timed(name):
+            return stage(endpoint, name)
         
-        # Drop columns that are not used
         try:
-            input_df = self._drop_unused_columns(input_df)
-            prediction = self.model.predict(input_df)
-            serialized_prediction = prediction.tolist()  # Serialize ndarray to nested list
+            with stage(endpoint, "wait"):
+                await self.ingest_slots.acquire()
+            try:
+                chunks = score_csv_chunks_async(str(file), predict, self._model_columns(), self.ingest_executor, PREDICT_FILE_CHUNK_ROWS, FILE_QUEUE_CHUNKS, timed)
+                async with aclosing(chunks):
+                    predictions = [prediction async for prediction in chunks]
+            finally:
+                self.ingest_slots.release()
+            with stage(endpoint, "serialize"):
+                serialized_prediction = np.concatenate(predictions).tolist() if predictions else []
             return {"prediction": serialized_prediction}
+        except Exception as e:
+            print(f"{endpoint} failed: {e!r}")
+            return {"error": str(e)}
+    
+    @bentoml.api(route="/prediction_cache")
+    def prediction_cache(self) -> dict:
+        # Size and hit/miss counters of the prediction cache
+        return self.cache.stats() if self.cache is not None else {"enabled": False}
+    
+    @bentoml.api(route="/predict_from_file_stream")
+    def predict_file_stream(self, file: Annotated[Path, ContentType("text/csv")], output_format: str = "ndjson"):
+        # Scores the file chunk by chunk and streams the predictions back as NDJSON or CSV lines of (Booking_ID, prediction)
+        # The response starts with the first chunk, so large files are not cut off by the traffic timeout
+        try:
+            if output_format not in OUTPUT_MEDIA_TYPES:
+                raise ValueError(f"Unknown output format '{output_format}', expected one of {list(OUTPUT_MEDIA_TYPES)}")
+            # The header is checked before the response starts, so missing columns are still reported as an error
+            check_csv_columns(str(file), self._model_columns())
         except Exception as e:
             return {"error": str(e)}
+        endpoint = "predict_from_file_stream"
+        
+        def predict(input_df):
+            record_rows(endpoint, len(input_df))
+            features = self._feature_matrix(input_df)
+            self._observe(features)
+            return self._predict(features)
+        
+        def timed(name):
+            return stage(endpoint, name)
+        
+        chunks = score_csv_chunks(str(file), predict, self._model_columns(), PREDICT_FILE_CHUNK_ROWS, timed)
+        from starlette.responses import StreamingResponse
+
+        return StreamingResponse(serialize_chunks(chunks, output_format, timed), media_type=OUTPUT_MEDIA_TYPES[output_format])
+    
+    @bentoml.api(route="/predict_from_columnar_file")
+    def predict_columnar_file(self, file: Annotated[Path, ContentType("application/*")]):
+        # Parquet or Feather (Arrow IPC) file, only the model columns are read (memory-mapped)
+        endpoint = "predict_from_columnar_file"
+        try:
+            with stage(endpoint, "parse"):
+                input_df = load_frame(str(file), columns=self._model_columns())
+            record_rows(endpoint, len(input_df))
+            with stage(endpoint, "select_columns"):
+                features = self._feature_matrix(input_df)
+            self._observe(features)
+            with stage(endpoint, "predict"):
+                prediction = self._predict(features)
+            with stage(endpoint, "serialize"):
+                serialized_prediction = prediction.tolist()  # Serialize ndarray to nested list
+            return {"prediction": serialized_prediction}
+        except Exception as e:
+            print(f"{endpoint} failed: {e!r}")
+            return {"error": str(e)}
+    
+    @bentoml.api(route="/profiler")
+    def profiler(self, action: str = "report", top: int = 50) -> dict:
+        # Starts, stops or resets the sampling profiler, every action reports the 'top' most frequent stacks
+        if self.sampling_profiler is None:
+            raise ServiceUnavailable("The profiler is disabled, start the service with PROFILER_ENABLED=1")
+        if action == "start":
+            self.sampling_profiler.start()
+        elif action == "stop":
+            self.sampling_profiler.stop()
+        elif action == "reset":
+            self.sampling_profiler.reset()
+        elif action != "report":
+            raise InvalidArgument(f"Unknown action '{action}', expected one of ['start', 'stop', 'reset', 'report']")
+        return self.sampling_profiler.report(top)
+    
+    @bentoml.api(route="/drift")
+    def drift(self, reset: bool = False) -> dict:
+        # Drift of the rows predicted since the start (or the last reset) from the training data, per model column,
+        # and the rows and raw categories violating the assumptions of the data preparation, reset=true starts over
+        if self.drift_monitor is None:
+            raise ServiceUnavailable("Drift monitoring is off (DRIFT_MONITORING=0) or the model has no training statistics, store it again with store_model.py")
+        accepted_categories = self.transformer.spec["categories"] if self.transformer is not None else None
+        return dict({"model_tag": self.model_tag}, **self.drift_monitor.report(accepted_categories, reset))
+    
+    def _load_transformer(self):
+        if os.path.exists(FEATURES_PATH):
+            return RawFeatureTransformer.load(FEATURES_PATH)
+        try:
+            spec = bentoml.models.get("hotel_booking_model_1").custom_objects.get("feature_transformer")
+        except Exception as e:
+            spec = None
+        return RawFeatureTransformer.from_dict(spec) if spec is not None else None
+    
+    def _load_drift_monitor(self):
+        if os.path.exists(DRIFT_STATISTICS_PATH):
+            return DriftMonitor(FeatureSketch.load(DRIFT_STATISTICS_PATH))
+        try:
+            statistics = bentoml.models.get("hotel_booking_model_1").custom_objects.get("training_statistics")
+        except Exception as e:
+            statistics = None
+        return DriftMonitor(FeatureSketch.from_dict(statistics)) if statistics is not None else None
+    
+    def _observe(self, features):
+        # Adds the rows to the drift sketches, every predicted row including the ones answered from the cache
+        if self.drift_monitor is not None:
+            with stage("drift", "update"):
+                self.drift_monitor.update(features)
+    
+    def _feature_matrix(self, input_df):
+        return np.ascontiguousarray(input_df[MODEL_COLUMNS], dtype=np.float32)
+    
+    def _predict_cached(self, features, predict):
+        self._observe(features)
+        if self.cache is None:
+            return predict(features)
+        n_missed = []
+        
+        def predict_missed(missed_features):
+            n_missed.append(len(missed_features))
+            return predict(missed_features)
+        
+        prediction = self.cache.predict(features, predict_missed)
+        record_cache_lookup(len(features), sum(n_missed))
+        return prediction
+    
+    def _predict(self, input_df):
+        # The rows and the duration of every batch are recorded per engine, this is the time spent in the trees
+        model = self.model
+        start = time.perf_counter()
+        if self.forest is not None and (model is None or len(input_df) <= FLAT_FOREST_MAX_ROWS):
+            engine = "engine_flat"
+            with stage(engine, "predict"):
+                prediction = self.forest.predict(input_df)
+        else:
+            engine = "engine_sklearn"
+            if isinstance(input_df, np.ndarray):
+                # Feature matrix of the transformer, the model checks the column names
+                input_df = pd.DataFrame(input_df, columns=MODEL_COLUMNS)
+            with stage(engine, "predict"):
+                prediction = model.predict(input_df)
+        record_rows(engine, len(input_df), time.perf_counter() - start)
+        return prediction
     
-    def _drop_unused_columns(self, input_df):
-        columns_to_preserve = [
-            'lead_time',
-            'avg_price_per_room',
-            'arrival_date',
-            'arrival_month',
-            'no_of_special_requests_1',
-            'no_of_special_requests_2+',
-            'market_segment_type_Online',
-            'no_of_weekend_nights_1',
-            'no_of_weekend_nights_2',
-            'type_of_meal_plan_Not Selected',
-            'room_type_reserved_Room_Type 5',
-            'no_of_week_nights_3',
-            'arrival_year',
-            'type_of_meal_plan_Meal Plan 2',
-            'no_of_adults',
-            'room_type_reserved_Room_Type 6',
-            'room_type_reserved_Room_Type 4'
-        ]
-        return input_df[columns_to_preserve]
+    def _model_columns(self):
+        return MODEL_COLUMNS
         
\ No newline at end of file
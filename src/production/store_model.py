@@ -1,70 +1,159 @@
-import pandas as pd
-
-data = pd.read_csv('train.csv')
-X = data.drop('booking_status', axis=1)
-columns_to_preserve = [
-            'lead_time',
-            'avg_price_per_room',
-            'arrival_date',
-            'arrival_month',
-            'no_of_special_requests_1',
-            'no_of_special_requests_2+',
-            'market_segment_type_Online',
-            'no_of_weekend_nights_1',
-            'no_of_weekend_nights_2',
-            'type_of_meal_plan_Not Selected',
-            'room_type_reserved_Room_Type 5',
-            'no_of_week_nights_3',
-            'arrival_year',
-            'type_of_meal_plan_Meal Plan 2',
-            'no_of_adults',
-            'room_type_reserved_Room_Type 6',
-            'room_type_reserved_Room_Type 4'
-        ]
-X = X[columns_to_preserve]
-y = data['booking_status']
-
-X.shape, y.shape
+import argparse
+import json
+import os
+import sys
+import time
 
 from sklearn.ensemble import RandomForestClassifier
 
-model = RandomForestClassifier(
-    n_estimators=100,                   # Number of trees in the forest
-    criterion='gini',                   # Function to measure the quality of a split
-    max_depth=None,                     # Maximum depth of the tree
-    min_samples_split=2,                # Minimum number of samples required to split an internal node
-    min_samples_leaf=1,                 # Minimum number of samples required to be at a leaf node
-    min_weight_fraction_leaf=0.0,       # Minimum weighted fraction of the sum total of weights
-    max_features='sqrt',                # Number of features to consider when looking for the best split
-    max_leaf_nodes=None,                # Grow trees with max_leaf_nodes in best-first fashion
-    min_impurity_decrease=0.0,          # A node will be split if this split induces a decrease of the impurity greater than or equal to this value
-    bootstrap=True,                     # Whether bootstrap samples are used when building trees
-    oob_score=False,                    # Whether to use out-of-bag samples to estimate the generalization accuracy
-    n_jobs=None,                        # The number of jobs to run in parallel
-    random_state=42,                    # Seed of the pseudo random number generator
-    verbose=1,                          # Controls the verbosity when fitting and predicting
-    warm_start=False,                   # When set to True, reuse the solution of the previous call to fit and add more estimators to the ensemble
-    class_weight=None,                  # Weights associated with classes in the form {class_label: weight}
-    ccp_alpha=0.0,                      # Complexity parameter used for Minimal Cost-Complexity Pruning
-    max_samples=None                    # If bootstrap is True, the number of samples to draw from X to train each base estimator
-)
-
-model.fit(X, y)
-
-import bentoml
-
-try:
-    bentoml.sklearn.save_model(
-        name="hotel_booking_model_1",
-        model=model
-    )
-except Exception as e:
-    print(e)
-    
-try:
-    bentoml.models.export_model(
-        tag="hotel_booking_model_1:latest",
-        path="hotel_booking_model_1"
+from columnar import load_frame
+from features import MODEL_COLUMNS, RawFeatureTransformer
+
+# The encoding of the raw records is taken from the data preparation script in src/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from data_preparation import MAX_PRICE_PER_ROOM, feature_spec
+
+# The training data can be a CSV, Parquet or Feather file, e.g. python store_model.py train.feather
+# The hyperparameters of the forest can be searched first, with the folds fitted on all cores:
+# python store_model.py train.feather --search [--candidates 27] [--max-latency-ms 20]
+# The models of the notebooks can be compared on the same folds without storing a model:
+# python store_model.py train.feather --compare-models
+SEARCH_REPORT_PATH = 'hotel_booking_model_1.search.json'
+
+def make_model(n_jobs: int = -1) -> RandomForestClassifier:
+    return RandomForestClassifier(
+        n_estimators=100,                   # Number of trees in the forest
+        criterion='gini',                   # Function to measure the quality of a split
+        max_depth=None,                     # Maximum depth of the tree
+        min_samples_split=2,                # Minimum number of samples required to split an internal node
+        min_samples_leaf=1,                 # Minimum number of samples required to be at a leaf node
+        min_weight_fraction_leaf=0.0,       # Minimum weighted fraction of the sum total of weights
+        max_features='sqrt',                # Number of features to consider when looking for the best split
+        max_leaf_nodes=None,                # Grow trees with max_leaf_nodes in best-first fashion
+        min_impurity_decrease=0.0,          # A node will be split if this split induces a decrease of the impurity greater than or equal to this value
+        bootstrap=True,                     # Whether bootstrap samples are used when building trees
+        oob_score=False,                    # Whether to use out-of-bag samples to estimate the generalization accuracy
+        n_jobs=n_jobs,                      # The number of jobs to run in parallel, -1 uses all cores
+        random_state=42,                    # Seed of the pseudo random number generator
+        verbose=0,                          # Controls the verbosity when fitting and predicting
+        warm_start=False,                   # When set to True, reuse the solution of the previous call to fit and add more estimators to the ensemble
+        class_weight=None,                  # Weights associated with classes in the form {class_label: weight}
+        ccp_alpha=0.0,                      # Complexity parameter used for Minimal Cost-Complexity Pruning
+        max_samples=None                    # If bootstrap is True, the number of samples to draw from X to train each base estimator
     )
-except Exception as e:
-    print(e)
\ No newline at end of file
+
+def notebook_models() -> dict:
+    # The models compared in the notebooks (05_*.ipynb) with their parameters, XGBoost only if it is installed
+    # TPOT is left out, it is a search over pipelines itself
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.neighbors import KNeighborsClassifier
+    from sklearn.neural_network import MLPClassifier
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    models = {
+        'logistic_regression': LogisticRegression(C=1.0, solver='lbfgs', max_iter=1000, random_state=42),
+        'knn': make_pipeline(StandardScaler(), KNeighborsClassifier(n_neighbors=5)),
+        'mlp': make_pipeline(StandardScaler(), MLPClassifier(hidden_layer_sizes=(100, 100, 100), max_iter=1000, random_state=42)),
+        'random_forest': make_model(n_jobs=1),
+    }
+    try:
+        from xgboost import XGBClassifier
+        models['xgboost'] = XGBClassifier(max_depth=3, learning_rate=0.1, n_estimators=100, n_jobs=1, random_state=42)
+    except ImportError:
+        print("\033[1;33mxgboost is not installed, the XGBoost model is not compared\033[0m")
+    return models
+
+def search(X, y, args) -> dict:
+    from model_search import default_cache, fold_splits, print_results, sample_candidates, select_best, successive_halving, RF_PARAMETER_SPACE
+
+    folds = fold_splits(X, y, args.folds, cache=default_cache())
+    candidates = sample_candidates(RF_PARAMETER_SPACE, args.candidates)
+    print("\033[1;32mSearching {} candidates on {} folds with {} workers...\033[0m".format(len(candidates), len(folds), args.workers or os.cpu_count()))
+    # Every fit uses one core, the candidates and folds are fitted in parallel
+    results = successive_halving(make_model(n_jobs=1), candidates, X, y, folds, args.factor, args.workers)
+    last_rung = max(result['rung'] for result in results)
+    print_results([result for result in results if result['rung'] == last_rung], lambda result: ' '.join('{}={}'.format(name, value) for name, value in result['params'].items()))
+    best = select_best(results, args.max_latency_ms, args.max_size_mb)
+    print("\033[1;32mBest hyperparameters: {}\033[0m".format(best['params']))
+    with open(SEARCH_REPORT_PATH, 'w') as file:
+        json.dump({'best': best, 'results': results}, file, indent=2)
+    return best
+
+def compare(X, y, args) -> None:
+    from model_search import compare_models, default_cache, fold_splits, print_results
+
+    folds = fold_splits(X, y, args.folds, cache=default_cache())
+    results = compare_models(notebook_models(), X, y, folds, args.workers)
+    print_results(results, lambda result: result['model'])
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Train and store the hotel booking model')
+    parser.add_argument('train_file', nargs='?', default='train.csv', help='Training data (CSV, Parquet or Feather)')
+    parser.add_argument('--search', action='store_true', help='Search the hyperparameters of the forest before training it')
+    parser.add_argument('--compare-models', action='store_true', help='Compare the models of the notebooks and exit')
+    parser.add_argument('--candidates', type=int, default=27, help='Number of hyperparameter combinations searched')
+    parser.add_argument('--factor', type=int, default=3, help='Successive halving keeps 1/factor of the candidates at every rung')
+    parser.add_argument('--folds', type=int, default=5, help='Number of cross-validation folds')
+    parser.add_argument('--workers', type=int, default=None, help='Processes fitting the folds (default all cores)')
+    parser.add_argument('--max-latency-ms', type=float, default=None, help='Only select forests predicting one row within this latency')
+    parser.add_argument('--max-size-mb', type=float, default=None, help='Only select forests with a pickled size within this limit')
+    args = parser.parse_args()
+
+    data = load_frame(args.train_file)
+    X = data.drop('booking_status', axis=1)
+    X = X[MODEL_COLUMNS]
+    y = data['booking_status']
+
+    if args.compare_models:
+        compare(X, y, args)
+        return
+
+    model = make_model()
+    metadata = {}
+    if args.search:
+        best = search(X, y, args)
+        model.set_params(**best['params'])
+        metadata = {name: best[name] for name in ['accuracy', 'f1', 'fit_time', 'predict_latency_ms', 'model_size_mb']}
+        metadata['params'] = json.dumps(best['params'])
+
+    start = time.perf_counter()
+    model.fit(X, y)
+    print("\033[1;32mModel fitted on {} rows in {:.2f} s\033[0m".format(len(X), time.perf_counter() - start))
+    # The forest is fitted on all cores but stored with the n_jobs of the baseline, so a prediction of the served
+    # model runs on one thread as in the latency measured by the search
+    model.set_params(n_jobs=None)
+
+    import bentoml
+
+    from drift import FeatureSketch
+    from forest import FlatForest
+
+    try:
+        # Encoding of the raw records into the model columns, used by the /predict_raw endpoint of serve_model.py
+        transformer = RawFeatureTransformer(feature_spec(MODEL_COLUMNS))
+        # Histograms of the training data, the drift of the served rows is measured against them by /drift
+        statistics = FeatureSketch.from_data(MODEL_COLUMNS, X, max_price=MAX_PRICE_PER_ROOM)
+        saved_model = bentoml.sklearn.save_model(
+            name="hotel_booking_model_1",
+            model=model,
+            custom_objects={"feature_transformer": transformer.to_dict(), "training_statistics": statistics.to_dict()},
+            metadata=metadata
+        )
+        transformer.save("hotel_booking_model_1.features.json")
+        statistics.save("hotel_booking_model_1.statistics.json")
+        # Memory-mappable copy of the forest, loaded by serve_model.py instead of the pickled model on startup
+        FlatForest.from_sklearn(model, str(saved_model.tag)).save("hotel_booking_model_1.forest")
+    except Exception as e:
+        print(e)
+
+    try:
+        bentoml.models.export_model(
+            tag="hotel_booking_model_1:latest",
+            path="hotel_booking_model_1"
+        )
+    except Exception as e:
+        print(e)
+
+if __name__ == '__main__':
+    main()
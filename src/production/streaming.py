@@ -0,0 +1,124 @@
+### Description
+# Chunked scoring of large CSV uploads for the /predict_from_file_stream endpoint of the production service.
+# The file is read in chunks of 'chunk_rows' rows, only the model columns (as float32, see data_schema.py) and the
+# optional 'Booking_ID' column are parsed, every chunk is predicted on its own and the predictions are serialized
+# as NDJSON or CSV lines right away, so the memory of the service stays flat regardless of the size of the file.
+# Rows without a 'Booking_ID' column are identified by their row number in the file (starting from 0).
+# The stages of every chunk are timed by 'timed', a function returning a context manager for the name of a stage.
+# score_csv_chunks_async is the variant for async endpoints: the chunks are parsed and predicted in a thread pool,
+# with the next chunks parsed while the current one is predicted, and at most 'max_queued_chunks' parsed chunks
+# waiting for the prediction, so the memory of an upload stays bounded when parsing is faster than predicting.
+# Copyright (c) 2024
+# Uvod u nauku o podacima, Prirodno-matematicki fakultet, Univerzitet u Kragujevcu
+# Authors: Radovan Draskovic, Marija Jolovic
+# Project: Predstavljanje i tumacenje skupa podataka Hotel Reservations
+
+import asyncio
+import threading
+from contextlib import nullcontext
+
+import pandas as pd
+
+from data_schema import MODEL_INPUT_DTYPE, RAW_DTYPES, read_csv_columns
+
+ID_COLUMN = 'Booking_ID'
+ROW_COLUMN = 'row'
+PREDICTION_COLUMN = 'prediction'
+
+OUTPUT_MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+def check_csv_columns(file_path: str, columns: list) -> str:
+    # Reads only the header, returns the name of the column identifying the rows in the output
+    # and raises ValueError if a model column is missing
+    header = pd.read_csv(file_path, nrows=0).columns
+    missing = [column for column in columns if column not in header]
+    if missing:
+        raise ValueError("Missing columns {}".format(missing))
+    return ID_COLUMN if ID_COLUMN in header else ROW_COLUMN
+
+def input_dtypes(columns: list) -> dict:
+    # Types the columns of an upload are parsed as, the model columns as the type the model predicts on
+    return dict({column: MODEL_INPUT_DTYPE for column in columns}, **{ID_COLUMN: RAW_DTYPES[ID_COLUMN]})
+
+def untimed(name: str):
+    return nullcontext()
+
+def score_csv_chunks(file_path: str, predict, columns: list, chunk_rows: int = 10000, timed=untimed):
+    # Yields a frame of (id, prediction) for every chunk of the file
+    id_column = check_csv_columns(file_path, columns)
+    usecols = columns + [ID_COLUMN] if id_column == ID_COLUMN else columns
+    reader = read_csv_columns(file_path, usecols, input_dtypes(columns), chunk_rows)
+    try:
+        while True:
+            with timed('parse'):
+                chunk = next(reader, None)
+            if chunk is None:
+                break
+            with timed('select_columns'):
+                ids = chunk[ID_COLUMN].to_numpy() if id_column == ID_COLUMN else chunk.index.to_numpy()
+                features = chunk[columns]
+            with timed('predict'):
+                predictions = predict(features)
+            yield pd.DataFrame({id_column: ids, PREDICTION_COLUMN: predictions})
+    finally:
+        reader.close()
+
+async def score_csv_chunks_async(file_path: str, predict, columns: list, executor, chunk_rows: int = 10000, max_queued_chunks: int = 2, timed=untimed):
+    # Yields the predictions of every chunk of the file, in the order of the file
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(executor, check_csv_columns, file_path, columns)
+    reader = read_csv_columns(file_path, columns, input_dtypes(columns), chunk_rows)
+    queue = asyncio.Queue(maxsize=max_queued_chunks)
+    # The reader is closed by another thread than the one parsing, the lock waits for a parse that is still running
+    reader_lock = threading.Lock()
+
+    def parse():
+        with timed('parse'), reader_lock:
+            return next(reader, None)
+
+    def close():
+        with reader_lock:
+            reader.close()
+
+    def select_and_predict(chunk):
+        with timed('predict'):
+            return predict(chunk[columns])
+
+    async def produce():
+        # Puts the parsed chunks, then None at the end of the file or the exception parsing failed with
+        try:
+            while True:
+                chunk = await loop.run_in_executor(executor, parse)
+                await queue.put(chunk)
+                if chunk is None:
+                    return
+        except Exception as e:
+            await queue.put(e)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield await loop.run_in_executor(executor, select_and_predict, chunk)
+    finally:
+        producer.cancel()
+        await loop.run_in_executor(executor, close)
+
+def serialize_chunks(chunks, output_format: str = 'ndjson', timed=untimed):
+    # Yields the text of every chunk, the CSV header is written with the first chunk
+    if output_format not in OUTPUT_MEDIA_TYPES:
+        raise ValueError("Unknown output format '{}', expected one of {}".format(output_format, list(OUTPUT_MEDIA_TYPES)))
+    for i, chunk in enumerate(chunks):
+        with timed('serialize'):
+            if output_format == 'ndjson':
+                text = chunk.to_json(orient='records', lines=True)
+            else:
+                text = chunk.to_csv(index=False, header=(i == 0))
+        yield text
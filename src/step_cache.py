@@ -0,0 +1,88 @@
+### Description
+# Content-addressed on-disk cache for the stages of the data preparation pipeline.
+# Every stage output is stored as a pickle file named after the stage and a key. The key is a hash of the
+# stage parameters and the keys of the stages it depends on, and the key of the first stage is a hash of
+# the raw file contents, so a key changes whenever the data or the parameters the output was computed from change.
+# Entries are evicted in least recently used order once the total size of the cache exceeds its limit.
+# Copyright (c) 2024
+# Uvod u nauku o podacima, Prirodno-matematicki fakultet, Univerzitet u Kragujevcu
+# Authors: Radovan Draskovic, Marija Jolovic
+# Project: Predstavljanje i tumacenje skupa podataka Hotel Reservations
+
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+ENTRY_EXTENSION = '.pkl'
+
+def hash_file(file_path: str, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def hash_parts(*parts) -> str:
+    # The parts have to be JSON serializable (strings, numbers, lists, dicts), dicts are hashed with sorted keys
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+class StepCache():
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, stage: str, key: str) -> str:
+        return os.path.join(self.directory, '{}-{}{}'.format(stage, key, ENTRY_EXTENSION))
+
+    def get(self, stage: str, key: str):
+        # Returns None when there is no entry for the key
+        path = self._path(stage, key)
+        try:
+            with open(path, 'rb') as file:
+                value = pickle.load(file)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        # The modification time marks the last use of the entry for the LRU eviction
+        os.utime(path)
+        self.hits += 1
+        return value
+
+    def put(self, stage: str, key: str, value) -> None:
+        # Written to a temporary file first, so that an interrupted run never leaves a truncated entry
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(descriptor, 'wb') as file:
+            pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, self._path(stage, key))
+        self.evict()
+
+    def entries(self) -> list:
+        # (last use, size, path) of every entry, least recently used first
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(ENTRY_EXTENSION):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(self.directory, name)))
+        return sorted(entries)
+
+    def evict(self) -> list:
+        entries = self.entries()
+        total_bytes = sum(size for _, size, _ in entries)
+        evicted = []
+        # The most recently used entry is always kept, even when it alone exceeds the limit
+        for _, size, path in entries[:-1]:
+            if total_bytes <= self.max_bytes:
+                break
+            os.remove(path)
+            total_bytes -= size
+            evicted.append(path)
+        return evicted
+
+    def clear(self) -> None:
+        for _, _, path in self.entries():
+            os.remove(path)